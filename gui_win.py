@@ -3,7 +3,7 @@ from tkinter import ttk, filedialog
 # from tkinter import scrolledtext  # removed old output pane
 from pathlib import Path
 from datetime import datetime
-import os, sys, json, calendar, locale, subprocess
+import os, sys, json, calendar, locale, subprocess, threading, queue
 from typing import Literal, Optional, Any, Callable
 try:
     import winreg  # type: ignore
@@ -315,31 +315,36 @@ def run_convert(pdf_path: str, monday_date: str) -> str:
     except Exception:
         return "Error: Monday date must be YYYY-MM-DD."
 
-    tables = app.extract_tables(str(pdf), strategy="lines")
+    # Open the PDF once and share it across table, name and term extraction
+    doc = app.TimetableDocument(str(pdf))
+    tables = app.extract_tables(doc, strategy="lines")
     result = app.merge_main_table(tables, collapse_newlines=False)
     if not result or not result[0]:
+        doc.close()
         return "Error: Could not detect timetable header."
     headers, rows, meta, _notes, is_chinese = result
     rows = app.merge_continuation_rows(headers, rows)
-    app.set_active_type_map(use_chinese=is_chinese)
-    courses = app.extract_courses_from_table(headers, rows, preserve_newlines=True)
-    courses += app.extract_outside_courses(meta)
+    ctx = app.parse_context(is_chinese)
+    courses = app.extract_courses_from_table(headers, rows, preserve_newlines=True, ctx=ctx)
+    courses += app.extract_outside_courses(meta, ctx)
     try:
         app._backfill_teachers(courses)
     except Exception:
         pass
     if not courses:
+        doc.close()
         return "Error: No courses detected."
 
     # Prefer content-based student name + term for ICS filename
     try:
-        ics_out, cal_name = app.compute_ics_output_path(str(pdf), meta, monday_date)
+        ics_out, cal_name = app.compute_ics_output_path(doc, meta, monday_date)
         ics_output = Path(ics_out)
     except Exception:
         pdf_dir = pdf.resolve().parent
         pdf_stem = pdf.stem
         ics_output = pdf_dir / f"{pdf_stem.replace(' ', '_')}.ics"
         cal_name = pdf_stem.replace("课表", "").strip() or pdf_stem
+    doc.close()
     cal_desc = f"Generated timetable starting Monday {monday_date}"
 
     # Always generate and return a detailed summary for GUI output and terminal
@@ -508,6 +513,10 @@ class App(ttk.Frame):
         self.var_term = tk.StringVar(value="")
         self.lbl_term = ttk.Label(grp, textvariable=self.var_term)
         self.lbl_term.grid(row=1, column=3, sticky="e")
+        # Indeterminate progress bar, shown only while a background job runs
+        self.progress = ttk.Progressbar(grp, mode="indeterminate")
+        self.progress.grid(row=2, column=0, columnspan=4, sticky="we", pady=(2, 0))
+        self.progress.grid_remove()
         # Hidden Monday-of-week-1 storage (only set programmatically)
         self.var_date = tk.StringVar(value="")
 
@@ -567,7 +576,16 @@ class App(ttk.Frame):
         self._last_is_chinese = False
         self._last_term = None
         self._asked_for_monday_term = None
-        self._last_meta = None
+        self._table_cache = None
+        # Analysis snapshots keyed by (path, size, mtime); re-dropping an unchanged PDF reuses them
+        self._analyses: dict[tuple, dict] = {}
+        self._analysis: Optional[dict] = None
+        # Set when Generate found a stale snapshot: generate once the re-analysis lands
+        self._generate_when_analyzed = False
+        # Background jobs: (cancel event, on_done) of the current job; workers post results here
+        self._job = None
+        self._job_results: "queue.Queue[tuple]" = queue.Queue()
+        self._polling = False
 
     # Styling
     def _apply_styles(self):
@@ -735,26 +753,101 @@ class App(ttk.Frame):
             self._last_ics = None
         except Exception:
             pass
-        # Analyze PDF and populate courses table
-        self.master.update_idletasks()
-        data = self._extract_pdf(pdf)
+        # A new analysis (drop, pick or stale Generate) drops any queued Generate
+        self._generate_when_analyzed = False
+        # An unchanged PDF that was already analyzed is shown straight from its snapshot
+        key = self._analysis_key(pdf)
+        if key is not None and key in self._analyses:
+            self._cancel_job()
+            self._set_busy(False)
+            self._apply_analysis(self._analyses[key], None)
+            return
+        # Clear the previous timetable and analyze in the background
+        self._load_core()
+        if self._table_cache is None:
+            self._table_cache = app.TableCache()
+        self._last_courses = []
+        self.courses_pane.set_courses([])
+        self.var_term.set("")
+        try:
+            self.lbl_pdf.configure(text=str(self.tr.get("working", "Working…")))
+        except Exception:
+            pass
+        self._start_job(self._analyze_worker, self._apply_analysis, pdf, key, self._table_cache)
+
+    def _analyze_worker(self, cancel: threading.Event, pdf: str, key, cache):
+        # Runs on a worker thread: core calls only, no Tk access
+        data = self._extract_pdf(pdf, cache)
         if not data:
+            return None
+        headers, rows, meta, is_chinese, doc = data
+        try:
+            if cancel.is_set():
+                return None
+            rows = self._merge_continuations(headers, rows)
+            courses = self._extract_courses(headers, rows, meta, is_chinese)
+            try:
+                app._backfill_teachers(courses)
+            except Exception:
+                pass
+            if cancel.is_set():
+                return None
+            # Student info + term
+            try:
+                info = app.extract_student_info_from_pdf(doc, meta)
+            except Exception:
+                info = {}
+            try:
+                term = app.extract_term_from_content(doc, meta)
+            except Exception:
+                term = self._extract_term_from_meta(meta, pdf)
+        finally:
+            doc.close()
+        # Everything on_generate needs, so it never reopens the PDF
+        return {
+            "key": key,
+            "pdf": pdf,
+            "courses": courses,
+            "is_chinese": is_chinese,
+            "student_name": (info.get("name") or "").strip(),
+            "student_id": info.get("id"),
+            "term": term,
+        }
+
+    def _snapshot_current(self, pdf: str) -> bool:
+        snap = self._analysis
+        return snap is not None and snap["key"] is not None and snap["key"] == self._analysis_key(pdf)
+
+    @staticmethod
+    def _analysis_key(pdf: str) -> Optional[tuple]:
+        try:
+            st = os.stat(pdf)
+        except OSError:
+            return None
+        return (os.path.abspath(pdf), st.st_size, st.st_mtime_ns)
+
+    def _apply_analysis(self, result, error):
+        generate, self._generate_when_analyzed = self._generate_when_analyzed, False
+        if error is not None or not result:
             self.courses_pane.set_courses([])
             self.var_term.set("")
             try:
+                self.lbl_pdf.configure(text="")
                 self.btn_generate.configure(state=tk.DISABLED)
             except Exception:
                 pass
             return
-        headers, rows, meta, is_chinese = data
-        self._last_meta = meta
-        rows = self._merge_continuations(headers, rows)
-        self._set_type_map(is_chinese)
-        courses = self._extract_courses(headers, rows, meta)
-        try:
-            app._backfill_teachers(courses)
-        except Exception:
-            pass
+        is_chinese = result["is_chinese"]
+        courses = result["courses"]
+        term = result["term"]
+        student_name = result["student_name"]
+        if result["key"] is not None:
+            self._analyses.pop(result["key"], None)
+            self._analyses[result["key"]] = result
+            # Keep only the most recent few PDFs
+            while len(self._analyses) > 8:
+                self._analyses.pop(next(iter(self._analyses)))
+        self._analysis = result
         self._last_courses = courses
         self._last_is_chinese = is_chinese
         # Update day display locale: Chinese if UI is zh OR timetable is Chinese; else French if UI is fr; else English
@@ -762,16 +855,6 @@ class App(ttk.Frame):
             self.courses_pane.set_day_locale(self.lang, is_chinese)
         except Exception:
             pass
-        # Student info + term
-        try:
-            info = app.extract_student_info_from_pdf(pdf, meta)
-            student_name = (info.get("name") or "").strip()
-        except Exception:
-            student_name = ""
-        try:
-            term = app.extract_term_from_content(pdf, meta)
-        except Exception:
-            term = self._extract_term_from_meta(meta)
         self._last_term = term
         display_term = self._format_term_display(term, is_chinese) if term else ""
         # Right side: academic year/term only
@@ -800,6 +883,8 @@ class App(ttk.Frame):
             self.btn_generate.configure(state=tk.NORMAL)
         except Exception:
             pass
+        if generate:
+            self.on_generate()
 
     def on_generate(self):
         pdf = self.var_pdf.get().strip()
@@ -816,19 +901,100 @@ class App(ttk.Frame):
         selected = self.courses_pane.get_selected_courses()
         if not selected:
             return
+        # Name and term come from the analysis snapshot; re-analyze only if the file changed on disk
+        if not self._snapshot_current(pdf):
+            # Analyze again ("Working…" shows meanwhile), then finish this Generate
+            self.on_analyze()
+            if self._job is not None:
+                self._generate_when_analyzed = True
+            elif self._snapshot_current(pdf):
+                self.on_generate()
+            return
+        snap = self._analysis
+        ics_path_str, _cal_name = app.ics_output_path(pdf, snap["student_name"], snap["term"], monday)
+        self._start_job(self._generate_worker, self._apply_generate,
+                        ics_path_str, monday, selected, snap["is_chinese"])
+
+    def _generate_worker(self, cancel: threading.Event, ics_path: str, monday: str, selected, is_chinese: bool):
         # Build ICS directly using the helper in module
-        try:
-            # Compute ICS path using content-based name + term
-            ics_path_str, cal_name = app.compute_ics_output_path(pdf, self._last_meta or [], monday)
-            ics_path = Path(ics_path_str)
-            self._build_ics(selected, monday, str(ics_path), self._last_is_chinese)
-            self._last_ics = str(ics_path)
-            if ics_path.exists():
-                self.btn_share.configure(state=tk.NORMAL)
-                self.btn_open_folder.configure(state=tk.NORMAL)
-        except Exception:
+        self._build_ics(selected, monday, ics_path, is_chinese)
+        return ics_path
+
+    def _apply_generate(self, ics_path, error):
+        if error is not None or not ics_path:
             self.btn_share.configure(state=tk.DISABLED)
             self.btn_open_folder.configure(state=tk.DISABLED)
+            return
+        self._last_ics = ics_path
+        if Path(ics_path).exists():
+            self.btn_share.configure(state=tk.NORMAL)
+            self.btn_open_folder.configure(state=tk.NORMAL)
+
+    # --- Background jobs: core work runs on a worker thread, Tk is only touched here ---
+    def _start_job(self, work: Callable[..., Any], on_done: Callable[[Any, Optional[BaseException]], None], *args):
+        """Run ``work(cancel, *args)`` on a worker thread, then ``on_done(result, error)`` on the Tk thread.
+
+        Starting a job cancels the current one: its cancel event is set and its result is dropped.
+        """
+        self._cancel_job()
+        cancel = threading.Event()
+        self._job = (cancel, on_done)
+
+        def _target():
+            try:
+                outcome = (work(cancel, *args), None)
+            except BaseException as e:
+                outcome = (None, e)
+            self._job_results.put((cancel, outcome))
+
+        threading.Thread(target=_target, name="gui-job", daemon=True).start()
+        self._set_busy(True)
+        if not self._polling:
+            self._polling = True
+            self.master.after(30, self._poll_jobs)
+
+    def _cancel_job(self):
+        if self._job is not None:
+            self._job[0].set()
+            self._job = None
+
+    def _poll_jobs(self):
+        # Drain finished jobs; results of cancelled (superseded) jobs are ignored
+        while True:
+            try:
+                cancel, (result, error) = self._job_results.get_nowait()
+            except queue.Empty:
+                break
+            if self._job is None or self._job[0] is not cancel:
+                continue
+            on_done = self._job[1]
+            self._job = None
+            self._set_busy(False)
+            try:
+                on_done(result, error)
+            except Exception:
+                pass
+        if self._job is None:
+            self._polling = False
+            return
+        try:
+            self.master.after(30, self._poll_jobs)
+        except tk.TclError:
+            # Window closed while a job was running
+            self._polling = False
+
+    def _set_busy(self, busy: bool):
+        try:
+            if busy:
+                self.btn_generate.configure(state=tk.DISABLED)
+                self.progress.grid()
+                self.progress.start(12)
+            else:
+                self.progress.stop()
+                self.progress.grid_remove()
+                self.btn_generate.configure(state=tk.NORMAL)
+        except Exception:
+            pass
 
     # Output log removed; modern UI replaces the scrolled text
 
@@ -969,27 +1135,35 @@ class App(ttk.Frame):
         theme.apply_theme(self.master, None)
 
     # --- Internal helpers that wrap the core library ---
-    def _extract_pdf(self, pdf_path: str):
+    def _load_core(self):
         global app
         if app is None:
             import importlib
             app = importlib.import_module("timetable_to_calendar_zjnu")
-        tables = app.extract_tables(pdf_path, strategy="lines")
-        result = app.merge_main_table(tables, collapse_newlines=False)
+
+    def _extract_pdf(self, pdf_path: str, cache=None):
+        self._load_core()
+        # Re-dropping a known PDF is served from the on-disk table cache
+        # Keep the document open for name/term lookups; the caller closes it
+        doc = app.TimetableDocument(pdf_path, cache=cache)
+        try:
+            result = app.extract_main_table(doc, strategy="lines", collapse_newlines=False)
+        except Exception:
+            doc.close()
+            raise
         if not result or not result[0]:
+            doc.close()
             return None
         headers, rows, meta, _notes, is_chinese = result
-        return headers, rows, meta, is_chinese
+        return headers, rows, meta, is_chinese, doc
 
     def _merge_continuations(self, headers, rows):
         return app.merge_continuation_rows(headers, rows)
 
-    def _set_type_map(self, is_chinese: bool):
-        app.set_active_type_map(use_chinese=is_chinese)
-
-    def _extract_courses(self, headers, rows, meta):
-        courses = app.extract_courses_from_table(headers, rows, preserve_newlines=True)
-        courses += app.extract_outside_courses(meta)
+    def _extract_courses(self, headers, rows, meta, is_chinese: bool):
+        ctx = app.parse_context(is_chinese)
+        courses = app.extract_courses_from_table(headers, rows, preserve_newlines=True, ctx=ctx)
+        courses += app.extract_outside_courses(meta, ctx)
         return courses
 
     def _build_ics(self, courses, monday_date, output, is_chinese: bool):
@@ -1005,7 +1179,7 @@ class App(ttk.Frame):
             chinese=is_chinese,
         )
 
-    def _extract_term_from_meta(self, metadata_lines: list[str]) -> Optional[str]:
+    def _extract_term_from_meta(self, metadata_lines: list[str], pdf_path: Optional[str] = None) -> Optional[str]:
         # Look for patterns like 2025-2026-1; handle Unicode dashes/fullwidth digits
         import re as _re
 
@@ -1032,7 +1206,7 @@ class App(ttk.Frame):
 
         # 2) Fallback: scan filename if available
         try:
-            pdf_name = Path(self.var_pdf.get()).stem
+            pdf_name = Path(pdf_path if pdf_path is not None else self.var_pdf.get()).stem
             ln = _normalize(pdf_name)
             m = pat.search(ln)
             if m:
@@ -1055,7 +1229,6 @@ class App(ttk.Frame):
         except Exception:
             return term
 
-    # No busy/progress UI needed due to fast analysis
 
 
 class CoursesPane(ttk.Frame):
@@ -1327,7 +1500,7 @@ class CoursesPane(ttk.Frame):
     def _weeks_to_text(weeks: list[int]) -> str:
         if not weeks:
             return ""
-        return ",".join(str(w) for w in sorted(set(weeks)))
+        return ",".join(str(w) for w in app.WeekSet.from_weeks(weeks))
 
     @staticmethod
     def _periods_to_session(periods: list[int]) -> str:
@@ -1367,21 +1540,7 @@ class CoursesPane(ttk.Frame):
 
     @staticmethod
     def _parse_weeks(text: str) -> list[int]:
-        if not text:
-            return []
-        parts = [t.strip() for t in text.split(',') if t.strip()]
-        out = set()
-        import re
-        for p in parts:
-            m = re.match(r"^(\d+)-(\d+)$", p)
-            if m:
-                a, b = int(m.group(1)), int(m.group(2))
-                if a <= b:
-                    for x in range(a, b + 1):
-                        out.add(x)
-            elif p.isdigit():
-                out.add(int(p))
-        return sorted(out)
+        return app.WeekSet.parse(text).to_list()
 
     def _to_output_course(self, c: dict) -> dict:
         # Preserve periods and day so ICS times remain correct
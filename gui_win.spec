@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('assets/icon.ico', 'assets')],
-    hiddenimports=['timetable_to_calendar_zjnu'],
+    hiddenimports=['timetable_to_calendar_zjnu', 'pdfplumber'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -6,19 +6,23 @@ Inputs: PDF path and week-1 Monday date. Output: .ics next to the PDF.
 
 import os
 import sys
+import contextvars
+import functools
 import glob
-import pdfplumber
+import hashlib
+import html
+import json
 import re
-from datetime import datetime, timedelta, timezone
-try:
-    from zoneinfo import ZoneInfo  # Python 3.9+
-except Exception:
-    ZoneInfo = None
-try:
-    from ics import Calendar, Event
-except Exception:
-    Calendar = None
-    Event = None
+import threading
+import time
+from array import array
+from datetime import date, datetime, timezone
+
+
+def _pdfplumber():
+    """Import pdfplumber (and pdfminer/PIL) on first use; --help, cache hits and GUI start never pay for it."""
+    import pdfplumber
+    return pdfplumber
 
 
 def find_default_pdf() -> str | None:
@@ -26,151 +30,605 @@ def find_default_pdf() -> str | None:
     return pdfs[0] if pdfs else None
 
 
-def extract_tables(pdf_path: str, strategy: str = "auto"):
-    all_tables = []  # (page_index, table_index, rows)
-    with pdfplumber.open(pdf_path) as pdf:
-        for i, page in enumerate(pdf.pages, start=1):
+# Stage instrumentation: a hook(stage, seconds, counts) installed with
+# instrument() receives one call per pipeline stage (and per page / per cell).
+# With no hook the stages only pay one ContextVar lookup per call.
+_STAGE_HOOK: contextvars.ContextVar = contextvars.ContextVar("zjnu_stage_hook", default=None)
+
+
+class instrument:
+    """Context manager installing ``hook`` for the pipeline stages run inside it.
+
+    ``hook(stage, seconds, counts)`` gets the stage name ("extract_tables",
+    "extract_tables.page", "merge_main_table", "merge_continuation_rows",
+    "extract_courses_from_table", "extract_courses_from_table.cell",
+    "extract_outside_courses", "write_ics"), its wall time and a dict of
+    counters (pages, tables, rows, lines, cells, blocks, courses, events). The hook is
+    per thread / asyncio task, so concurrent conversions do not mix.
+    """
+
+    def __init__(self, hook):
+        self.hook = hook
+        self._token = None
+
+    def __enter__(self):
+        self._token = _STAGE_HOOK.set(self.hook)
+        return self.hook
+
+    def __exit__(self, *exc) -> None:
+        _STAGE_HOOK.reset(self._token)
+
+
+class StageStats:
+    """Built-in stage hook: totals calls, wall time and counters per stage."""
+
+    def __init__(self):
+        self.stages: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, stage: str, seconds: float, counts: dict) -> None:
+        with self._lock:
+            st = self.stages.setdefault(stage, {"calls": 0, "seconds": 0.0})
+            st["calls"] += 1
+            st["seconds"] += seconds
+            for k, v in counts.items():
+                st[k] = st.get(k, 0) + v
+
+    def merge(self, stages: dict) -> None:
+        """Add the ``to_dict()`` totals of another collector (e.g. from a worker process)."""
+        for stage, st in stages.items():
+            st = dict(st)
+            seconds = st.pop("seconds", 0.0)
+            calls = st.pop("calls", 0)
+            self(stage, seconds, st)
+            with self._lock:
+                self.stages[stage]["calls"] += calls - 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {k: dict(v) for k, v in self.stages.items()}
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def table(self) -> str:
+        """Per-stage totals as a plain-text table."""
+        cols = ["pages", "tables", "rows", "lines", "cells", "blocks", "courses", "events", "cached"]
+        stages = self.to_dict()
+        cols = [c for c in cols if any(c in st for st in stages.values())]
+        width = max([len("stage")] + [len(k) for k in stages])
+        lines = [f"{'stage':<{width}}  {'calls':>6}  {'ms':>9}" + "".join(f"  {c:>7}" for c in cols)]
+        for stage, st in stages.items():
+            lines.append(f"{stage:<{width}}  {st['calls']:>6}  {st['seconds'] * 1000:>9.2f}"
+                         + "".join(f"  {st[c]:>7}" if c in st else f"  {'':>7}" for c in cols))
+        return "\n".join(lines)
+
+
+# pdfplumber table settings per detection strategy.
+# Line detection is kept even though the ZJNU grid has fixed columns: on the
+# samples it costs ~12 ms of ~170 ms per page (pdfminer object parsing dominates
+# and is needed for cell text anyway), and explicit column lines would also cut
+# through the full-width metadata/notes rows above and below the grid.
+TABLE_SETTINGS = {
+    "lines": {"vertical_strategy": "lines", "horizontal_strategy": "lines"},
+    "text": {"vertical_strategy": "text", "horizontal_strategy": "text"},
+}
+
+
+def _extract_page_tables(page, strategy: str = "auto") -> list:
+    """Run table detection on one pdfplumber page using the given strategy."""
+    tables = []
+    if strategy in ("auto", "lines"):
+        try:
+            tables = page.extract_tables(TABLE_SETTINGS["lines"]) or []
+        except Exception:
             tables = []
-            if strategy in ("auto", "lines"):
-                try:
-                    tables = page.extract_tables({
-                        "vertical_strategy": "lines",
-                        "horizontal_strategy": "lines",
-                    }) or []
-                except Exception:
-                    tables = []
-            if strategy == "text" or (strategy == "auto" and not tables):
+    if strategy == "text" or (strategy == "auto" and not tables):
+        try:
+            tables = page.extract_tables(TABLE_SETTINGS["text"]) or []
+        except Exception:
+            tables = page.extract_tables() or []
+    return tables
+
+
+# Bump when extraction/merge output changes so stale cache entries are ignored
+CACHE_VERSION = 1
+
+
+def default_cache_dir() -> str:
+    """Per-user cache directory for extracted tables."""
+    if sys.platform.startswith("win"):
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "timetable-to-calendar-zjnu", "tables")
+
+
+class TableCache:
+    """Content-addressed on-disk cache of extraction results with LRU eviction.
+
+    Entries are keyed by the SHA-256 of the PDF bytes plus the stage name and
+    its settings, and stored as one JSON file each. Reads refresh the file's
+    mtime; writes evict the least recently used entries once the directory
+    exceeds ``max_bytes``.
+    """
+
+    def __init__(self, directory: str | None = None, max_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(pdf_sha256: str, kind: str, **params) -> str:
+        blob = json.dumps([CACHE_VERSION, pdf_sha256, kind, params], sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except Exception:
+            return None
+        try:
+            os.utime(path, None)
+        except Exception:
+            pass
+        return value
+
+    def put(self, key: str, value) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp, path)
+            self.evict()
+        except Exception:
+            # A cache that cannot be written must never break a conversion
+            pass
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the cache fits in ``max_bytes``."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except Exception:
+                pass
+
+    def clear(self) -> None:
+        for entry in os.scandir(self.directory) if os.path.isdir(self.directory) else []:
+            if entry.name.endswith(".json"):
                 try:
-                    tables = page.extract_tables({
-                        "vertical_strategy": "text",
-                        "horizontal_strategy": "text",
-                    }) or []
+                    os.remove(entry.path)
                 except Exception:
-                    tables = page.extract_tables() or []
-            for t_idx, table in enumerate(tables, start=1):
-                all_tables.append((i, t_idx, table))
-    return all_tables
+                    pass
 
 
-# removed: markdown helpers; ICS-only tool
+class TimetableDocument:
+    """Open-once view of a timetable PDF shared by every extraction step.
 
+    The PDF is opened lazily on first use and each page's tables and text are
+    cached, so table extraction, student-name and term detection all reuse the
+    same parsed pages. Cached results stay available after ``close()``; the
+    file is only reopened if something uncached is requested later.
 
-def merge_main_table(all_tables, collapse_newlines: bool = True):
-    import html as _html
-
-    def clean_cell(c: str) -> str:
-        s = (c or "")
-        if collapse_newlines:
-            # Collapse all whitespace and line breaks into single spaces
-            s = s.replace("\r", " ").replace("\n", " ")
-            s = " ".join(s.split())
-        else:
-            # Preserve line breaks for downstream block parsing
-            s = s.replace("\r", "\n")
-            # Trim lines but keep structure
-            s = "\n".join([ln.strip() for ln in s.split("\n")])
-        s = _html.unescape(s)
-        return s.replace("|", "\\|")
-
-    def normalize_header(cells: list[str]) -> list[str]:
-        mapped = []
-        for x in cells:
-            y = x
-            y = y.replace("Sectio ns", "Sections")
-            y = y.replace("Sectio\u00A0ns", "Sections")
-            # Do not over-correct generic prefixes to avoid "Sectionns"
-            mapped.append(y)
-        return mapped
-
-    def find_header_idx(rows: list[list[str]]):
-        # Detect English or Chinese timetable headers
-        cn_days = ["周一", "周二", "周三", "周四", "周五", "周六", "周日", "星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
-        for idx, row in enumerate(rows):
-            joined = " ".join(row)
-            # English
-            if ("Period" in joined or "Morning" in joined or "Evening" in joined) and ("Mon" in joined and "Sun" in joined):
-                return idx
-            # Chinese: row contains multiple day names and a time/section indicator like 节/节次/上午/下午/晚上
-            day_hits = sum(1 for d in cn_days if d in joined)
-            if day_hits >= 3 and ("节" in joined or "节次" in joined or "上午" in joined or "下午" in joined or "晚上" in joined):
-                return idx
+    With a ``cache`` (TableCache), tables, merged tables and header text are
+    also looked up by content hash first, so a previously seen PDF is served
+    without opening it in pdfplumber at all.
+    """
+
+    def __init__(self, pdf_path: str, cache: "TableCache | None" = None):
+        self.pdf_path = pdf_path
+        self.cache = cache
+        self._sha256: str | None = None
+        self._pdf = None
+        self._page_count: int | None = None
+        self._tables: dict[tuple[int, str], list] = {}
+        self._text: dict[int, str] = {}
+
+    def __enter__(self) -> "TimetableDocument":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _open(self):
+        if self._pdf is None:
+            self._pdf = _pdfplumber().open(self.pdf_path)
+            self._page_count = len(self._pdf.pages)
+        return self._pdf
+
+    def close(self) -> None:
+        if self._pdf is not None:
+            try:
+                self._pdf.close()
+            except Exception:
+                pass
+            self._pdf = None
+
+    @property
+    def sha256(self) -> str:
+        """Hex SHA-256 of the PDF bytes (read once)."""
+        if self._sha256 is None:
+            h = hashlib.sha256()
+            with open(self.pdf_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            self._sha256 = h.hexdigest()
+        return self._sha256
+
+    def cache_key(self, kind: str, **params) -> str | None:
+        if self.cache is None:
+            return None
+        try:
+            return self.cache.key(self.sha256, kind, **params)
+        except Exception:
+            return None
+
+    @property
+    def page_count(self) -> int:
+        if self._page_count is None:
+            self._open()
+        return self._page_count or 0
+
+    def page_tables(self, index: int, strategy: str = "auto", keep: bool = True) -> list:
+        """Tables on page ``index`` (1-based), cached per strategy.
+
+        With ``keep=False`` a page that is not cached yet is extracted without
+        storing its tables, and its layout cache is released right away.
+        """
+        key = (index, strategy)
+        if key in self._tables:
+            return self._tables[key]
+        page = self._open().pages[index - 1]
+        tables = _extract_page_tables(page, strategy)
+        if not keep:
+            page.close()
+            return tables
+        self._tables[key] = tables
+        return tables
+
+    def cached_tables(self, strategy: str = "auto") -> list | None:
+        """``extract_tables`` result from the TableCache without opening the PDF, or None on a miss."""
+        key = self.cache_key("tables", strategy=strategy, settings=TABLE_SETTINGS)
+        if key:
+            hit = self.cache.get(key)
+            if hit is not None:
+                return [tuple(t) for t in hit]
         return None
 
-    # Find the first table with recognizable EN/CN header
-    main_headers = None
-    col_count = None
-    merged_rows: list[list[str]] = []
-    metadata_lines: list[str] = []
-    notes_lines: list[str] = []
+    def store_tables(self, strategy: str, tables: list) -> None:
+        """Save a complete ``extract_tables`` result to the TableCache, if any."""
+        key = self.cache_key("tables", strategy=strategy, settings=TABLE_SETTINGS)
+        if key:
+            self.cache.put(key, tables)
+
+    def prefetch_tables(self, strategy: str = "auto", workers: int = 0) -> None:
+        """Extract uncached pages in a process pool, one contiguous page range per worker.
+
+        Each worker opens the file itself, so only page indices and extracted rows
+        cross the process boundary. ``workers=0`` uses one process per CPU. Falls
+        back to in-process extraction if the pool cannot be started.
+        """
+        pending = [i for i in range(1, self.page_count + 1) if (i, strategy) not in self._tables]
+        workers = min(workers or (os.cpu_count() or 1), len(pending))
+        if workers < 2:
+            return
+        from concurrent.futures import ProcessPoolExecutor
+        size = -(-len(pending) // workers)
+        chunks = [pending[k:k + size] for k in range(0, len(pending), size)]
+        try:
+            with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+                futures = [pool.submit(_extract_page_range, self.pdf_path, c[0], c[-1], strategy) for c in chunks]
+                for fut in futures:
+                    for i, tables in fut.result():
+                        self._tables[(i, strategy)] = tables
+        except Exception:
+            # Sequential extraction in extract_tables picks up whatever is still missing
+            pass
+
+    def page_text(self, index: int) -> str:
+        """``extract_text()`` of page ``index`` (1-based), cached."""
+        if index not in self._text:
+            page = self._open().pages[index - 1]
+            self._text[index] = page.extract_text() or ""
+        return self._text[index]
+
+    def head_lines(self, max_pages: int = 2) -> list[str]:
+        """Non-empty stripped text lines of the first ``max_pages`` pages."""
+        key = self.cache_key("head_lines", max_pages=max_pages)
+        if key:
+            hit = self.cache.get(key)
+            if hit is not None:
+                return hit
+        lines: list[str] = []
+        for i in range(1, min(max_pages, self.page_count) + 1):
+            lines.extend([l.strip() for l in self.page_text(i).splitlines() if l.strip()])
+        if key:
+            self.cache.put(key, lines)
+        return lines
+
+
+def _extract_page_range(pdf_path: str, first: int, last: int, strategy: str) -> list[tuple[int, list]]:
+    """Process-pool worker: open the PDF independently and extract pages first..last (1-based)."""
+    with _pdfplumber().open(pdf_path) as pdf:
+        return [(i, _extract_page_tables(pdf.pages[i - 1], strategy)) for i in range(first, last + 1)]
+
+
+def _as_document(source) -> tuple["TimetableDocument", bool]:
+    """Return (document, owned) for a path or an existing TimetableDocument."""
+    if isinstance(source, TimetableDocument):
+        return source, False
+    return TimetableDocument(source), True
+
+
+def extract_tables(source: "str | TimetableDocument", strategy: str = "auto", workers: int = 1):
+    """Return ``(page_index, table_index, rows)`` for every table in page order.
+
+    ``workers`` > 1 (or 0 for one per CPU) detects tables on separate pages in a
+    process pool; the result is identical to the sequential run.
+    """
+    all_tables = []  # (page_index, table_index, rows)
+    hook = _STAGE_HOOK.get()
+    t0 = time.perf_counter() if hook else 0.0
+    doc, owned = _as_document(source)
+    hit = doc.cached_tables(strategy)
+    if hit is not None:
+        if hook:
+            hook("extract_tables", time.perf_counter() - t0, {"tables": len(hit), "cached": 1})
+        return hit
+    try:
+        if workers != 1:
+            doc.prefetch_tables(strategy, workers)
+        for i in range(1, doc.page_count + 1):
+            tp = time.perf_counter() if hook else 0.0
+            page_tables = doc.page_tables(i, strategy)
+            if hook:
+                hook("extract_tables.page", time.perf_counter() - tp, {"pages": 1, "tables": len(page_tables)})
+            for t_idx, table in enumerate(page_tables, start=1):
+                all_tables.append((i, t_idx, table))
+    finally:
+        if owned:
+            doc.close()
+    doc.store_tables(strategy, all_tables)
+    if hook:
+        hook("extract_tables", time.perf_counter() - t0, {"pages": doc.page_count, "tables": len(all_tables)})
+    return all_tables
 
-    # Pre-clean all cells and compute per-table cleaned rows
-    cleaned_tables = []
-    for page_idx, table_idx, rows in all_tables:
-        cleaned = [[clean_cell(c) for c in (row or [])] for row in (rows or [])]
-        cleaned_tables.append((page_idx, table_idx, cleaned))
 
-    header_src = None  # (page_idx, table_idx)
-    detected_chinese = False
-    for page_idx, table_idx, rows in cleaned_tables:
-        if not rows:
-            continue
-        hdr_idx = find_header_idx(rows)
-        if hdr_idx is not None:
-            # Rows before header are metadata lines
-            pre_rows = rows[:hdr_idx]
-            for pr in pre_rows:
-                joined = " ".join([x for x in pr if x])
-                j = " ".join(joined.split())
-                if j:
-                    metadata_lines.append(j)
-            headers_row = rows[hdr_idx]
-            col_count = max(col_count or 0, len(headers_row))
-            main_headers = normalize_header(headers_row + [""] * (col_count - len(headers_row)))
-            # Detect Chinese by presence of Chinese weekdays in header
-            hdr_joined = " ".join(headers_row)
-            if any(x in hdr_joined for x in ["周一","星期一","周二","星期二","周三","星期三","周四","星期四","周五","星期五","周六","星期六","周日","星期日"]):
-                detected_chinese = True
-            # Append all rows after header
-            for r in rows[hdr_idx + 1 : ]:
-                merged_rows.append(r)
-            header_src = (page_idx, table_idx)
-            break
+def extract_main_table(source: "str | TimetableDocument", strategy: str = "lines", collapse_newlines: bool = False, workers: int = 1):
+    """``merge_main_table(extract_tables(...))``, served from the document's cache when possible."""
+    doc, owned = _as_document(source)
+    key = doc.cache_key("merged", strategy=strategy, settings=TABLE_SETTINGS, collapse_newlines=collapse_newlines)
+    if key:
+        hit = doc.cache.get(key)
+        if hit is not None:
+            return tuple(hit)
+    try:
+        result = merge_main_table(extract_tables(doc, strategy=strategy, workers=workers), collapse_newlines=collapse_newlines)
+    finally:
+        if owned:
+            doc.close()
+    if key and result and result[0]:
+        doc.cache.put(key, list(result))
+    return result
 
-    if main_headers is None:
-        # Fallback to the first table's shape
-        if cleaned_tables:
-            _, _, rows = cleaned_tables[0]
-            col_count = max(len(r) for r in rows) if rows else 0
-            main_headers = [f"Col {i}" for i in range(1, col_count + 1)]
-            merged_rows.extend(rows)
-        return main_headers, merged_rows
-
-    # Append remaining tables with the same column count as continuation
-    for page_idx, table_idx, rows in cleaned_tables:
-        # Skip the table that provided the header and rows we already consumed
-        if header_src and (page_idx, table_idx) == header_src:
-            continue
-        if not rows:
-            continue
-        # If this table also contains a header row, append rows after it; otherwise append all
-        hdr_idx = find_header_idx(rows)
-        if hdr_idx is not None:
-            rows_to_add = rows[hdr_idx + 1 : ]
-        else:
-            rows_to_add = rows
-        merged_rows.extend(rows_to_add)
 
-    # Collect optional notes
-    for page_idx, table_idx, rows in cleaned_tables:
-        for r in rows or []:
+# removed: markdown helpers; ICS-only tool
+
+
+def _clean_cell(c: str, collapse_newlines: bool) -> str:
+    s = (c or "")
+    if collapse_newlines:
+        # Collapse all whitespace and line breaks into single spaces
+        s = s.replace("\r", " ").replace("\n", " ")
+        s = " ".join(s.split())
+    else:
+        # Preserve line breaks for downstream block parsing
+        s = s.replace("\r", "\n")
+        # Trim lines but keep structure
+        s = "\n".join([ln.strip() for ln in s.split("\n")])
+    s = html.unescape(s)
+    return s.replace("|", "\\|")
+
+
+def _normalize_header(cells: list[str]) -> list[str]:
+    mapped = []
+    for x in cells:
+        y = x
+        y = y.replace("Sectio ns", "Sections")
+        y = y.replace("Sectio\u00A0ns", "Sections")
+        # Do not over-correct generic prefixes to avoid "Sectionns"
+        mapped.append(y)
+    return mapped
+
+
+def _find_header_idx(rows: list[list[str]]):
+    # Detect English or Chinese timetable headers
+    cn_days = ["周一", "周二", "周三", "周四", "周五", "周六", "周日", "星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
+    for idx, row in enumerate(rows):
+        joined = " ".join(row)
+        # English
+        if ("Period" in joined or "Morning" in joined or "Evening" in joined) and ("Mon" in joined and "Sun" in joined):
+            return idx
+        # Chinese: row contains multiple day names and a time/section indicator like 节/节次/上午/下午/晚上
+        day_hits = sum(1 for d in cn_days if d in joined)
+        if day_hits >= 3 and ("节" in joined or "节次" in joined or "上午" in joined or "下午" in joined or "晚上" in joined):
+            return idx
+    return None
+
+
+class MainTableMerger:
+    """Incremental ``merge_main_table``: feed tables as pages are parsed, get rows as they settle.
+
+    ``feed`` cleans one table and returns the padded body rows that became
+    available (none until the header table has been seen; tables that arrive
+    before it are held and released right after its rows). Metadata lines,
+    notes and language are exposed as attributes once known.
+    """
+
+    def __init__(self, collapse_newlines: bool = True):
+        self.collapse_newlines = collapse_newlines
+        self.headers: list[str] | None = None
+        self.metadata_lines: list[str] = []
+        self.notes_lines: list[str] = []
+        self.detected_chinese = False
+        self._first_table: list[list[str]] | None = None
+        self._pending: list[list[list[str]]] = []
+
+    def feed(self, page_idx: int, table_idx: int, rows) -> list[list[str]]:
+        cleaned = [[_clean_cell(c, self.collapse_newlines) for c in (row or [])] for row in (rows or [])]
+        # Collect optional notes
+        for r in cleaned:
             joined = " ".join([x for x in r if x])
             j = " ".join(joined.split())
             if j.startswith("★:") or "print time" in j:
-                notes_lines.append(j)
+                self.notes_lines.append(j)
+        if self.headers is not None:
+            return self._pad(self._body_rows(cleaned))
+        if self._first_table is None:
+            self._first_table = cleaned
+        hdr_idx = _find_header_idx(cleaned) if cleaned else None
+        if hdr_idx is None:
+            self._pending.append(cleaned)
+            return []
+        # Rows before header are metadata lines
+        for pr in cleaned[:hdr_idx]:
+            joined = " ".join([x for x in pr if x])
+            j = " ".join(joined.split())
+            if j:
+                self.metadata_lines.append(j)
+        headers_row = cleaned[hdr_idx]
+        self.headers = _normalize_header(headers_row)
+        # Detect Chinese by presence of Chinese weekdays in header
+        hdr_joined = " ".join(headers_row)
+        if any(x in hdr_joined for x in ["周一","星期一","周二","星期二","周三","星期三","周四","星期四","周五","星期五","周六","星期六","周日","星期日"]):
+            self.detected_chinese = True
+        # Rows after the header, then any tables held back before it, as continuation
+        out = cleaned[hdr_idx + 1 : ]
+        for t in self._pending:
+            out.extend(self._body_rows(t))
+        self._pending = []
+        self._first_table = None
+        return self._pad(out)
+
+    @staticmethod
+    def _body_rows(rows: list[list[str]]) -> list[list[str]]:
+        # If this table also contains a header row, use rows after it; otherwise all
+        if not rows:
+            return []
+        hdr_idx = _find_header_idx(rows)
+        return rows[hdr_idx + 1 : ] if hdr_idx is not None else rows
+
+    def _pad(self, rows: list[list[str]]) -> list[list[str]]:
+        # Pad each row to the number of header columns
+        n = len(self.headers or [])
+        return [r + [""] * (n - len(r)) for r in rows]
+
+    def result(self, merged_rows: list[list[str]]):
+        """Return the ``merge_main_table`` tuple for the rows collected from ``feed``."""
+        if self.headers is None:
+            # Fallback to the first table's shape
+            if self._first_table is None:
+                return None, []
+            rows = self._first_table
+            col_count = max(len(r) for r in rows) if rows else 0
+            return [f"Col {i}" for i in range(1, col_count + 1)], list(rows)
+        return self.headers, merged_rows, self.metadata_lines, self.notes_lines, self.detected_chinese
+
+
+def iter_tables(source: "str | TimetableDocument", strategy: str = "auto"):
+    """Yield ``(page_index, table_index, rows)`` page by page as tables are detected.
+
+    Unlike ``extract_tables`` no page is kept: each page's layout cache is
+    released once its tables have been yielded, so memory stays at one page.
+    A document with a TableCache is served from it when possible, and otherwise
+    collects the (small) table rows to fill it once every page was read.
+    """
+    doc, owned = _as_document(source)
+    try:
+        hit = doc.cached_tables(strategy)
+        if hit is not None:
+            yield from hit
+            return
+        collected = [] if doc.cache is not None else None
+        for i in range(1, doc.page_count + 1):
+            tables = doc.page_tables(i, strategy, keep=False)
+            for t_idx, table in enumerate(tables, start=1):
+                if collected is not None:
+                    collected.append((i, t_idx, table))
+                yield i, t_idx, table
+        if collected is not None:
+            doc.store_tables(strategy, collected)
+    finally:
+        if owned:
+            doc.close()
+
+
+def iter_courses(source: "str | TimetableDocument", strategy: str = "lines", on_header=None):
+    """Stream parsed courses from a PDF while its pages are still being read.
+
+    Tables flow page by page through MainTableMerger, ContinuationMerger and the
+    cell parser, and each course is yielded as soon as its row is final. The
+    order matches the batch pipeline: table courses, then outside-of-table
+    courses from the metadata lines. ``on_header(merger)`` is called once the
+    header is found, when language and metadata lines are known. Teacher
+    backfill needs every course, so apply ``_backfill_teachers`` to the
+    collected list.
+    """
+    merger = MainTableMerger(collapse_newlines=False)
+    rows_merger: ContinuationMerger | None = None
+    day_by_col: dict[int, str] = {}
+    ctx = CONTEXT_EN
+    hook = _STAGE_HOOK.get()
+    for page_idx, table_idx, rows in iter_tables(source, strategy=strategy):
+        body = merger.feed(page_idx, table_idx, rows)
+        if merger.headers is None:
+            continue
+        if rows_merger is None:
+            rows_merger = ContinuationMerger(merger.headers)
+            day_by_col = _day_columns(merger.headers)
+            ctx = parse_context(merger.detected_chinese)
+            if on_header is not None:
+                on_header(merger)
+        for r in body:
+            for row in rows_merger.feed(r):
+                yield from _courses_from_row(row, day_by_col, True, ctx, hook)
+    if rows_merger is None:
+        return
+    for row in rows_merger.finish():
+        yield from _courses_from_row(row, day_by_col, True, ctx, hook)
+    yield from extract_outside_courses(merger.metadata_lines, ctx)
 
-    # Pad each row to the number of header columns
-    merged_rows = [r + [""] * (len(main_headers) - len(r)) for r in merged_rows]
-    return main_headers, merged_rows, metadata_lines, notes_lines, detected_chinese
+
+def merge_main_table(all_tables, collapse_newlines: bool = True):
+    hook = _STAGE_HOOK.get()
+    t0 = time.perf_counter() if hook else 0.0
+    merger = MainTableMerger(collapse_newlines=collapse_newlines)
+    merged_rows: list[list[str]] = []
+    for page_idx, table_idx, rows in all_tables:
+        merged_rows.extend(merger.feed(page_idx, table_idx, rows))
+    result = merger.result(merged_rows)
+    if hook:
+        hook("merge_main_table", time.perf_counter() - t0, {"tables": len(all_tables), "rows": len(result[1])})
+    return result
 
 
 # Section → time mapping (24h)
@@ -190,16 +648,258 @@ SECTION_TIMES = {
     13: ("20:30", "21:10"),
 }
 
+
+def _to_minutes(hhmm: str) -> int:
+    h, m = hhmm.split(":")
+    return int(h) * 60 + int(m)
+
+
+# SECTION_TIMES as minutes after midnight, parsed once
+SECTION_MINUTES = {p: (_to_minutes(a), _to_minutes(b)) for p, (a, b) in SECTION_TIMES.items()}
+
 TYPE_MAP_EN = {"△": "Theory", "★": "Technical", "▲": "Practice", "☆": "Experiment"}
 TYPE_MAP_CN = {"△": "理论", "★": "技术", "▲": "实践", "☆": "实验"}
-# Active type map (switched per language)
+# Legacy process-wide type map, used only when no ParseContext is passed
 TYPE_MAP = TYPE_MAP_EN
 
+
+class ParseContext:
+    """Per-conversion language settings threaded through the course parser.
+
+    Pass ``ctx=parse_context(is_chinese)`` to the parsing functions instead of
+    calling ``set_active_type_map``; nothing global is touched, so EN and CN
+    timetables can be parsed at the same time from different threads.
+    """
+
+    __slots__ = ("chinese", "type_map")
+
+    def __init__(self, chinese: bool = False):
+        self.chinese = chinese
+        self.type_map = TYPE_MAP_CN if chinese else TYPE_MAP_EN
+
+    def type_name(self, type_char: str) -> str:
+        return self.type_map.get(type_char, "")
+
+
+CONTEXT_EN = ParseContext(chinese=False)
+CONTEXT_CN = ParseContext(chinese=True)
+
+
+def parse_context(use_chinese: bool) -> ParseContext:
+    return CONTEXT_CN if use_chinese else CONTEXT_EN
+
+
+def _context(ctx: "ParseContext | None") -> ParseContext:
+    """``ctx``, or the one matching the legacy global ``TYPE_MAP`` when omitted."""
+    if ctx is not None:
+        return ctx
+    return CONTEXT_CN if TYPE_MAP is TYPE_MAP_CN else CONTEXT_EN
+
+
 def set_active_type_map(use_chinese: bool) -> None:
+    """Switch the process-wide default locale (not thread-safe; prefer ``ctx=``)."""
     global TYPE_MAP
     TYPE_MAP = TYPE_MAP_CN if use_chinese else TYPE_MAP_EN
 
 
+class WeekSet:
+    """Set of teaching weeks backed by an int bitmask (bit n = week n).
+
+    Union (``|``), intersection (``&``) and difference (``-``) are single int
+    operations; iteration yields weeks in ascending order. Weeks are
+    non-negative ints.
+    """
+
+    __slots__ = ("mask",)
+
+    def __init__(self, mask: int = 0):
+        self.mask = mask
+
+    @classmethod
+    def from_weeks(cls, weeks) -> "WeekSet":
+        mask = 0
+        for w in weeks:
+            # A negative week raises ValueError (negative shift count)
+            mask |= 1 << w
+        return cls(mask)
+
+    @classmethod
+    def from_range(cls, a: int, b: int) -> "WeekSet":
+        """Weeks a..b inclusive; empty when a > b."""
+        if a > b:
+            return cls()
+        if a < 0:
+            raise ValueError(f"negative week: {a}")
+        return cls(((1 << (b - a + 1)) - 1) << a)
+
+    @classmethod
+    def parse(cls, weeks_text: str) -> "WeekSet":
+        """Parse '1-8,10,12-17' (ASCII or Chinese commas); unknown parts are skipped."""
+        mask = 0
+        if not weeks_text:
+            return cls()
+        for part in weeks_text.replace("，", ",").split(","):
+            part = part.strip()
+            if not part:
+                continue
+            m = RX.week_range.match(part)
+            if m:
+                mask |= cls.from_range(int(m.group(1)), int(m.group(2))).mask
+            elif part.isdigit():
+                mask |= 1 << int(part)
+        return cls(mask)
+
+    def condense(self) -> str:
+        """Comma-separated runs, e.g. '1-8,10,12-17'."""
+        ranges = []
+        # Runs of set bits are runs of '1' in the little-endian binary string
+        for m in RX.bit_runs.finditer(bin(self.mask)[:1:-1]):
+            start, end = m.start(), m.end() - 1
+            ranges.append(str(start) if start == end else f"{start}-{end}")
+        return ",".join(ranges)
+
+    def to_list(self) -> list[int]:
+        return [i for i, bit in enumerate(bin(self.mask)[:1:-1]) if bit == "1"]
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __len__(self) -> int:
+        return self.mask.bit_count()
+
+    def __bool__(self) -> bool:
+        return bool(self.mask)
+
+    def __contains__(self, week) -> bool:
+        return isinstance(week, int) and week >= 0 and bool(self.mask >> week & 1)
+
+    def __or__(self, other: "WeekSet") -> "WeekSet":
+        return WeekSet(self.mask | other.mask)
+
+    def __and__(self, other: "WeekSet") -> "WeekSet":
+        return WeekSet(self.mask & other.mask)
+
+    def __sub__(self, other: "WeekSet") -> "WeekSet":
+        return WeekSet(self.mask & ~other.mask)
+
+    union = __or__
+    intersection = __and__
+    difference = __sub__
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, WeekSet):
+            return self.mask == other.mask
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.mask)
+
+    def __repr__(self) -> str:
+        return f"WeekSet({self.condense()!r})"
+
+
+class Course:
+    """Compact course record: weeks and periods as int bitmasks.
+
+    This is what the parser produces. It reads like a course dict
+    (``c["weeks"]``, ``c.get("day")``, ``"outside" in c``, ``dict(c)``), so
+    summarize_courses, build_ics and the GUI accept either form. Keys a dict
+    would not have (``day``/``outside`` on the other kind of course,
+    ``periods`` on outside courses) are stored as None and stay absent from
+    the view. Like weeks, periods come back sorted and de-duplicated, so a
+    non-contiguous ``[1, 3]`` round-trips unchanged.
+    """
+
+    __slots__ = ("name", "week_mask", "period_mask", "location",
+                 "teacher", "type", "type_char", "day", "outside")
+    KEYS = ("name", "periods", "weeks", "location", "teacher", "type", "type_char", "day", "outside")
+    _PLAIN = frozenset(("name", "location", "teacher", "type", "type_char", "day", "outside"))
+
+    def __init__(self, name: str = "", weeks=(), periods=None, location: str = "", teacher: str = "",
+                 type: str = "", type_char: str = "", day: str | None = None, outside: bool | None = None):
+        self.name = name
+        self.location = location
+        self.teacher = teacher
+        self.type = type
+        self.type_char = type_char
+        self.day = day
+        self.outside = outside
+        self["weeks"] = weeks
+        self["periods"] = periods
+
+    @classmethod
+    def from_dict(cls, d) -> "Course":
+        return cls(**{k: d[k] for k in cls.KEYS if k in d})
+
+    def to_dict(self) -> dict:
+        return {k: self[k] for k in self.keys()}
+
+    # Mapping view
+    def __getitem__(self, key: str):
+        if key == "weeks":
+            return WeekSet(self.week_mask).to_list()
+        if key == "periods":
+            if self.period_mask is None:
+                raise KeyError(key)
+            return WeekSet(self.period_mask).to_list()
+        if key in self._PLAIN:
+            v = getattr(self, key)
+            if v is None:
+                raise KeyError(key)
+            return v
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key == "weeks":
+            self.week_mask = WeekSet.from_weeks(value or ()).mask
+        elif key == "periods":
+            # None = no periods key (outside courses); [] = present but empty
+            self.period_mask = None if value is None else WeekSet.from_weeks(value).mask
+        elif key in self._PLAIN:
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    @property
+    def week_set(self) -> "WeekSet":
+        return WeekSet(self.week_mask)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key) -> bool:
+        if key == "weeks":
+            return True
+        if key == "periods":
+            return self.period_mask is not None
+        return key in self._PLAIN and getattr(self, key) is not None
+
+    def keys(self) -> list[str]:
+        return [k for k in self.KEYS if k in self]
+
+    def items(self) -> list[tuple]:
+        return [(k, self[k]) for k in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (Course, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Course({self.to_dict()!r})"
+
+
 def summarize_courses(courses: list[dict], is_chinese: bool) -> str:
     """Return a detailed, human-readable summary of parsed courses/events.
 
@@ -214,6 +914,7 @@ def summarize_courses(courses: list[dict], is_chinese: bool) -> str:
         name = (c.get("name", "") or "").strip()
         day = c.get("day") or ("outside" if c.get("outside") else "?")
         weeks = c.get("weeks", []) or []
+        week_set = c.week_set if isinstance(c, Course) else WeekSet.from_weeks(weeks)
         total_weeks += len(weeks)
         periods = c.get("periods", []) or []
         if periods:
@@ -236,53 +937,150 @@ def summarize_courses(courses: list[dict], is_chinese: bool) -> str:
         else:
             eff_loc = (loc if loc else ("未定" if is_chinese else "Not yet"))
         lines.append(
-            f"{i:02d}. [{day}] {ctype} weeks={len(weeks):2d} ({_condense_weeks(weeks)}) "
+            f"{i:02d}. [{day}] {ctype} weeks={len(weeks):2d} ({week_set.condense()}) "
             f"sections={pspan}{tspan} :: {name} @ {eff_loc} | {teacher}"
         )
     lines.append(f"Total week-occurrences (expected ~ event count): {total_weeks}")
     return "\n".join(lines)
 
 
+class PatternRegistry:
+    """Named regex patterns, each compiled on first use.
+
+    Values are a pattern string or a ``(pattern, flags)`` tuple. Importing the
+    module therefore compiles nothing; after its first lookup a pattern is a
+    plain instance attribute, so the parser's hot paths pay no extra cost.
+    """
+
+    def __init__(self, **sources):
+        self._sources = sources
+
+    def __getattr__(self, name: str):
+        try:
+            src = self.__dict__["_sources"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+        rx = re.compile(*src) if isinstance(src, tuple) else re.compile(src)
+        setattr(self, name, rx)
+        return rx
+
+
+# Parser patterns, grouped by locale. Patterns that mix EN and CN labels in
+# one alternation live in RX (shared).
+RX = PatternRegistry(
+    marker=r"[△★▲☆]",
+    marker_prefix=r"^(.*?)\s*([△★▲☆])",
+    marker_suffix=r"^(.*?)([△★▲☆])$",
+    marker_prefix_tight=r"^(.*?)([△★▲☆])",
+    whitespace=r"\s+",
+    multi_space=r"\s{2,}",
+    hyphen_spacing=r"\s*-\s*",
+    amp_spacing=r"\s*&\s*",
+    leading_noise=r"^[^A-Za-z\u4e00-\u9fff]+",
+    cjk_gap=r"([\u4e00-\u9fff])\s+([\u4e00-\u9fff])",
+    cjk=r"[\u4e00-\u9fff]",
+    any_space=r"\s",
+    week_range=r"^(\d+)-(\d+)$",
+    bit_runs=r"1+",
+    week_tokens=r"(\d+(?:-\d+)?)\s*周",
+    qq_group=r"课程QQ群号[：:]\s*(\d+)",
+    teacher_label=r"(Teacher[s]?|任课教师|教师|老师)\s*[:：]",
+    teacher_line=r"(Teacher[s]?|任课教师|教师|老师)\s*[:：]\s*(.+)$",
+    trailing_separator=r"\s*[|/;].*$",
+    camel_parts=r"[A-Z][a-z]*|[A-Z]+(?![a-z])|[a-z]+",
+    teacher_fallback_skip=(r"[△★▲☆]|周|节|校区|地点|场地|上课地点|实验|理论|技术|实践|Campus|Area|Teacher|Week|Credit", re.IGNORECASE),
+    stray_teacher_prefix=r"^(?:任课教师|教师|老师|师)\s*[:：]\s*\S+\s*",
+    non_digit=r"[^0-9]",
+    sec_number=r"^(\d+)$",
+    name_header=r"\b(Name|姓名)\s*:\s*([A-Za-z\u4e00-\u9fff\s.]{2,})",
+    id_header=(r"\b(Student\s*ID|ID|学号)\s*:\s*([A-Za-z0-9_-]{4,})", re.IGNORECASE),
+    term_direct=r"(\d{4})-(\d{4})-([1-2])",
+)
+
+RX_EN = PatternRegistry(
+    section=r"\((\d+)(?:-(\d+))?\s*Section\)",
+    weeks=r"Week\s*([0-9,\-\s]+)",
+    area=r"Area[:：]?\s*([^/;]+)",
+    campus=r"Campus[:：]?\s*([^/;]+)",
+    campus_word=(r"\bCampus\b", re.IGNORECASE),
+    campus_area=r"Campus/Area:([^/]+)",
+    teacher_simple=r"Teacher[s]?:\s*([A-Za-z\u4e00-\u9fff .]+)",
+    # Metadata keys printed inside cells (match anywhere, e.g. '/The class:')
+    meta_keys_inline=(r"(?:^|/|\s)(The class|The makeup of the class|Class selection remarks|Course\s*hours|Week\s*period|Credit)\s*[:：]", re.IGNORECASE),
+    meta_keys_start=(r"^(The class|The makeup of the class|Class selection remarks|Course\s*hours|Week\s*period|Credit)\s*[:：]", re.IGNORECASE),
+    meta_keys_word=(r"\b(The class|The makeup of the class|Class selection remarks|Course\s*hours|Week\s*period|Credit)\b", re.IGNORECASE),
+    meta_keys_tail=(r"\b(The class|The makeup of the class|Class selection remarks|Course\s*hours|Week\s*period|Credit)\s*[:：].*$", re.IGNORECASE),
+    continuation_cut=(r"[|/;]|\b(The class|The makeup of the class|Class selection remarks|Course\s*hours|Week\s*period|Credit)\b", re.IGNORECASE),
+    period_line=(r"^(?:Week\s*)?period\s*[:：]", re.IGNORECASE),
+    hours_line=(r"^hours\s*[:：]", re.IGNORECASE),
+    # Meta-line predicates: block splitter (labels right before ':') and name prelude (spaced labels)
+    meta_split=r"\(\d+(?:-\d+)?\s*Section\)|Week\b|(Campus|Area)[:：]|Teacher[s]?:",
+    meta_name=r"\(\d+(?:-\d+)?\s*Section\)|\bWeek\b|(Campus|Area)\s*[:：]|Teacher[s]?\s*[:：]",
+    name_cut=r"\(\d+(?:-\d+)?\s*Section\)|\bWeek\b",
+    label_tail=r"\b(Campus|Area|Teacher|Week)\s*[:：].*$",
+    stray_meta_prefix=(r"^(?:Week\s*period|period|hours|Credit)\s*[:：].*$", re.IGNORECASE),
+    person_name=r"[A-Za-z.'\s]{2,40}",
+    digits_or_punct=r"[0-9:/-]",
+    course_words=(r"(Project|Security|Design|Software|Training|College|Physical|China|Communication|National|Conditions|Analysis|Specification|Quality|Assurance|Testing)", re.IGNORECASE),
+    outside_prefix=(r"^(Practice course|Practical course|Other courses|实践课程|其它课程|其他课程)[:：]\s*", re.IGNORECASE),
+    outside_total=(r"\(total\s*\d+\s*week\)\s*", re.IGNORECASE),
+    outside_teacher=r"[△★▲☆]\s*([A-Za-z\u4e00-\u9fff][A-Za-z\u4e00-\u9fff\s]{0,30}?)(?=\(|/|Week|周|;|$)",
+    outside_weeks=r"Week[:\s]*([0-9,\-\s]+)",
+    outside_weeks_before=r"/([0-9,\-\s]+)\s*Week",
+    outside_not_yet=(r"Not Yet:?\s*([^;]+)", re.IGNORECASE),
+    curriculum=(r"\bCurriculum\b", re.IGNORECASE),
+    possessive=(r"'s\b", re.IGNORECASE),
+    academic_year=(r"\b\d{4}-\d{4}\b.*?academic\s*year\s*[1-2]\s*term", re.IGNORECASE),
+    student_id=(r"\bstudent\s*id\s*:\s*[A-Za-z0-9_-]+", re.IGNORECASE),
+    term=(r"(\d{4})-(\d{4}).{0,8}academic\s*year\s*([1-2])\s*term", re.IGNORECASE),
+)
+
+RX_CN = PatternRegistry(
+    section=r"\((\d+)(?:-(\d+))?\s*节\)",
+    weeks=r"第\s*([0-9,\-\s]+)\s*周",
+    campus=r"(校区|教学区)\s*[:：]?\s*([^/;]+)",
+    place=r"(场地|地点|上课地点)\s*[:：]?\s*([^/;]+)",
+    sec_number=r"^(\d+)\s*节",
+    meta_week_or_section=r"\(\d+(?:-\d+)?\s*节\)|第\s*[0-9,\-\s]+\s*周",
+    meta_split_labels=r"(校区|教学区|地点|上课地点|场地|任课教师|教师|老师)[:：]",
+    meta_name_labels=r"(校区|教学区|地点|上课地点|场地|任课教师|教师|老师)\s*[:：]",
+    label_tail=r"(校区|教学区|地点|上课地点|场地|任课教师|教师|老师)\s*[:：].*$",
+    not_name_words=r"(周|节|校区|地点|场地|上课地点|实验|理论|技术|实践)",
+    person_name=r"[\u4e00-\u9fff.\s]{2,16}",
+    outside_total=r"\(共\s*\d+\s*周\)\s*",
+    outside_qq=r"课程QQ群号[:]\s*(\d+)",
+    paren_open=r"\s*（\s*",
+    paren_close=r"\s*）\s*",
+    title_name=r"^\s*([A-Za-z\u4e00-\u9fff][A-Za-z\u4e00-\u9fff\s.\-']{1,}?)\s*(?:课表|课程表)\s*$",
+    term=r"(\d{4})-(\d{4})\s*学年\s*第\s*([一二三123])\s*学期",
+)
+
+# Unicode dashes → '-', fullwidth digits → ASCII
+_DASH_DIGIT_TRANS = {ord(ch): '-' for ch in "\u2010\u2011\u2012\u2013\u2014\u2212\ufe63\uff0d"}
+_DASH_DIGIT_TRANS.update({0xFF10 + i: ord('0') + i for i in range(10)})
+
+
 def parse_weeks(weeks_text: str) -> list[int]:
-    weeks = set()
-    if not weeks_text:
-        return []
-    # Normalize Chinese comma to ASCII comma
-    weeks_text = weeks_text.replace("，", ",")
-    for part in re.split(r",", weeks_text):
-        part = part.strip()
-        if not part:
-            continue
-        m = re.match(r"^(\d+)-(\d+)$", part)
-        if m:
-            a, b = int(m.group(1)), int(m.group(2))
-            if a <= b:
-                weeks.update(range(a, b + 1))
-        elif part.isdigit():
-            weeks.add(int(part))
-    return sorted(weeks)
+    return WeekSet.parse(weeks_text).to_list()
+
+
+def _expand_week_tokens(parts: list[str]) -> list[int]:
+    """Expand loose '2-5' / '17' tokens (from '…周' fallbacks) into sorted weeks."""
+    weeks = WeekSet()
+    for p in parts:
+        try:
+            if "-" in p:
+                a, b = p.split("-", 1)
+                weeks |= WeekSet.from_range(int(a), int(b))
+            else:
+                weeks |= WeekSet.from_weeks((int(p),))
+        except Exception:
+            pass
+    return weeks.to_list()
 
 
 def _condense_weeks(weeks: list[int]) -> str:
-    if not weeks:
-        return ""
-    w = sorted(set(weeks))
-    ranges = []
-    start = prev = w[0]
-    for x in w[1:]:
-        if x == prev + 1:
-            prev = x
-            continue
-        if start == prev:
-            ranges.append(str(start))
-        else:
-            ranges.append(f"{start}-{prev}")
-        start = prev = x
-    if start == prev:
-        ranges.append(str(start))
-    else:
-        ranges.append(f"{start}-{prev}")
-    return ",".join(ranges)
+    return WeekSet.from_weeks(weeks).condense()
 
 
 def split_blocks(cell_text: str) -> list[list[str]]:
@@ -293,7 +1091,7 @@ def split_blocks(cell_text: str) -> list[list[str]]:
     blocks: list[list[str]] = []
     cur: list[str] = []
     for ln in lines:
-        if re.search(r"[△★▲☆]", ln):
+        if RX.marker.search(ln):
             # Close previous block if any
             if cur:
                 blocks.append(cur)
@@ -315,11 +1113,10 @@ def split_blocks_by_marker(cell_text: str) -> list[str]:
     if not text:
         return []
     # If there is at least one marker, use positions to split into blocks
-    markers = list(re.finditer(r"[△★▲☆]", text))
-    if not markers:
+    idxs = [m.start() for m in RX.marker.finditer(text)]
+    if not idxs:
         return []
     # Start each block exactly at marker positions; ignore any leading pre-marker noise
-    idxs = [m.start() for m in markers]
     blocks: list[str] = []
     for i, st in enumerate(idxs):
         en = idxs[i + 1] if i + 1 < len(idxs) else len(text)
@@ -329,66 +1126,91 @@ def split_blocks_by_marker(cell_text: str) -> list[str]:
     return [b for b in blocks if b]
 
 
-def parse_block_text(block_text: str, fallback_period: int | None) -> dict | None:
+def _is_meta_line_name(ln: str) -> bool:
+    """Metadata line that must not be taken as part of a course-name prelude."""
+    if RX_EN.meta_name.search(ln):
+        return True
+    # Chinese meta indicators
+    if RX_CN.meta_week_or_section.search(ln):
+        return True
+    if RX_CN.meta_name_labels.search(ln):
+        return True
+    # Other metadata lines found in PDFs (match anywhere, not only at start, to catch '/The class:')
+    if RX_EN.meta_keys_inline.search(ln):
+        return True
+    # Broken lines where 'Week' split from 'period', or 'hours' alone
+    if RX_EN.period_line.search(ln):
+        return True
+    if RX_EN.hours_line.search(ln):
+        return True
+    # Otherwise, include as part of course title prelude (do not block generic English/CN lines)
+    return False
+
+
+def _is_probable_name_line_cn(ln: str) -> bool:
+    if not ln:
+        return False
+    if not RX.cjk.search(ln):
+        return False
+    if RX_CN.not_name_words.search(ln):
+        return False
+    return bool(RX_CN.person_name.fullmatch(ln))
+
+
+def _is_probable_name_line_en(ln: str) -> bool:
+    if not ln or RX_EN.digits_or_punct.search(ln):
+        return False
+    if not RX_EN.person_name.fullmatch(ln):
+        return False
+    tokens = ln.split()
+    if len(tokens) > 4:
+        return False
+    # Exclude common course words
+    if RX_EN.course_words.search(ln):
+        return False
+    return True
+
+
+def parse_block_text(block_text: str, fallback_period: int | None, ctx: "ParseContext | None" = None) -> dict | None:
     txt = (block_text or "").strip()
     if not txt:
         return None
+    lines = txt.split("\n")
+    # Find marker line index
+    for marker_line_idx, line in enumerate(lines):
+        if RX.marker.search(line):
+            return _parse_block_cached(tuple(lines), marker_line_idx, fallback_period, ctx)
+    return None
+
+
+def parse_block_lines(lines: list[str], marker_line_idx: int, fallback_period: int | None,
+                      ctx: "ParseContext | None" = None) -> dict | None:
+    """Parse one course block given as lines plus the index of its marker line.
+
+    ``lines`` must be the block text split on newlines with no leading or
+    trailing whitespace on the block as a whole (as produced by
+    ``split_cell_blocks`` or ``parse_block_text``).
+    """
+    txt = "\n".join(lines)
     # Normalize whitespace/newlines
-    flat = re.sub(r"\s+", " ", txt)
+    flat = RX.whitespace.sub(" ", txt)
     # Course name: combine prelude lines before the marker (excluding meta lines) with the marker line prefix
-    mpos = re.search(r"[△★▲☆]", txt)
-    if not mpos:
-        return None
-    mi = mpos.start()
-    lines = [l for l in txt.split("\n")]
-    # Find marker line index
-    acc = 0
-    marker_line_idx = 0
-    for idx, line in enumerate(lines):
-        acc_next = acc + len(line) + 1  # +1 for newline
-        if mi < acc_next:
-            marker_line_idx = idx
-            break
-        acc = acc_next
     marker_line = lines[marker_line_idx]
-    # Define meta-line predicate
-    has_teacher_label = bool(re.search(r"(Teacher[s]?|任课教师|教师|老师)\s*[:：]", txt))
-    def looks_like_person_name(ln: str) -> bool:
-        # A heuristic: a short line with only letters/CJK/dots/spaces
-        return bool(re.fullmatch(r"[A-Za-z\u4e00-\u9fff.\s]{2,40}", ln))
-    def is_meta_line_name(ln: str) -> bool:
-        if re.search(r"\(\d+(?:-\d+)?\s*Section\)|\bWeek\b|(Campus|Area)\s*[:：]|Teacher[s]?\s*[:：]", ln):
-            return True
-        # Chinese meta indicators
-        if re.search(r"\(\d+(?:-\d+)?\s*节\)|第\s*[0-9,\-\s]+\s*周", ln):
-            return True
-        if re.search(r"(校区|教学区|地点|上课地点|场地|任课教师|教师|老师)\s*[:：]", ln):
-            return True
-        # Other metadata lines found in PDFs (match anywhere, not only at start, to catch '/The class:')
-        if re.search(r"(?:^|/|\s)(The class|The makeup of the class|Class selection remarks|Course\s*hours|Week\s*period|Credit)\s*[:：]", ln, flags=re.IGNORECASE):
-            return True
-        # Broken lines where 'Week' split from 'period', or 'hours' alone
-        if re.search(r"^(?:Week\s*)?period\s*[:：]", ln, flags=re.IGNORECASE):
-            return True
-        if re.search(r"^hours\s*[:：]", ln, flags=re.IGNORECASE):
-            return True
-        # Otherwise, include as part of course title prelude (do not block generic English/CN lines)
-        return False
     # Collect name prelude from lines above marker line
     prelude_parts: list[str] = []
     j = marker_line_idx - 1
     while j >= 0:
         ln = (lines[j] or "").strip()
-        if not ln or is_meta_line_name(ln) or re.search(r"[△★▲☆]", ln):
+        if not ln or _is_meta_line_name(ln) or RX.marker.search(ln):
             break
         prelude_parts.append(ln)
         j -= 1
     prelude_parts.reverse()
     # Extract name prefix on the marker line up to marker
-    mname_line = re.search(r"^(.*?)\s*([△★▲☆])", marker_line)
+    mname_line = RX.marker_prefix.search(marker_line)
     if not mname_line:
         # Fallback to flattened prefix
-        mname_line = re.search(r"^(.*?)\s*([△★▲☆])", flat)
+        mname_line = RX.marker_prefix.search(flat)
         if not mname_line:
             return None
     type_char = mname_line.group(2)
@@ -396,17 +1218,17 @@ def parse_block_text(block_text: str, fallback_period: int | None) -> dict | Non
     name_raw = (" ".join(prelude_parts + [name_prefix])).strip()
     # Fix hyphen/connectors in EN titles
     # Remove spurious spaces around hyphens introduced by joins
-    name_raw = re.sub(r"\s*-\s*", "-", name_raw)
+    name_raw = RX.hyphen_spacing.sub("-", name_raw)
     # Merge common English connectors split by newlines: ensure single spaces around '&' and between words
-    name_raw = re.sub(r"\s*&\s*", " & ", name_raw)
-    name_raw = re.sub(r"\s{2,}", " ", name_raw)
+    name_raw = RX.amp_spacing.sub(" & ", name_raw)
+    name_raw = RX.multi_space.sub(" ", name_raw)
     original_name_raw = name_raw
     # Drop leading non-letter/CJK noise
-    name_raw = re.sub(r"^[^A-Za-z\u4e00-\u9fff]+", "", name_raw).strip()
+    name_raw = RX.leading_noise.sub("", name_raw).strip()
     # Sections: (a-b Section) or (n Section) or Chinese '(a-b节)' '(n节)'
-    sec_m = re.search(r"\((\d+)(?:-(\d+))?\s*Section\)", flat)
+    sec_m = RX_EN.section.search(flat)
     if not sec_m:
-        sec_m = re.search(r"\((\d+)(?:-(\d+))?\s*节\)", flat)
+        sec_m = RX_CN.section.search(flat)
     if sec_m:
         s1 = int(sec_m.group(1)); s2 = int(sec_m.group(2)) if sec_m.group(2) else s1
         periods = list(range(s1, s2 + 1))
@@ -414,55 +1236,39 @@ def parse_block_text(block_text: str, fallback_period: int | None) -> dict | Non
         periods = [fallback_period] if fallback_period else []
     # Weeks: EN Week / CN 第…周 / generic …周
     weeks: list[int] = []
-    w_m = re.search(r"Week\s*([0-9,\-\s]+)", flat)
+    w_m = RX_EN.weeks.search(flat)
     if w_m:
         weeks = parse_weeks(w_m.group(1).replace(" ", ""))
     else:
-        m_cn = re.search(r"第\s*([0-9,\-\s]+)\s*周", flat)
+        m_cn = RX_CN.weeks.search(flat)
         if m_cn:
             weeks = parse_weeks(m_cn.group(1).replace(" ", ""))
         else:
             # Fallback: collect occurrences like '2-5周' or '17周'
-            parts = re.findall(r"(\d+(?:-\d+)?)\s*周", flat)
+            parts = RX.week_tokens.findall(flat)
             if parts:
-                expanded: list[int] = []
-                for p in parts:
-                    if "-" in p:
-                        a, b = p.split("-", 1)
-                        try:
-                            a_i = int(a); b_i = int(b)
-                            if a_i <= b_i:
-                                expanded.extend(list(range(a_i, b_i + 1)))
-                        except Exception:
-                            pass
-                    else:
-                        try:
-                            expanded.append(int(p))
-                        except Exception:
-                            pass
-                if expanded:
-                    weeks = sorted(set(expanded))
+                weeks = _expand_week_tokens(parts)
     # Location: Area/Campus or CN 校区/教学区/地点; QQ optional
     loc = ""
-    qq_m = re.search(r"课程QQ群号[：:]\s*(\d+)", txt)
+    qq_m = RX.qq_group.search(txt)
     if qq_m:
         loc = f"Online {qq_m.group(1)}"
     else:
-        loc_m = re.search(r"Area[:：]?\s*([^/;]+)", flat)
+        loc_m = RX_EN.area.search(flat)
         if loc_m:
             loc = loc_m.group(1).strip()
     if not loc:
-        camp_m = re.search(r"Campus[:：]?\s*([^/;]+)", flat)
+        camp_m = RX_EN.campus.search(flat)
         if camp_m:
             loc = camp_m.group(1).strip()
     if not loc:
         # Chinese labels: use flattened text to capture multi-line values
         campus = None
         place = None
-        m_campus = re.search(r"(校区|教学区)\s*[:：]?\s*([^/;]+)", flat)
+        m_campus = RX_CN.campus.search(flat)
         if m_campus:
             campus = m_campus.group(2).strip()
-        m_place = re.search(r"(场地|地点|上课地点)\s*[:：]?\s*([^/;]+)", flat)
+        m_place = RX_CN.place.search(flat)
         if m_place:
             place = m_place.group(2).strip()
         if campus and place:
@@ -478,61 +1284,37 @@ def parse_block_text(block_text: str, fallback_period: int | None) -> dict | Non
     # Fallback: any line that contains the word 'Campus' (e.g., 'Main Campus  25-315')
     if not loc:
         for ln in lines:
-            if re.search(r"\bCampus\b", ln, flags=re.IGNORECASE):
+            if RX_EN.campus_word.search(ln):
                 # take the entire line as location candidate
                 loc = ln.strip()
                 break
     # Do not convert English 'Not yet' to 'Online' for in-table courses; keep as-is
     if loc:
         # fix hyphen spacing and CJK spacing
-        loc = re.sub(r"\s*-\s*", "-", loc)
-        loc = re.sub(r"([\u4e00-\u9fff])\s+([\u4e00-\u9fff])", r"\1\2", loc)
+        loc = RX.hyphen_spacing.sub("-", loc)
+        loc = RX.cjk_gap.sub(r"\1\2", loc)
     # tighten Chinese parentheses spacing
-    loc = re.sub(r"\s*（\s*", "（", loc)
-    loc = re.sub(r"\s*）\s*", "）", loc)
+    loc = RX_CN.paren_open.sub("（", loc)
+    loc = RX_CN.paren_close.sub("）", loc)
     # Teacher: after Teacher:/任课教师/教师/老师; gather short continuation lines
     teacher = ""
-    # Helpers to decide continuation
-    def is_probable_name_line_cn(ln: str) -> bool:
-        if not ln:
-            return False
-        if not re.search(r"[\u4e00-\u9fff]", ln):
-            return False
-        if re.search(r"(周|节|校区|地点|场地|上课地点|实验|理论|技术|实践)", ln):
-            return False
-        return bool(re.fullmatch(r"[\u4e00-\u9fff.\s]{2,16}", ln))
-
-    def is_probable_name_line_en(ln: str) -> bool:
-        if not ln or re.search(r"[0-9:/-]", ln):
-            return False
-        if not re.fullmatch(r"[A-Za-z.'\s]{2,40}", ln):
-            return False
-        tokens = ln.split()
-        if len(tokens) > 4:
-            return False
-        # Exclude common course words
-        course_words = r"(Project|Security|Design|Software|Training|College|Physical|China|Communication|National|Conditions|Analysis|Specification|Quality|Assurance|Testing)"
-        if re.search(course_words, ln, flags=re.IGNORECASE):
-            return False
-        return True
-
     for idx_ln, ln in enumerate(lines):
-        m_tline = re.search(r"(Teacher[s]?|任课教师|教师|老师)\s*[:：]\s*(.+)$", ln)
+        m_tline = RX.teacher_line.search(ln)
         if m_tline:
             teacher = m_tline.group(2).strip()
             # Cut at any trailing metadata marker on same line
-            teacher = re.split(r"\b(The class|The makeup of the class|Class selection remarks|Course\s*hours|Week\s*period|Credit)\b", teacher, maxsplit=1, flags=re.IGNORECASE)[0].strip()
+            teacher = RX_EN.meta_keys_word.split(teacher, maxsplit=1)[0].strip()
             # Collect continuation lines for Chinese or English teacher names, cautiously
             j = idx_ln + 1
             cont = []
             while j < len(lines) and len(cont) < 2:
                 nxt_raw = (lines[j] or "").strip()
                 # Stop if continuation line starts with metadata keys
-                if re.search(r"^(The class|The makeup of the class|Class selection remarks|Course\s*hours|Week\s*period|Credit)\s*[:：]", nxt_raw, flags=re.IGNORECASE):
+                if RX_EN.meta_keys_start.search(nxt_raw):
                     break
                 # Clean trailing separators and inline metadata from continuation line
-                nxt = re.split(r"[|/;]|\b(The class|The makeup of the class|Class selection remarks|Course\s*hours|Week\s*period|Credit)\b", nxt_raw, maxsplit=1, flags=re.IGNORECASE)[0].strip()
-                if (is_probable_name_line_cn(nxt) or is_probable_name_line_en(nxt)) and not re.search(r"[△★▲☆]", nxt):
+                nxt = RX_EN.continuation_cut.split(nxt_raw, maxsplit=1)[0].strip()
+                if (_is_probable_name_line_cn(nxt) or _is_probable_name_line_en(nxt)) and not RX.marker.search(nxt):
                     cont.append(nxt)
                     j += 1
                     continue
@@ -542,12 +1324,12 @@ def parse_block_text(block_text: str, fallback_period: int | None) -> dict | Non
             break
     # As a small cleanup, drop trailing icon hints or extra labels
     if teacher:
-        teacher = re.sub(r"\s*[|/;].*$", "", teacher).strip()
+        teacher = RX.trailing_separator.sub("", teacher).strip()
         # Collapse spaces between CJK characters (e.g., '吴 剑明' -> '吴剑明')
-        teacher = re.sub(r"([\u4e00-\u9fff])\s+([\u4e00-\u9fff])", r"\1\2", teacher)
+        teacher = RX.cjk_gap.sub(r"\1\2", teacher)
         # Normalize camel-case English names without spaces (e.g., WangZiYe -> Wang Zi Ye)
-        if not re.search(r"[\u4e00-\u9fff]", teacher) and not re.search(r"\s", teacher):
-            parts = re.findall(r"[A-Z][a-z]*|[A-Z]+(?![a-z])|[a-z]+", teacher)
+        if not RX.cjk.search(teacher) and not RX.any_space.search(teacher):
+            parts = RX.camel_parts.findall(teacher)
             if len(parts) >= 2:
                 teacher = " ".join(parts)
     if teacher:
@@ -558,7 +1340,7 @@ def parse_block_text(block_text: str, fallback_period: int | None) -> dict | Non
             name_raw = name_raw.replace(teacher, "").strip()
         else:
             # Remove trailing/leading teacher tokens (e.g., last surname) from edges
-            tokens = [t for t in re.split(r"\s+", teacher) if len(t) >= 3]
+            tokens = [t for t in RX.whitespace.split(teacher) if len(t) >= 3]
             changed = True
             while changed and name_raw:
                 changed = False
@@ -577,25 +1359,25 @@ def parse_block_text(block_text: str, fallback_period: int | None) -> dict | Non
             if not lns:
                 continue
             # Skip metadata/location/type/marker lines
-            if re.search(r"[△★▲☆]|周|节|校区|地点|场地|上课地点|实验|理论|技术|实践|Campus|Area|Teacher|Week|Credit", lns, flags=re.IGNORECASE):
+            if RX.teacher_fallback_skip.search(lns):
                 continue
-            if is_probable_name_line_cn(lns) or is_probable_name_line_en(lns):
+            if _is_probable_name_line_cn(lns) or _is_probable_name_line_en(lns):
                 teacher = lns
                 break
     # Clean up name: remove any metadata tokens if accidentally included (English & Chinese)
-    name_raw = re.sub(r"\b(Campus|Area|Teacher|Week)\s*[:：].*$", "", name_raw).strip()
-    name_raw = re.sub(r"(校区|教学区|地点|上课地点|场地|任课教师|教师|老师)\s*[:：].*$", "", name_raw).strip()
+    name_raw = RX_EN.label_tail.sub("", name_raw).strip()
+    name_raw = RX_CN.label_tail.sub("", name_raw).strip()
     # Remove other PDF metadata keys if they leaked into the name
-    name_raw = re.sub(r"\b(The class|The makeup of the class|Class selection remarks|Course\s*hours|Week\s*period|Credit)\s*[:：].*$", "", name_raw, flags=re.IGNORECASE).strip()
+    name_raw = RX_EN.meta_keys_tail.sub("", name_raw).strip()
     # Also cut before any inline '(n Section)'/'(n节)' or 'Week'/'第..周' tokens
-    name_raw = re.split(r"\(\d+(?:-\d+)?\s*Section\)|\bWeek\b", name_raw)[0].strip()
-    name_raw = re.split(r"\(\d+(?:-\d+)?\s*节\)|第\s*[0-9,\-\s]+\s*周", name_raw)[0].strip()
+    name_raw = RX_EN.name_cut.split(name_raw)[0].strip()
+    name_raw = RX_CN.meta_week_or_section.split(name_raw)[0].strip()
     # Extra cleanup for stray teacher fragments at start of the name (e.g., '师:王子烨 ...')
-    name_raw = re.sub(r"^(?:任课教师|教师|老师|师)\s*[:：]\s*\S+\s*", "", name_raw).strip()
+    name_raw = RX.stray_teacher_prefix.sub("", name_raw).strip()
     # Remove stray leading metadata fragments like 'period:3/ ...' or 'hours:Experiment:64/...'
-    name_raw = re.sub(r"^(?:Week\s*period|period|hours|Credit)\s*[:：].*$", "", name_raw, flags=re.IGNORECASE).strip()
+    name_raw = RX_EN.stray_meta_prefix.sub("", name_raw).strip()
     # Fix CJK spacing inside names
-    name_raw = re.sub(r"([\u4e00-\u9fff])\s+([\u4e00-\u9fff])", r"\1\2", name_raw)
+    name_raw = RX.cjk_gap.sub(r"\1\2", name_raw)
     # Fallback: if name became empty after cleanup, restore original marker-line name
     if not name_raw:
         name_raw = original_name_raw.strip()
@@ -606,45 +1388,48 @@ def parse_block_text(block_text: str, fallback_period: int | None) -> dict | Non
         "weeks": weeks,
         "location": loc,
         "teacher": teacher,
-        "type": TYPE_MAP.get(type_char, ""),
+        "type": _context(ctx).type_name(type_char),
         "type_char": type_char,
     }
 
 
+def _is_meta_line(ln: str) -> bool:
+    """Metadata line that stops the name-prelude backtrack in split_blocks_smart."""
+    # English meta
+    if RX_EN.meta_split.search(ln):
+        return True
+    # Chinese meta
+    if RX_CN.meta_week_or_section.search(ln):
+        return True
+    if RX_CN.meta_split_labels.search(ln):
+        return True
+    # Additional metadata keys to ignore in name prelude
+    if RX_EN.meta_keys_start.search(ln):
+        return True
+    if RX_EN.period_line.search(ln):
+        return True
+    if RX_EN.hours_line.search(ln):
+        return True
+    return False
+
+
 def split_blocks_smart(cell_text: str) -> list[list[str]]:
     """Smart block splitter: include name lines just above first marker; stop at next marker."""
     lines = [l.strip() for l in (cell_text or "").split("\n") if l and l.strip()]
     if not lines:
         return []
-    marker_idxs = [i for i, ln in enumerate(lines) if re.search(r"[△★▲☆]", ln)]
+    has_marker = [bool(RX.marker.search(ln)) for ln in lines]
+    marker_idxs = [i for i, m in enumerate(has_marker) if m]
     if not marker_idxs:
         return []
 
-    def is_meta_line(ln: str) -> bool:
-        # English meta
-        if re.search(r"\(\d+(?:-\d+)?\s*Section\)|Week\b|(Campus|Area)[:：]|Teacher[s]?:", ln):
-            return True
-        # Chinese meta
-        if re.search(r"\(\d+(?:-\d+)?\s*节\)|第\s*[0-9,\-\s]+\s*周", ln):
-            return True
-        if re.search(r"(校区|教学区|地点|上课地点|场地|任课教师|教师|老师)[:：]", ln):
-            return True
-        # Additional metadata keys to ignore in name prelude
-        if re.search(r"^(The class|The makeup of the class|Class selection remarks|Course\s*hours|Week\s*period|Credit)\s*[:：]", ln, flags=re.IGNORECASE):
-            return True
-        if re.search(r"^(?:Week\s*)?period\s*[:：]", ln, flags=re.IGNORECASE):
-            return True
-        if re.search(r"^hours\s*[:：]", ln, flags=re.IGNORECASE):
-            return True
-        return False
-
     blocks: list[list[str]] = []
     prev_marker = -1
     for idx_i, mi in enumerate(marker_idxs):
         # Backtrack to include name prelude
         start = mi
         j = mi - 1
-        while j > prev_marker and j >= 0 and not is_meta_line(lines[j]) and not re.search(r"[△★▲☆]", lines[j]):
+        while j > prev_marker and j >= 0 and not _is_meta_line(lines[j]) and not has_marker[j]:
             start = j
             j -= 1
         end = marker_idxs[idx_i + 1] if idx_i + 1 < len(marker_idxs) else len(lines)
@@ -654,63 +1439,220 @@ def split_blocks_smart(cell_text: str) -> list[list[str]]:
     return blocks
 
 
+def split_cell_blocks(cell_text: str) -> list[tuple[list[str], int]]:
+    """Split a cell into course blocks; fields are parsed later by ``parse_block_lines``.
+
+    Same blocks as ``split_blocks_smart`` followed by ``split_blocks_by_marker``
+    on every block, but each line is stripped and searched for markers once,
+    only name-prelude candidates are checked for metadata, and blocks are not
+    re-joined or re-split. Blocks are returned as ``(lines, marker_line_idx)``;
+    section, week, location and teacher patterns still run per block.
+    """
+    out: list[tuple[list[str], int]] = []
+    lines: list[str] = []
+    # Open block: start line, marker line, marker offsets on that line
+    start = mi = -1
+    marks: list[int] = []
+    for raw in (cell_text or "").split("\n"):
+        ln = raw.strip()
+        if not ln:
+            continue
+        pos = [m.start() for m in RX.marker.finditer(ln)]
+        if not pos:
+            lines.append(ln)
+            continue
+        if mi >= 0:
+            _emit_blocks(out, lines, start, mi, marks)
+        # Backtrack over the name prelude; the ranges never overlap, so this stays linear
+        start = len(lines)
+        while start - 1 > mi and not _is_meta_line(lines[start - 1]):
+            start -= 1
+        mi = len(lines)
+        marks = pos
+        lines.append(ln)
+    if mi >= 0:
+        _emit_blocks(out, lines, start, mi, marks)
+    return out
+
+
+def _emit_blocks(out: list, lines: list[str], start: int, mi: int, marks: list[int]) -> None:
+    block = lines[start:]
+    if len(marks) == 1:
+        out.append((block, mi - start))
+        return
+    # Several markers on one line: one sub-block per marker, dropping the name prelude
+    mline = lines[mi]
+    for i, p in enumerate(marks[:-1]):
+        out.append(([mline[p:marks[i + 1]].rstrip()], 0))
+    out.append(([mline[marks[-1]:]] + lines[mi + 1:], 0))
+
+
+# Block parsing memo. Identical cells repeat across rows of one timetable and
+# across the students of one class. Results are stored frozen and copied out
+# on every call, so callers may mutate them (see _backfill_teachers); the
+# locale-dependent "type" is filled in on the way out.
+PARSE_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _cell_blocks(cell_text: str) -> tuple:
+    return tuple((tuple(bl), mli) for bl, mli in split_cell_blocks(cell_text))
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_block_frozen(lines: tuple, marker_line_idx: int, fallback_period: int | None) -> tuple | None:
+    parsed = parse_block_lines(lines, marker_line_idx, fallback_period, CONTEXT_EN)
+    if parsed is None:
+        return None
+    parsed["periods"] = tuple(parsed["periods"])
+    parsed["weeks"] = tuple(parsed["weeks"])
+    return tuple(parsed.items())
+
+
+def _parse_block_cached(lines: tuple, marker_line_idx: int, fallback_period: int | None,
+                        ctx: "ParseContext | None" = None) -> dict | None:
+    frozen = _parse_block_frozen(lines, marker_line_idx, fallback_period)
+    if frozen is None:
+        return None
+    parsed = dict(frozen)
+    parsed["periods"] = list(parsed["periods"])
+    parsed["weeks"] = list(parsed["weeks"])
+    parsed["type"] = _context(ctx).type_name(parsed["type_char"])
+    return parsed
+
+
+def parse_cache_info() -> dict:
+    """Hit/miss counters of the cell and block parse caches (``functools`` CacheInfo)."""
+    return {"cells": _cell_blocks.cache_info(), "blocks": _parse_block_frozen.cache_info()}
+
+
+def parse_cache_clear() -> None:
+    _cell_blocks.cache_clear()
+    _parse_block_frozen.cache_clear()
+
+
 def trim_to_first_marker_line(text: str) -> str:
     lines = [l for l in (text or "").split("\n")]
     for i, ln in enumerate(lines):
-        if re.search(r"[△★▲☆]", ln):
+        if RX.marker.search(ln):
             return "\n".join(lines[i:]).strip()
     return text.strip()
 
 
-def merge_continuation_rows(headers: list[str], rows: list[list[str]]) -> list[list[str]]:
-    """Stitch PDF-split continuation rows (empty period/section + day fragments)."""
-    if not rows:
-        return rows
-    # Identify key columns
-    col_period = 0
-    col_section = 1
-    day_cols = [i for i in range(2, len(headers))]
-    out = [r[:] for r in rows]
-    # Track last non-empty row index per day column
-    last_nonempty_in_col: dict[int, int | None] = {j: None for j in day_cols}
-    for i, r in enumerate(out):
-        # If this looks like a continuation row (no period/section)
-        p = (r[col_period] or "").strip()
-        s = (r[col_section] or "").strip()
+class ContinuationMerger:
+    """Incremental ``merge_continuation_rows``.
+
+    ``feed`` takes one table row and returns the rows that can no longer
+    receive continuation fragments, in their original order. A row stays held
+    while it is the latest non-empty row of some day column (or a possible
+    safety-net target); ``finish`` releases whatever is left.
+    """
+
+    # Continuation fragments with no tracked target look back this many rows
+    LOOKBACK = 20
+
+    def __init__(self, headers: list[str]):
+        # Identify key columns
+        self.col_period = 0
+        self.col_section = 1
+        self.day_cols = [i for i in range(2, len(headers))]
+        # Track last non-empty row index per day column
+        self.last_nonempty_in_col: dict[int, int | None] = {j: None for j in self.day_cols}
+        self._held: dict[int, list[str] | None] = {}
+        self._next = 0
+
+    def feed(self, row: list[str]) -> list[list[str]]:
+        i = self._next
+        self._next += 1
+        r = row[:]
+        self._held[i] = r
+        held = self._held
+        # If this looks like a continuation row (no period/section)
+        p = (r[self.col_period] or "").strip()
+        s = (r[self.col_section] or "").strip()
         if p == "" and s == "":
             changed = False
-            for j in day_cols:
+            for j in self.day_cols:
                 frag = (r[j] or "").strip()
                 if not frag:
                     continue
                 # Typical fragments start with Campus/Area/Teachers/Week; accept any text
                 # Prefer the tracked last non-empty row for this column
-                prev_idx = last_nonempty_in_col.get(j)
+                prev_idx = self.last_nonempty_in_col.get(j)
                 # Safety net: if tracker is None (e.g., edge cases), scan a larger window
                 if prev_idx is None:
-                    for k in range(i - 1, max(-1, i - 20), -1):
-                        if (out[k][j] or "").strip():
+                    for k in range(i - 1, max(-1, i - self.LOOKBACK), -1):
+                        if held.get(k) and (held[k][j] or "").strip():
                             prev_idx = k
                             break
                 if prev_idx is not None:
                     # Append with newline
-                    base = out[prev_idx][j].rstrip()
+                    base = held[prev_idx][j].rstrip()
                     joiner = "\n" if not base.endswith("\n") else ""
-                    out[prev_idx][j] = base + joiner + frag
-                    out[i][j] = ""
+                    held[prev_idx][j] = base + joiner + frag
+                    r[j] = ""
                     changed = True
             # If we consumed all day columns, drop this row by marking a tombstone
-            if changed and all((out[i][j] or "").strip() == "" for j in day_cols) and p == "" and s == "":
-                out[i] = None
-            # Do NOT update tracker on pure continuation rows; continue to next row
-            continue
-        # Non-continuation row: update tracker after handling continuation logic
-        for j in day_cols:
-            if (r[j] or "").strip():
-                last_nonempty_in_col[j] = i
-    # Compact rows removing None
-    out2 = [r for r in out if r is not None]
-    return out2
+            if changed and all((r[j] or "").strip() == "" for j in self.day_cols):
+                held[i] = None
+            # Do NOT update tracker on pure continuation rows
+        else:
+            # Non-continuation row: update tracker after handling continuation logic
+            for j in self.day_cols:
+                if (r[j] or "").strip():
+                    self.last_nonempty_in_col[j] = i
+        return self._release(i)
+
+    def _release(self, i: int) -> list[list[str]]:
+        live = {k for k in self.last_nonempty_in_col.values() if k is not None}
+        untracked = [j for j, k in self.last_nonempty_in_col.items() if k is None]
+        if untracked:
+            for k, r in self._held.items():
+                if r is not None and k > i - self.LOOKBACK and any((r[j] or "").strip() for j in untracked):
+                    live.add(k)
+        out: list[list[str]] = []
+        for k in list(self._held):
+            if k in live:
+                break
+            r = self._held.pop(k)
+            if r is not None:
+                out.append(r)
+        return out
+
+    def finish(self) -> list[list[str]]:
+        # Compact rows removing tombstones
+        out = [r for r in self._held.values() if r is not None]
+        self._held.clear()
+        return out
+
+
+def merge_continuation_rows(headers: list[str], rows: list[list[str]]) -> list[list[str]]:
+    """Stitch PDF-split continuation rows (empty period/section + day fragments)."""
+    if not rows:
+        return rows
+    hook = _STAGE_HOOK.get()
+    t0 = time.perf_counter() if hook else 0.0
+    merger = ContinuationMerger(headers)
+    out: list[list[str]] = []
+    for r in rows:
+        out.extend(merger.feed(r))
+    out.extend(merger.finish())
+    if hook:
+        hook("merge_continuation_rows", time.perf_counter() - t0, {"rows": len(out)})
+    return out
+
+
+def _name_from_curriculum_title(s: str) -> str:
+    """'<NAME>'s … Curriculum' title (with possibly injected term/ID) → NAME, or ''."""
+    pre = RX_EN.possessive.split(s, maxsplit=1)[0]
+    # Normalize dashes/fullwidth digits
+    x = pre.translate(_DASH_DIGIT_TRANS)
+    # Remove academic year phrases like '2025-2026 academic year 1 term'
+    x = RX_EN.academic_year.sub(" ", x)
+    # Remove 'student ID: XXXXX'
+    x = RX_EN.student_id.sub(" ", x)
+    # Collapse spaces and trim
+    return " ".join(x.split()).strip(" -:·.")
 
 
 def extract_student_info(metadata_lines: list[str]) -> dict:
@@ -722,82 +1664,56 @@ def extract_student_info(metadata_lines: list[str]) -> dict:
     for line in metadata_lines or []:
         s = (line or "").replace("：", ":")
         # ID patterns
-        m = re.search(r"\b(Student\s*ID|ID|学号)\s*:\s*([A-Za-z0-9_-]{4,})", s, flags=re.IGNORECASE)
+        m = RX.id_header.search(s)
         if m and not info["id"]:
             info["id"] = m.group(2).strip()
         # Name patterns (optional)
-        m2 = re.search(r"\b(Name|姓名)\s*:\s*([A-Za-z\u4e00-\u9fff\s.]{2,})", s)
+        m2 = RX.name_header.search(s)
         if m2 and not info["name"]:
             info["name"] = " ".join(m2.group(2).split())
         # English header lines where term/ID is injected before 's Curriculum
-        if not info["name"] and re.search(r"\bCurriculum\b", s, flags=re.IGNORECASE) and "'s" in s:
-            pre = re.split(r"'s\b", s, maxsplit=1, flags=re.IGNORECASE)[0]
-            x = pre
-            # Normalize dashes/fullwidth digits
-            dash_chars = "\u2010\u2011\u2012\u2013\u2014\u2212\ufe63\uff0d"
-            trans = {ord(ch): '-' for ch in dash_chars}
-            for i in range(10):
-                trans[0xFF10 + i] = ord('0') + i
-            x = x.translate(trans)
-            # Remove academic year phrases like '2025-2026 academic year 1 term'
-            x = re.sub(r"\b\d{4}-\d{4}\b.*?academic\s*year\s*[1-2]\s*term", " ", x, flags=re.IGNORECASE)
-            # Remove 'student ID: XXXXX'
-            x = re.sub(r"\bstudent\s*id\s*:\s*[A-Za-z0-9_-]+", " ", x, flags=re.IGNORECASE)
-            # Collapse spaces and trim
-            cand = " ".join(x.split()).strip(" -:·.")
+        if not info["name"] and RX_EN.curriculum.search(s) and "'s" in s:
+            cand = _name_from_curriculum_title(s)
             if cand:
                 info["name"] = cand
         # Chinese title header: <NAME>课表 or <NAME>课程表
         if not info["name"]:
-            mtc = re.search(r"^\s*([A-Za-z\u4e00-\u9fff][A-Za-z\u4e00-\u9fff\s.\-']{1,}?)\s*(?:课表|课程表)\s*$", s)
+            mtc = RX_CN.title_name.search(s)
             if mtc:
                 info["name"] = " ".join(mtc.group(1).split())
     return info
 
 
-def extract_student_info_from_pdf(pdf_path: str, metadata_lines: list[str]) -> dict:
+def extract_student_info_from_pdf(source: "str | TimetableDocument", metadata_lines: list[str]) -> dict:
     """Extract student info using metadata lines first, then fallback to scanning PDF text.
 
     Handles title headers such as "<NAME>'s Curriculum" (EN) and "<NAME>课表/课程表" (CN)
-    that may not be part of table metadata rows.
+    that may not be part of table metadata rows. ``source`` may be a PDF path or an
+    open TimetableDocument whose cached page text is reused.
     """
     info = extract_student_info(metadata_lines or [])
     if info.get("name"):
         return info
     # Fallback: scan first 2 pages text
     try:
-        import pdfplumber  # type: ignore
-        with pdfplumber.open(pdf_path) as pdf:
-            pages = [p for i, p in enumerate(pdf.pages) if i < 2]
-            for p in pages:
-                txt = p.extract_text() or ""
-                # Normalize colons and spaces
-                lines = [l.strip() for l in txt.splitlines() if l.strip()]
-                for s in lines:
-                    if info.get("name"):
-                        break
-                    # English header: <NAME>'s … Curriculum (with possible injected term/ID)
-                    if re.search(r"\bCurriculum\b", s, flags=re.IGNORECASE) and "'s" in s:
-                        pre = re.split(r"'s\b", s, maxsplit=1, flags=re.IGNORECASE)[0]
-                        x = pre
-                        dash_chars = "\u2010\u2011\u2012\u2013\u2014\u2212\ufe63\uff0d"
-                        trans = {ord(ch): '-' for ch in dash_chars}
-                        for i in range(10):
-                            trans[0xFF10 + i] = ord('0') + i
-                        x = x.translate(trans)
-                        x = re.sub(r"\b\d{4}-\d{4}\b.*?academic\s*year\s*[1-2]\s*term", " ", x, flags=re.IGNORECASE)
-                        x = re.sub(r"\bstudent\s*id\s*:\s*[A-Za-z0-9_-]+", " ", x, flags=re.IGNORECASE)
-                        cand = " ".join(x.split()).strip(" -:·.")
-                        if cand:
-                            info["name"] = cand
-                            break
-                    # Chinese header: <NAME>课表 or <NAME>课程表
-                    m_cn = re.search(r"^\s*([A-Za-z\u4e00-\u9fff][A-Za-z\u4e00-\u9fff\s.\-']{1,}?)\s*(?:课表|课程表)\s*$", s)
-                    if m_cn and not info.get("name"):
-                        info["name"] = " ".join(m_cn.group(1).split())
-                        break
-                if info.get("name"):
+        doc, owned = _as_document(source)
+        try:
+            lines = doc.head_lines(2)
+        finally:
+            if owned:
+                doc.close()
+        for s in lines:
+            # English header: <NAME>'s … Curriculum (with possible injected term/ID)
+            if RX_EN.curriculum.search(s) and "'s" in s:
+                cand = _name_from_curriculum_title(s)
+                if cand:
+                    info["name"] = cand
                     break
+            # Chinese header: <NAME>课表 or <NAME>课程表
+            m_cn = RX_CN.title_name.search(s)
+            if m_cn and not info.get("name"):
+                info["name"] = " ".join(m_cn.group(1).split())
+                break
     except Exception:
         pass
     return info
@@ -810,7 +1726,25 @@ def extract_term_from_pdf(pdf_path: str) -> str | None:
     return m.group(1) if m else None
 
 
-def extract_term_from_content(pdf_path: str, metadata_lines: list[str]) -> str | None:
+def _term_from_lines(lines: list[str]) -> str | None:
+    cn_map = {"一": "1", "二": "2", "三": "3"}
+    for raw in lines or []:
+        s = (raw or "").translate(_DASH_DIGIT_TRANS)
+        m = RX.term_direct.search(s)
+        if m:
+            return f"{m.group(1)}-{m.group(2)}-{m.group(3)}"
+        m = RX_EN.term.search(s)
+        if m:
+            return f"{m.group(1)}-{m.group(2)}-{m.group(3)}"
+        m = RX_CN.term.search(s)
+        if m:
+            sem = cn_map.get(m.group(3), m.group(3))
+            if sem in ("1", "2"):
+                return f"{m.group(1)}-{m.group(2)}-{sem}"
+    return None
+
+
+def extract_term_from_content(source: "str | TimetableDocument", metadata_lines: list[str]) -> str | None:
     """Extract academic term (YYYY-YYYY-N) from content: metadata first, then page text.
 
     Handles Unicode dashes and CN/EN phrasing like:
@@ -818,50 +1752,19 @@ def extract_term_from_content(pdf_path: str, metadata_lines: list[str]) -> str |
     - 2025‑2026 academic year 1 term
     - 2025‑2026学年第1学期
     """
-    def norm(s: str) -> str:
-        if not s:
-            return ""
-        dash_chars = "\u2010\u2011\u2012\u2013\u2014\u2212\ufe63\uff0d"
-        trans = {ord(ch): '-' for ch in dash_chars}
-        for i in range(10):
-            trans[0xFF10 + i] = ord('0') + i
-        return s.translate(trans)
-
-    def from_text_list(lines: list[str]) -> str | None:
-        pat_direct = re.compile(r"(\d{4})-(\d{4})-([1-2])")
-        pat_en = re.compile(r"(\d{4})-(\d{4}).{0,8}academic\s*year\s*([1-2])\s*term", re.IGNORECASE)
-        pat_cn = re.compile(r"(\d{4})-(\d{4})\s*学年\s*第\s*([一二三123])\s*学期")
-        cn_map = {"一": "1", "二": "2", "三": "3"}
-        for raw in lines or []:
-            s = norm(raw)
-            m = pat_direct.search(s)
-            if m:
-                return f"{m.group(1)}-{m.group(2)}-{m.group(3)}"
-            m = pat_en.search(s)
-            if m:
-                return f"{m.group(1)}-{m.group(2)}-{m.group(3)}"
-            m = pat_cn.search(s)
-            if m:
-                sem = cn_map.get(m.group(3), m.group(3))
-                if sem in ("1", "2"):
-                    return f"{m.group(1)}-{m.group(2)}-{sem}"
-        return None
-
     # 1) Metadata lines
-    term = from_text_list(metadata_lines or [])
+    term = _term_from_lines(metadata_lines or [])
     if term:
         return term
     # 2) Fallback: scan first 2 pages text
     try:
-        import pdfplumber  # type: ignore
-        with pdfplumber.open(pdf_path) as pdf:
-            lines: list[str] = []
-            for i, p in enumerate(pdf.pages):
-                if i >= 2:
-                    break
-                txt = p.extract_text() or ""
-                lines.extend([l.strip() for l in txt.splitlines() if l.strip()])
-        return from_text_list(lines)
+        doc, owned = _as_document(source)
+        try:
+            lines = doc.head_lines(2)
+        finally:
+            if owned:
+                doc.close()
+        return _term_from_lines(lines)
     except Exception:
         return None
 
@@ -877,12 +1780,25 @@ def safe_filename(name: str) -> str:
     return s or 'Timetable'
 
 
-def compute_ics_output_path(pdf_path: str, metadata_lines: list[str], monday_date: str) -> tuple[str, str]:
+def compute_ics_output_path(source: "str | TimetableDocument", metadata_lines: list[str], monday_date: str) -> tuple[str, str]:
     """Compute ICS output path and calendar name '<StudentName> <Term>'."""
+    doc, owned = _as_document(source)
+    pdf_path = doc.pdf_path
+    try:
+        student_full = extract_student_info_from_pdf(doc, metadata_lines)
+        student_name = (student_full.get("name") or "").strip()
+        term_str = extract_term_from_content(doc, metadata_lines)
+    finally:
+        if owned:
+            doc.close()
+    return ics_output_path(pdf_path, student_name, term_str, monday_date)
+
+
+def ics_output_path(pdf_path: str, student_name: str | None, term: str | None, monday_date: str) -> tuple[str, str]:
+    """Same result as compute_ics_output_path, from an already known student name and term (no PDF access)."""
     pdf_dir = os.path.dirname(os.path.abspath(pdf_path))
-    student_full = extract_student_info_from_pdf(pdf_path, metadata_lines)
-    student_name = (student_full.get("name") or "").strip()
-    term_str = extract_term_from_content(pdf_path, metadata_lines) or derive_term_from_monday(monday_date)
+    student_name = (student_name or "").strip()
+    term_str = term or derive_term_from_monday(monday_date)
     base = safe_filename(f"{student_name} {term_str}" if student_name and term_str else (student_name or term_str or os.path.splitext(os.path.basename(pdf_path))[0]))
     return os.path.join(pdf_dir, f"{base}.ics"), base
 
@@ -904,19 +1820,19 @@ def derive_term_from_monday(monday_date: str) -> str:
     return f"{start}-{start+1}-{sem}"
 
 
-def parse_block(block_lines: list[str], fallback_period: int | None) -> dict | None:
+def parse_block(block_lines: list[str], fallback_period: int | None, ctx: "ParseContext | None" = None) -> dict | None:
     # Join for cross-line patterns
     joined = " ".join(block_lines)
     # Course name + type
     first = block_lines[0]
-    m = re.search(r"^(.*?)([△★▲☆])$", first)
+    m = RX.marker_suffix.search(first)
     if not m:
         return None
     name_raw = m.group(1).strip()
     type_char = m.group(2)
     course_name = name_raw
     # Section(s)
-    sec_m = re.search(r"\((\d+)(?:-(\d+))?\s*Section\)", joined)
+    sec_m = RX_EN.section.search(joined)
     if sec_m:
         s1 = int(sec_m.group(1))
         s2 = int(sec_m.group(2)) if sec_m.group(2) else s1
@@ -924,17 +1840,17 @@ def parse_block(block_lines: list[str], fallback_period: int | None) -> dict | N
     else:
         periods = [fallback_period] if fallback_period else []
     # Weeks
-    w_m = re.search(r"Week\s*([0-9,\-\s]+)", joined)
+    w_m = RX_EN.weeks.search(joined)
     weeks = parse_weeks(w_m.group(1).replace(" ", "")) if w_m else []
     # Location (Area)
     loc = None
-    loc_m = re.search(r"Campus/Area:([^/]+)", joined)
+    loc_m = RX_EN.campus_area.search(joined)
     if loc_m:
         loc = loc_m.group(1).strip()
         if loc in ("Not yet", "Notyet", "not yet"):
             loc = "Online"
     # Teacher
-    t_m = re.search(r"Teacher[s]?:\s*([A-Za-z\u4e00-\u9fff .]+)", joined)
+    t_m = RX_EN.teacher_simple.search(joined)
     teacher = t_m.group(1).strip() if t_m else ""
     return {
         "name": course_name.strip(),
@@ -942,11 +1858,12 @@ def parse_block(block_lines: list[str], fallback_period: int | None) -> dict | N
         "weeks": weeks,
         "location": loc or "",
         "teacher": teacher,
-        "type": TYPE_MAP.get(type_char, ""),
+        "type": _context(ctx).type_name(type_char),
     }
 
 
-def extract_courses_from_table(headers: list[str], rows: list[list[str]], preserve_newlines: bool) -> list[dict]:
+def _day_columns(headers: list[str]) -> dict[int, str]:
+    """Map column index → canonical day ('Mon'..'Sun') for EN and CN headers."""
     # Map day columns (English and Chinese)
     cn_day_map = {
         "周一": "Mon", "星期一": "Mon",
@@ -969,52 +1886,63 @@ def extract_courses_from_table(headers: list[str], rows: list[list[str]], preser
                 if key in hh_raw:
                     days.append((idx, eng))
                     break
-    day_by_col = {c: d for c, d in days}
-    courses: list[dict] = []
-    for row in rows:
-        if len(row) < 3:
+    return {c: d for c, d in days}
+
+
+def _courses_from_row(row: list[str], day_by_col: dict[int, str], preserve_newlines: bool,
+                      ctx: ParseContext, hook=None) -> list[Course]:
+    courses: list[Course] = []
+    if len(row) < 3:
+        return courses
+    # section number in column 2 (English 'Sections' or Chinese '节次/节')
+    sec_text = (row[1] or "").strip()
+    sec_num = None
+    m_sec = RX.sec_number.search(sec_text)
+    if not m_sec:
+        m_sec = RX_CN.sec_number.search(sec_text)
+    if m_sec:
+        try:
+            sec_num = int(m_sec.group(1))
+        except Exception:
+            sec_num = None
+    for c_idx in range(2, len(row)):
+        day = day_by_col.get(c_idx)
+        if not day:
             continue
-        # section number in column 2 (English 'Sections' or Chinese '节次/节')
-        sec_text = (row[1] or "").strip()
-        sec_num = None
-        m_sec = re.search(r"^(\d+)$", sec_text)
-        if not m_sec:
-            m_sec = re.search(r"^(\d+)\s*节", sec_text)
-        if m_sec:
-            try:
-                sec_num = int(m_sec.group(1))
-            except Exception:
-                sec_num = None
-        for c_idx in range(2, len(row)):
-            day = day_by_col.get(c_idx)
-            if not day:
-                continue
-            cell = row[c_idx] or ""
-            if not cell.strip():
-                continue
-            # Try line-based blocks first; if it fails, fallback to marker-based across full text
-            # Prefer smart splitting with preserved newlines
-            blocks = split_blocks_smart(cell) if preserve_newlines else []
-            blocks_text: list[str] = []
-            if blocks:
-                # If a block contains multiple markers (rare), split into sub-blocks
-                bt_list: list[str] = []
-                for bl in blocks:
-                    text_bl = "\n".join(bl)
-                    # Generic: if multiple markers are present, split into separate sub-blocks by markers
-                    subs = split_blocks_by_marker(text_bl)
-                    if subs and len(subs) > 1:
-                        bt_list.extend(subs)
-                    else:
-                        bt_list.append(text_bl)
-                blocks_text = bt_list
-            else:
-                blocks_text = split_blocks_by_marker(cell)
-            for bt in blocks_text:
-                parsed = parse_block_text(bt, sec_num)
-                if parsed and parsed.get("periods") and parsed.get("weeks"):
-                    parsed["day"] = day
-                    courses.append(parsed)
+        cell = row[c_idx] or ""
+        if not cell.strip():
+            continue
+        t0 = time.perf_counter() if hook else 0.0
+        n_before = len(courses)
+        # Line-based blocks with name preludes when newlines are preserved;
+        # otherwise split by marker positions across the flattened text
+        if preserve_newlines:
+            blocks = _cell_blocks(cell)
+            parsed_blocks = [_parse_block_cached(bl, mli, sec_num, ctx) for bl, mli in blocks]
+        else:
+            blocks = split_blocks_by_marker(cell)
+            parsed_blocks = [parse_block_text(bt, sec_num, ctx) for bt in blocks]
+        for parsed in parsed_blocks:
+            if parsed and parsed.get("periods") and parsed.get("weeks"):
+                parsed["day"] = day
+                courses.append(Course.from_dict(parsed))
+        if hook:
+            hook("extract_courses_from_table.cell", time.perf_counter() - t0,
+                 {"cells": 1, "blocks": len(blocks), "courses": len(courses) - n_before})
+    return courses
+
+
+def extract_courses_from_table(headers: list[str], rows: list[list[str]], preserve_newlines: bool,
+                               ctx: "ParseContext | None" = None) -> list[Course]:
+    hook = _STAGE_HOOK.get()
+    t0 = time.perf_counter() if hook else 0.0
+    day_by_col = _day_columns(headers)
+    ctx = _context(ctx)
+    courses: list[Course] = []
+    for row in rows:
+        courses.extend(_courses_from_row(row, day_by_col, preserve_newlines, ctx, hook))
+    if hook:
+        hook("extract_courses_from_table", time.perf_counter() - t0, {"rows": len(rows), "courses": len(courses)})
     return courses
 
 
@@ -1040,313 +1968,1434 @@ def _backfill_teachers(courses: list[dict]) -> None:
                 courses[i]["teacher"] = t
 
 
-def extract_outside_courses(metadata_lines: list[str]) -> list[dict]:
-    courses: list[dict] = []
+def extract_outside_courses(metadata_lines: list[str], ctx: "ParseContext | None" = None) -> list[Course]:
+    hook = _STAGE_HOOK.get()
+    t0 = time.perf_counter() if hook else 0.0
+    ctx = _context(ctx)
+    courses: list[Course] = []
     for line in metadata_lines:
         # Normalize punctuation variants
         text = (line or "").replace("：", ":").replace("（", "(").replace("）", ")").replace("；", ";")
         # Find course marker
-        m = re.search(r"^(.*?)([△★▲☆])", text)
+        m = RX.marker_prefix_tight.search(text)
         if not m:
             continue
         base = m.group(1).strip()
         # Strip category prefixes (English/Chinese)
-        base = re.sub(r"^(Practice course|Practical course|Other courses|实践课程|其它课程|其他课程)[:：]\s*", "", base, flags=re.IGNORECASE)
+        base = RX_EN.outside_prefix.sub("", base)
         # Remove '(total N week)' and '(共N周)'
-        base = re.sub(r"\(total\s*\d+\s*week\)\s*", "", base, flags=re.IGNORECASE)
-        base = re.sub(r"\(共\s*\d+\s*周\)\s*", "", base)
+        base = RX_EN.outside_total.sub("", base)
+        base = RX_CN.outside_total.sub("", base)
         type_char = m.group(2)
         # Teacher right after marker until (, /, 'Week', '周', ';'
         teacher = ""
-        mteach = re.search(r"[△★▲☆]\s*([A-Za-z\u4e00-\u9fff][A-Za-z\u4e00-\u9fff\s]{0,30}?)(?=\(|/|Week|周|;|$)", text)
+        mteach = RX_EN.outside_teacher.search(text)
         if mteach:
             teacher = mteach.group(1).strip()
         # Weeks (English or Chinese)
         weeks: list[int] = []
-        w_m = re.search(r"Week[:\s]*([0-9,\-\s]+)", text)
+        w_m = RX_EN.outside_weeks.search(text)
         if w_m:
             weeks = parse_weeks(w_m.group(1).replace(" ", ""))
         else:
-            w1 = re.search(r"/([0-9,\-\s]+)\s*Week", text)
+            w1 = RX_EN.outside_weeks_before.search(text)
             if w1:
                 weeks = parse_weeks(w1.group(1).replace(" ", ""))
             else:
-                wcn = re.search(r"第\s*([0-9,\-\s]+)\s*周", text)
+                wcn = RX_CN.weeks.search(text)
                 if wcn:
                     weeks = parse_weeks(wcn.group(1).replace(" ", ""))
                 else:
-                    parts = re.findall(r"(\d+(?:-\d+)?)\s*周", text)
+                    parts = RX.week_tokens.findall(text)
                     if parts:
-                        expanded: list[int] = []
-                        for p in parts:
-                            if "-" in p:
-                                a, b = p.split("-", 1)
-                                try:
-                                    a_i = int(a); b_i = int(b)
-                                    if a_i <= b_i:
-                                        expanded.extend(list(range(a_i, b_i + 1)))
-                                except Exception:
-                                    pass
-                            else:
-                                try:
-                                    expanded.append(int(p))
-                                except Exception:
-                                    pass
-                        if expanded:
-                            weeks = sorted(set(expanded))
+                        weeks = _expand_week_tokens(parts)
         # Location / QQ (English 'Not Yet' or Chinese '未定' + QQ)
         loc = ""
-        loc_m = re.search(r"Not Yet:?\s*([^;]+)", text, flags=re.IGNORECASE)
+        loc_m = RX_EN.outside_not_yet.search(text)
         if loc_m:
-            qq = re.sub(r"[^0-9]", "", loc_m.group(1))
+            qq = RX.non_digit.sub("", loc_m.group(1))
             loc = f"Online {qq}" if qq else "Online"
         else:
             if "未定" in text or "未排" in text:
-                qqm = re.search(r"课程QQ群号[:]\s*(\d+)", text)
+                qqm = RX_CN.outside_qq.search(text)
                 if qqm:
                     loc = f"Online {qqm.group(1)}"
                 else:
                     loc = "Online"
         # Append course
-        courses.append({
-            "name": base,
-            "teacher": teacher,
-            "weeks": weeks or [],
-            "location": loc or "",
-            "outside": True,
-            "type": TYPE_MAP.get(type_char, ""),
-            "type_char": type_char,
-        })
+        courses.append(Course(
+            name=base,
+            teacher=teacher,
+            weeks=weeks,
+            location=loc or "",
+            outside=True,
+            type=ctx.type_name(type_char),
+            type_char=type_char,
+        ))
+    if hook:
+        hook("extract_outside_courses", time.perf_counter() - t0, {"lines": len(metadata_lines), "courses": len(courses)})
     return courses
 
 
-def build_ics(
+ICS_PRODID = "-//ZJNU Timetable to Calendar//EN"
+DAY_INDEX = {"Mon": 0, "Tue": 1, "Wed": 2, "Thu": 3, "Fri": 4, "Sat": 5, "Sun": 6}
+
+
+def _ics_escape(text: str) -> str:
+    """Escape a TEXT property value (RFC 5545 §3.3.11)."""
+    return (
+        text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\n").replace("\r", "\n").replace("\n", "\\n")
+    )
+
+
+def _ics_fold(line: str) -> bytes:
+    """Encode one content line with CRLF, folded at 75 octets without splitting UTF-8 sequences."""
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return data + b"\r\n"
+    parts = []
+    start, limit = 0, 75
+    while len(data) - start > limit:
+        end = start + limit
+        # Step back off UTF-8 continuation bytes
+        while data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end])
+        # Continuation lines start with a space, which counts toward the 75
+        start, limit = end, 74
+    parts.append(data[start:])
+    return b"\r\n ".join(parts) + b"\r\n"
+
+
+_TZ_NAME = re.compile(r"[A-Za-z0-9_+\-]+(?:/[A-Za-z0-9_+\-]+)*")
+
+
+@functools.lru_cache(maxsize=16)
+def _zoneinfo(name: str):
+    """ZoneInfo for an IANA zone name; ValueError if the name is malformed or unknown."""
+    if not isinstance(name, str) or not _TZ_NAME.fullmatch(name):
+        raise ValueError(f"invalid time zone name: {name!r}")
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"unknown time zone: {name!r} (on Windows, install the tzdata package)") from None
+
+
+def _ics_utc_offset(seconds: int) -> str:
+    sign = "-" if seconds < 0 else "+"
+    h, m = divmod(abs(seconds) // 60, 60)
+    return f"{sign}{h:02d}{m:02d}"
+
+
+def ics_vtimezone(name: str, first: datetime, last: datetime) -> list[str]:
+    """VTIMEZONE content lines for zone ``name`` covering local times ``first``..``last``.
+
+    One observance for the zone's state at ``first`` plus one per UTC-offset
+    change up to ``last``, found by a daily scan and a bisection to the second.
+    """
+    zone = _zoneinfo(name)
+
+    def state(t: int):
+        local = datetime.fromtimestamp(t, zone)
+        return int(local.utcoffset().total_seconds()), bool(local.dst()), local.tzname() or name
+
+    lo = int(first.replace(tzinfo=timezone.utc).timestamp()) - 86400
+    hi = int(last.replace(tzinfo=timezone.utc).timestamp()) + 86400
+    observances = []
+    cur = state(lo)
+    observances.append((lo + cur[0], cur[0], cur))
+    for t in range(lo + 86400, hi + 86400, 86400):
+        nxt = state(t)
+        if nxt[0] == cur[0]:
+            cur = nxt
+            continue
+        a, b = t - 86400, t  # offset at a is cur's, at b is nxt's
+        while b - a > 1:
+            mid = (a + b) // 2
+            if state(mid)[0] == cur[0]:
+                a = mid
+            else:
+                b = mid
+        # An observance starts at the local time of the offset it replaces
+        observances.append((b + cur[0], cur[0], nxt))
+        cur = nxt
+    lines = ["BEGIN:VTIMEZONE", f"TZID:{name}"]
+    for wall, before, (after, dst, abbr) in observances:
+        kind = "DAYLIGHT" if dst else "STANDARD"
+        lines += [
+            f"BEGIN:{kind}",
+            f"DTSTART:{_ics_datetime(datetime.fromtimestamp(wall, timezone.utc))}",
+            f"TZOFFSETFROM:{_ics_utc_offset(before)}",
+            f"TZOFFSETTO:{_ics_utc_offset(after)}",
+            f"TZNAME:{_ics_escape(abbr)}",
+            f"END:{kind}",
+        ]
+    lines.append("END:VTIMEZONE")
+    return lines
+
+
+def _ics_datetime(dt: datetime) -> str:
+    return f"{dt.year:04d}{dt.month:02d}{dt.day:02d}T{dt.hour:02d}{dt.minute:02d}{dt.second:02d}"
+
+
+def _uid_domain(name: str) -> str:
+    s = (name or "").strip().lower()
+    s = s.replace("@", "-")
+    s = re.sub(r"[^a-z0-9.-]+", "-", s)
+    s = re.sub(r"-+", "-", s).strip("-")
+    return s or "timetable.local"
+
+
+class IcsWriter:
+    """Streams an RFC 5545 VCALENDAR to a binary file handle.
+
+    Lines are CRLF-terminated and folded at 75 octets as they are written;
+    every VEVENT carries DTSTAMP, so the output needs no post-processing.
+    ``tzid`` is None for floating local times; otherwise call vtimezone()
+    after begin() so the calendar defines the zone its events refer to.
+
+    ``previous`` is the state of an earlier calendar (see load_calendar_state):
+    events whose content changed get SEQUENCE bumped, and events no longer
+    produced are written once with STATUS:CANCELLED when the calendar ends;
+    a cancellation already in ``previous`` is dropped. With ``changes_only``
+    unchanged events are skipped, so the output is a delta. ``state``
+    collects the new calendar's full state for save_calendar_state.
+    """
+
+    def __init__(self, fh, tzid: str | None = None, dtstamp: datetime | None = None,
+                 previous: dict | None = None, changes_only: bool = False):
+        self.fh = fh
+        self.tzid = tzid
+        self.dtstamp = (dtstamp or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%SZ")
+        self.previous = previous or {}
+        self.changes_only = changes_only
+        self.state: dict[str, dict] = {}
+        self.events = 0
+
+    def line(self, text: str) -> None:
+        self.fh.write(_ics_fold(text))
+
+    def text(self, name: str, value: str) -> None:
+        self.line(f"{name}:{_ics_escape(value)}")
+
+    def begin(self, cal_name: str | None = None, cal_desc: str | None = None, tz: str | None = None) -> None:
+        self.line("BEGIN:VCALENDAR")
+        self.line("VERSION:2.0")
+        self.line(f"PRODID:{ICS_PRODID}")
+        self.line("CALSCALE:GREGORIAN")
+        self.line("METHOD:PUBLISH")
+        if cal_name:
+            self.text("X-WR-CALNAME", cal_name)
+        if cal_desc:
+            self.text("X-WR-CALDESC", cal_desc)
+        if tz:
+            self.text("X-WR-TIMEZONE", tz)
+
+    def vtimezone(self, first: datetime, last: datetime) -> None:
+        for text in ics_vtimezone(self.tzid, first, last):
+            self.line(text)
+
+    def end(self) -> None:
+        # Cancel whatever the previous calendar had that this one no longer produces;
+        # events it had already cancelled were announced then and are forgotten now
+        for uid, prev in self.previous.items():
+            if uid not in self.state and not prev.get("cancelled", False):
+                self._emit(uid, prev["props"], cancelled=True)
+        self.line("END:VCALENDAR")
+
+    def _dates(self, name: str, dts: list) -> str:
+        # Values are datetimes or preformatted 'YYYYMMDDTHHMMSS' stamps
+        value = ",".join(dt if isinstance(dt, str) else _ics_datetime(dt) for dt in dts)
+        if self.tzid:
+            return f"{name};TZID={self.tzid}:{value}"
+        return f"{name}:{value}"
+
+    def event(
+        self, uid: str, start: datetime | str, end: datetime | str, summary: str, location: str, description: str,
+        rrule: str | None = None, rdates: list = (), exdates: list = (),
+    ) -> None:
+        props = [self._dates("DTSTART", [start]), self._dates("DTEND", [end])]
+        if rrule:
+            props.append(f"RRULE:{rrule}")
+        if rdates:
+            props.append(self._dates("RDATE", rdates))
+        if exdates:
+            props.append(self._dates("EXDATE", exdates))
+        props.append(f"SUMMARY:{_ics_escape(summary)}")
+        props.append(f"LOCATION:{_ics_escape(location)}")
+        props.append(f"DESCRIPTION:{_ics_escape(description)}")
+        self._emit(uid, props)
+
+    def _emit(self, uid: str, props: list[str], cancelled: bool = False) -> None:
+        fingerprint = _ics_fingerprint(props)
+        prev = self.previous.get(uid)
+        unchanged = False
+        if prev is None:
+            sequence = 0
+        elif prev["fingerprint"] == fingerprint and prev.get("cancelled", False) == cancelled:
+            sequence = prev["sequence"]
+            unchanged = True
+        else:
+            sequence = prev["sequence"] + 1
+        self.state[uid] = {"sequence": sequence, "fingerprint": fingerprint, "cancelled": cancelled, "props": props}
+        if unchanged and self.changes_only:
+            return
+        self.line("BEGIN:VEVENT")
+        self.line(f"UID:{uid}")
+        self.line(f"DTSTAMP:{self.dtstamp}")
+        if sequence:
+            self.line(f"SEQUENCE:{sequence}")
+        if cancelled:
+            self.line("STATUS:CANCELLED")
+        for p in props:
+            self.line(p)
+        self.line("END:VEVENT")
+        self.events += 1
+
+
+def _ics_fingerprint(props: list[str]) -> str:
+    return hashlib.sha1("\n".join(props).encode("utf-8")).hexdigest()
+
+
+def load_calendar_state(path: str) -> dict[str, dict]:
+    """Per-UID state of an earlier calendar, read from its .ics or a saved manifest (.json).
+
+    Returns ``{uid: {"sequence", "fingerprint", "cancelled", "props"}}``; a
+    missing file yields an empty state.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    if path.lower().endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("events", {})
+    with open(path, "rb") as f:
+        raw = f.read().decode("utf-8", errors="replace")
+    # Unfold continuation lines, then collect each VEVENT's content lines
+    lines = raw.replace("\r\n", "\n").replace("\n ", "").replace("\n\t", "").split("\n")
+    state: dict[str, dict] = {}
+    props: list[str] | None = None
+    uid, sequence, cancelled = None, 0, False
+    for ln in lines:
+        if ln == "BEGIN:VEVENT":
+            props, uid, sequence, cancelled = [], None, 0, False
+        elif ln == "END:VEVENT" and props is not None:
+            if uid:
+                state[uid] = {"sequence": sequence, "fingerprint": _ics_fingerprint(props), "cancelled": cancelled, "props": props}
+            props = None
+        elif props is not None:
+            name = ln.split(":", 1)[0].split(";", 1)[0].upper()
+            if name == "UID":
+                uid = ln.split(":", 1)[1]
+            elif name == "SEQUENCE":
+                try:
+                    sequence = int(ln.split(":", 1)[1])
+                except Exception:
+                    sequence = 0
+            elif name == "STATUS":
+                cancelled = ln.split(":", 1)[1].upper() == "CANCELLED"
+            elif name != "DTSTAMP" and ln:
+                props.append(ln)
+    return state
+
+
+def save_calendar_state(state: dict[str, dict], path: str) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "events": state}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def event_uid(uid_dom: str, *identity) -> str:
+    """Stable UID from an event's identity (course, day, period span, week or slot)."""
+    digest = hashlib.sha1("|".join(str(x) for x in identity).encode("utf-8")).hexdigest()[:20]
+    return f"class-{digest}@{uid_dom}"
+
+
+def weekly_recurrence(weeks: WeekSet) -> tuple[int, int, list[int], list[int]]:
+    """Cheapest weekly recurrence for a set of weeks.
+
+    Returns ``(interval, count, exdate_weeks, rdate_weeks)`` for an event whose
+    DTSTART falls in the first week: ``RRULE:FREQ=WEEKLY;INTERVAL=interval;COUNT=count``
+    minus the EXDATE weeks plus the RDATE weeks reproduces ``weeks`` exactly.
+    Every interval up to the span and every COUNT along it is tried (so
+    odd/even-week courses become INTERVAL=2, and ``1-8,20`` becomes COUNT=8
+    plus one RDATE), and the one with the fewest listed dates wins; ``count``
+    0 means no RRULE is worth it and every later week is an RDATE.
+    """
+    ws = weeks.to_list()
+    if not ws:
+        return 0, 0, [], []
+    first = ws[0]
+    present = set(ws)
+    # (cost, interval, count); the RRULE line itself counts as one entry
+    best = (len(ws) - 1, 0, 0)
+    for k in range(1, ws[-1] - first + 1):
+        # Extend the run one occurrence at a time: a listed week leaves the
+        # RDATEs, a missing one joins the EXDATEs
+        ex, rd = 0, len(ws) - 1
+        for count, w in enumerate(range(first + k, ws[-1] + 1, k), start=2):
+            if w in present:
+                rd -= 1
+            else:
+                ex += 1
+            cost = 1 + ex + rd
+            # Ties prefer an RRULE over plain RDATEs, then the smaller interval and count
+            if cost < best[0] or (cost == best[0] and best[1] == 0):
+                best = (cost, k, count)
+    _, k, count = best
+    if not count:
+        return 0, 0, [], ws[1:]
+    prog = WeekSet.from_weeks(range(first, first + (count - 1) * k + 1, k))
+    return k, count, (prog - weeks).to_list(), (weeks - prog).to_list()
+
+
+class TermCalendar:
+    """(week, weekday) → date table for one term.
+
+    Week 1 starts on ``monday`` and weekday 0 is Monday. Dates for the first
+    ``weeks`` weeks are formatted up front and later ones on first use, so
+    expanding an occurrence is integer arithmetic plus a table lookup.
+    """
+
+    def __init__(self, monday, weeks: int = 25):
+        if isinstance(monday, str):
+            monday = datetime.strptime(monday, "%Y-%m-%d")
+        self.monday = datetime(monday.year, monday.month, monday.day)
+        self._ordinal = self.monday.toordinal()
+        self._days: dict[tuple[int, int], str] = {}
+        for w in range(1, weeks + 1):
+            for d in range(7):
+                self._days[(w, d)] = self._format_day(w, d)
+
+    def _format_day(self, week: int, weekday: int) -> str:
+        d = date.fromordinal(self._ordinal + (week - 1) * 7 + weekday)
+        return f"{d.year:04d}{d.month:02d}{d.day:02d}"
+
+    def day(self, week: int, weekday: int) -> str:
+        """'YYYYMMDD' of the given week/weekday."""
+        s = self._days.get((week, weekday))
+        if s is None:
+            s = self._days[(week, weekday)] = self._format_day(week, weekday)
+        return s
+
+    def stamp(self, week: int, weekday: int, minute: int) -> str:
+        """iCalendar local DATE-TIME for ``minute`` minutes after midnight (may roll past midnight)."""
+        extra, minute = divmod(minute, 1440)
+        return f"{self.day(week, weekday + extra)}T{minute // 60:02d}{minute % 60:02d}00"
+
+    def timestamp(self, week: int, weekday: int, minute: int) -> int:
+        """Seconds since 1970-01-01 of the local wall-clock time, with no time zone applied."""
+        return ((self._ordinal - _EPOCH_ORDINAL + (week - 1) * 7 + weekday) * 1440 + minute) * 60
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def iter_occurrences(courses: list[dict]):
+    """Yield ``(course_index, week, weekday, start_minute, end_minute)`` for every class meeting.
+
+    Table courses meet on their day in SECTION_MINUTES of their period span;
+    courses with unknown periods are skipped. Outside courses take one-hour
+    Sunday slots from 14:00, handed out in order within each week.
+    """
+    outside_week_slots: dict[int, int] = {}  # week -> count
+    for i, course in enumerate(courses):
+        weeks = course.get("weeks", [])
+        if course.get("outside", False):
+            for w in weeks:
+                idx = outside_week_slots.get(w, 0)
+                outside_week_slots[w] = idx + 1
+                start = (14 + idx) * 60
+                yield i, w, 6, start, start + 60
+            continue
+        periods = course.get("periods", [])
+        if not periods:
+            continue
+        t_start = SECTION_MINUTES.get(min(periods))
+        t_end = SECTION_MINUTES.get(max(periods))
+        if not t_start or not t_end:
+            continue
+        weekday = DAY_INDEX.get(course.get("day"), 0)
+        for w in weeks:
+            yield i, w, weekday, t_start[0], t_end[1]
+
+
+def expand_occurrences(courses: list[dict], monday_date) -> tuple[array, array, array]:
+    """Expand courses × weeks into parallel arrays ``(course_index, start, end)``.
+
+    ``start``/``end`` are int64 wall-clock seconds as in TermCalendar.timestamp;
+    the arrays support the buffer protocol (e.g. ``numpy.frombuffer(start, "int64")``).
+    """
+    if isinstance(monday_date, TermCalendar):
+        ordinal = monday_date._ordinal
+    else:
+        ordinal = TermCalendar(monday_date, weeks=0)._ordinal
+    index, starts, ends = array("q"), array("q"), array("q")
+    base = (ordinal - _EPOCH_ORDINAL) * 86400
+    for i, w, wd, s, e in iter_occurrences(courses):
+        day = base + ((w - 1) * 7 + wd) * 86400
+        index.append(i)
+        starts.append(day + s * 60)
+        ends.append(day + e * 60)
+    return index, starts, ends
+
+
+def _write_recurring(writer: "IcsWriter", uid: str, term: TermCalendar, weeks: WeekSet, weekday: int,
+                     start: int, end: int, summary: str, location: str, description: str) -> None:
+    interval, count, ex, rd = weekly_recurrence(weeks)
+    first = next(iter(weeks))
+    rrule = None
+    if count:
+        rrule = f"FREQ=WEEKLY;COUNT={count}" if interval == 1 else f"FREQ=WEEKLY;INTERVAL={interval};COUNT={count}"
+    writer.event(
+        uid, term.stamp(first, weekday, start), term.stamp(first, weekday, end), summary, location, description,
+        rrule=rrule,
+        rdates=[term.stamp(w, weekday, start) for w in rd],
+        exdates=[term.stamp(w, weekday, start) for w in ex],
+    )
+
+
+def write_ics(
     courses: list[dict],
     monday_date: str,
-    output_path: str,
+    fh,
     tz: str = "Asia/Shanghai",
     tz_mode: str = "floating",
     cal_name: str | None = None,
     cal_desc: str | None = None,
     uid_domain: str | None = None,
     chinese: bool = False,
-) -> None:
-    if Calendar is None or Event is None:
-        print("ics library not available; cannot generate calendar.")
-        return
-    cal = Calendar()
-    # Day index
-    day_to_idx = {"Mon": 0, "Tue": 1, "Wed": 2, "Thu": 3, "Fri": 4, "Sat": 5, "Sun": 6}
-    monday = datetime.strptime(monday_date, "%Y-%m-%d")
-    # For scheduling outside courses per week (Saturday at 14:00+)
-    outside_week_slots: dict[int, int] = {}  # week -> count
+    recurring: bool = False,
+    previous: dict | str | None = None,
+    changes_only: bool = False,
+    manifest: str | None = None,
+) -> int:
+    """Write the calendar for ``courses`` to the binary file handle ``fh``; returns the VEVENT count.
+
+    With ``recurring`` each course slot becomes one VEVENT with RRULE/EXDATE/RDATE
+    (see weekly_recurrence) instead of one VEVENT per week.
+
+    UIDs are derived from course name, type, day, period span and week (or
+    slot), so they survive courses being added or removed. ``previous`` (a
+    state dict, or the path of an earlier .ics or manifest) enables SEQUENCE
+    tracking and cancellations, and ``manifest`` saves the new state as JSON
+    for the next run. ``changes_only`` writes just the delta; a delta .ics
+    does not hold the full state, so it requires ``manifest`` and the next
+    run should pass that manifest as ``previous``. These options are library
+    API only; the CLI always writes full calendars.
+    """
+    if changes_only and not manifest:
+        raise ValueError("changes_only requires manifest= (a delta .ics cannot serve as the next previous=)")
+    hook = _STAGE_HOOK.get()
+    t0 = time.perf_counter() if hook else 0.0
+    term = TermCalendar(monday_date)
 
-    # Time handling
+    # Time handling: 'utc' keeps floating local times like 'floating'
     tz_mode = (tz_mode or "floating").lower()
     if tz_mode not in ("floating", "tzid", "utc"):
         tz_mode = "floating"
-    tzinfo = None
-    if tz_mode == "tzid" and ZoneInfo and tz:
-        try:
-            tzinfo = ZoneInfo(tz)
-        except Exception:
-            tzinfo = None
-
-    # UID domain
-    def to_domain(name: str) -> str:
-        s = (name or "").strip().lower()
-        s = s.replace("@", "-")
-        s = re.sub(r"[^a-z0-9.-]+", "-", s)
-        s = re.sub(r"-+", "-", s).strip("-")
-        return s or "timetable.local"
-    uid_dom = uid_domain or to_domain((cal_name or "alraimi-timetable"))
-    uid_prefix = "class"
-    uid_counter = 1
+    tzid = tz if tz_mode == "tzid" and tz else None
+    if tzid:
+        _zoneinfo(tzid)  # ValueError before anything is written
+    if isinstance(previous, str):
+        previous = load_calendar_state(previous)
+    writer = IcsWriter(fh, tzid=tzid, previous=previous, changes_only=changes_only)
+    writer.begin(cal_name, cal_desc, tz)
+    if tzid:
+        # A year from week 1 covers any term, including weeks past the table's 25
+        writer.vtimezone(term.monday, datetime.fromordinal(term.monday.toordinal() + 366))
+
+    uid_dom = uid_domain or _uid_domain(cal_name or "alraimi-timetable")
+    seen_uids: dict[str, int] = {}
+
+    def uid_for(*identity) -> str:
+        uid = event_uid(uid_dom, *identity)
+        # Identical identities (a course listed twice) get a stable ordinal
+        n = seen_uids.get(uid, 0)
+        seen_uids[uid] = n + 1
+        return uid if n == 0 else event_uid(uid_dom, *identity, n)
 
     # Localized labels
     label_teacher = "任课教师" if chinese else "Teacher"
     label_online = "线上" if chinese else "Online"
+    not_yet = "未定" if chinese else "Not yet"
 
+    # Per-course text: summary, location, description and UID identity
+    info = []
     for course in courses:
         name = course["name"].strip()
         teacher = course.get("teacher", "")
         location = course.get("location", "")
-        weeks = course.get("weeks", [])
-        is_outside = course.get("outside", False)
-        if is_outside:
-            # Outside: 1-hour on Sunday from 14:00, sequential per week
-            for w in weeks:
-                idx = outside_week_slots.get(w, 0)
-                start_hour = 14 + idx
-                outside_week_slots[w] = idx + 1
-                day_idx = 6  # Sunday
-                class_date = monday + timedelta(days=day_idx, weeks=w - 1)
-                # Build start/end according to tz mode
-                naive = datetime.strptime(f"{class_date.date()} {start_hour:02d}:00", "%Y-%m-%d %H:%M")
-                start_dt = naive
-                end_dt = start_dt + timedelta(hours=1)
-                ev = Event()
-                disp = f"{name} {course.get('type','').strip()}".strip()
-                ev.name = disp
-                ev.begin = start_dt
-                ev.end = end_dt
-                # Default to Online location for outside items when missing
-                ev.location = location or label_online
-                # Single-line description (avoid raw newlines for importer compatibility)
-                ev.description = f"{label_teacher}: {teacher} ({label_online})".strip()
-                # Consistent UID domain
-                ev.uid = f"{uid_prefix}-{uid_counter:04d}@{uid_dom}"
-                uid_counter += 1
-                cal.events.add(ev)
-            continue
+        disp = f"{name} {course.get('type','').strip()}".strip()
+        type_char = course.get("type_char", "")
+        if course.get("outside", False):
+            # Default to Online location for outside items when missing
+            info.append((disp, location or label_online, f"{label_teacher}: {teacher} ({label_online})".strip(),
+                         (name, type_char, "outside")))
+        else:
+            periods = course.get("periods") or [0]
+            # In-table empty location → Not yet/未定; single-line description only
+            info.append((disp, location or not_yet, f"{label_teacher}: {teacher}".strip(),
+                         (name, type_char, course.get("day"), min(periods), max(periods))))
+
+    if recurring:
+        # One VEVENT per course slot: same course, weekday and times
+        slots: dict[tuple, list[int]] = {}
+        for i, w, wd, s, e in iter_occurrences(courses):
+            slots.setdefault((i, wd, s, e), []).append(w)
+        for (i, wd, s, e), weeks in slots.items():
+            disp, loc, desc, identity = info[i]
+            tag = f"{s // 60}h" if courses[i].get("outside", False) else "weekly"
+            _write_recurring(writer, uid_for(*identity, tag), term, WeekSet.from_weeks(weeks), wd, s, e, disp, loc, desc)
+    else:
+        for i, w, wd, s, e in iter_occurrences(courses):
+            disp, loc, desc, identity = info[i]
+            writer.event(uid_for(*identity, w), term.stamp(w, wd, s), term.stamp(w, wd, e), disp, loc, desc)
 
-        day = course.get("day")
-        day_idx = day_to_idx.get(day, 0)
-        periods = course.get("periods", [])
-        if not periods:
-            continue
-        p_start, p_end = min(periods), max(periods)
-        t_start = SECTION_TIMES.get(p_start)
-        t_end = SECTION_TIMES.get(p_end)
-        if not t_start or not t_end:
-            continue
-        for w in weeks:
-            class_date = monday + timedelta(days=day_idx, weeks=w - 1)
-            naive_start = datetime.strptime(f"{class_date.date()} {t_start[0]}", "%Y-%m-%d %H:%M")
-            naive_end = datetime.strptime(f"{class_date.date()} {t_end[1]}", "%Y-%m-%d %H:%M")
-            start_dt = naive_start
-            end_dt = naive_end
-            ev = Event()
-            disp = f"{name} {course.get('type','').strip()}".strip()
-            ev.name = disp
-            ev.begin = start_dt
-            ev.end = end_dt
-            # In-table empty location → Not yet/未定
-            if not location:
-                ev.location = ("未定" if chinese else "Not yet")
-            else:
-                ev.location = location
-            # Single-line description only
-            ev.description = f"{label_teacher}: {teacher}".strip()
-            # Consistent UID domain
-            ev.uid = f"{uid_prefix}-{uid_counter:04d}@{uid_dom}"
-            uid_counter += 1
-            cal.events.add(ev)
-
-    # Serialize ICS (ensure CRLF)
+    writer.end()
+    if manifest:
+        save_calendar_state(writer.state, manifest)
+    if hook:
+        hook("write_ics", time.perf_counter() - t0, {"courses": len(courses), "events": writer.events})
+    return writer.events
+
+
+def build_ics(
+    courses: list[dict],
+    monday_date: str,
+    output_path: str,
+    tz: str = "Asia/Shanghai",
+    tz_mode: str = "floating",
+    cal_name: str | None = None,
+    cal_desc: str | None = None,
+    uid_domain: str | None = None,
+    chinese: bool = False,
+    recurring: bool = False,
+    previous: dict | str | None = None,
+    changes_only: bool = False,
+    manifest: str | None = None,
+) -> int:
+    # Read the previous state first: it may be the very file being replaced
+    if isinstance(previous, str):
+        previous = load_calendar_state(previous)
+    with open(output_path, "wb") as f:
+        events = write_ics(
+            courses, monday_date, f, tz=tz, tz_mode=tz_mode, cal_name=cal_name,
+            cal_desc=cal_desc, uid_domain=uid_domain, chinese=chinese, recurring=recurring,
+            previous=previous, changes_only=changes_only, manifest=manifest,
+        )
+    print(f"Calendar exported: {output_path} (events: {events})")
+    return events
+
+
+def _parse_timetable(tables: list) -> tuple[list, list[str], bool]:
+    """Analysis stage: extracted tables → (courses, metadata lines, is_chinese)."""
+    # Merge while preserving newlines for robust block parsing
+    headers, rows, meta, _, is_chinese = merge_main_table(tables, collapse_newlines=False)
+    if not headers:
+        raise ValueError("Could not detect main timetable header")
+    # Stitch continuation fragments split by PDF extraction
+    rows = merge_continuation_rows(headers, rows)
+    # Chinese or English type names for titles, for this conversion only
+    ctx = parse_context(is_chinese)
+    courses = extract_courses_from_table(headers, rows, preserve_newlines=True, ctx=ctx) + extract_outside_courses(meta, ctx)
+    if not courses:
+        raise ValueError("No courses detected")
+    return courses, meta, is_chinese
+
+
+def _describe_timetable(doc: "TimetableDocument", meta: list[str], monday_date: str) -> dict:
+    """Analysis stage: output path, calendar name and UID domain from the PDF text."""
+    # One name/term lookup serves both the file name and the UID domain
+    info = extract_student_info_from_pdf(doc, meta)
+    term = extract_term_from_content(doc, meta) or derive_term_from_monday(monday_date)
+    ics_output, base = ics_output_path(doc.pdf_path, info.get("name"), term, monday_date)
+    # Use student ID for ASCII-only fields where names may contain Chinese
+    student_id = info.get("id")
+    term_ascii = re.sub(r"[^0-9-]", "", term or "")
+    return {
+        "pdf": doc.pdf_path,
+        "output": ics_output,
+        "cal_name": base,
+        "cal_desc": f"Generated timetable starting Monday {monday_date}",
+        "uid_domain": (f"{student_id}.{term_ascii}" if student_id and term_ascii else (student_id or term_ascii or None)),
+    }
+
+
+def analyze_timetable(source: "str | TimetableDocument", monday_date: str) -> dict:
+    """Extract and parse one timetable PDF without writing anything.
+
+    Returns ``{"pdf", "courses", "is_chinese", "output", "cal_name", "cal_desc",
+    "uid_domain"}``, where ``courses`` is a list of Course records and
+    ``output`` is the default .ics path beside the PDF.
+    Raises ValueError when the date is malformed or no timetable/courses can
+    be found.
+    """
+    datetime.strptime(monday_date, "%Y-%m-%d")
+    # Open the PDF once; every extraction step below reuses its parsed pages
+    doc, owned = _as_document(source)
     try:
-        content = "".join(cal.serialize_iter())
-    except Exception:
-        content = str(cal)
-
-    # Ensure CALSCALE/METHOD/X-WR-* and add DTSTAMP per VEVENT
-    def fix_ics_content(text: str) -> str:
-    # Normalize to CRLF
-        txt = text.replace("\r\n", "\n").replace("\r", "\n")
-        lines = txt.split("\n")
-        out: list[str] = []
-        # Insert CALSCALE + METHOD after VERSION if missing
-        inserted_headers = False
-        saw_version = False
-        had_calscale = any(l.startswith("CALSCALE:") for l in lines)
-        had_method = any(l.startswith("METHOD:") for l in lines)
-        had_calname = any(l.startswith("X-WR-CALNAME:") for l in lines)
-        had_caldesc = any(l.startswith("X-WR-CALDESC:") for l in lines)
-        had_tz_header = any(l.startswith("X-WR-TIMEZONE:") for l in lines)
-        for i, l in enumerate(lines):
-            out.append(l)
-            if not inserted_headers and l.startswith("VERSION:"):
-                saw_version = True
-                if not had_calscale:
-                    out.append("CALSCALE:GREGORIAN")
-                if not had_method:
-                    out.append("METHOD:PUBLISH")
-                # Add calendar name/description if provided and not already present
-                if cal_name and not had_calname:
-                    out.append(f"X-WR-CALNAME:{cal_name}")
-                if cal_desc and not had_caldesc:
-                    out.append(f"X-WR-CALDESC:{cal_desc}")
-                if tz and not had_tz_header:
-                    out.append(f"X-WR-TIMEZONE:{tz}")
-                inserted_headers = True
-        # If VERSION header wasn't found for some reason, still ensure name/desc exist near top
-        if not inserted_headers:
-            hdr_injected: list[str] = []
-            injected = False
-            for l in out:
-                hdr_injected.append(l)
-                if not injected and l == "BEGIN:VCALENDAR":
-                    if not had_calscale:
-                        hdr_injected.append("CALSCALE:GREGORIAN")
-                    if not had_method:
-                        hdr_injected.append("METHOD:PUBLISH")
-                    if cal_name and not had_calname:
-                        hdr_injected.append(f"X-WR-CALNAME:{cal_name}")
-                    if cal_desc and not had_caldesc:
-                        hdr_injected.append(f"X-WR-CALDESC:{cal_desc}")
-                    if tz and not had_tz_header:
-                        hdr_injected.append(f"X-WR-TIMEZONE:{tz}")
-                    injected = True
-            out = hdr_injected
-    # Add DTSTAMP if missing
-        fixed: list[str] = []
-        in_event = False
-        buf: list[str] = []
-        have_dtstamp = False
-        utc_now = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
-        for l in out:
-            if l == "BEGIN:VEVENT":
-                in_event = True
-                buf = [l]
-                have_dtstamp = False
+        # Detect tables (use 'lines' strategy by default for robustness)
+        courses, meta, is_chinese = _parse_timetable(extract_tables(doc, strategy="lines"))
+        res = _describe_timetable(doc, meta, monday_date)
+    finally:
+        if owned:
+            doc.close()
+    res.update(courses=courses, is_chinese=is_chinese)
+    return res
+
+
+def write_analysis_ics(analysis: dict, monday_date: str, fh, tz: str = "Asia/Shanghai",
+                       tz_mode: str = "floating", recurring: bool = False) -> int:
+    """Write the calendar of an ``analyze_timetable`` result to a binary file handle."""
+    return write_ics(
+        analysis["courses"],
+        monday_date,
+        fh,
+        tz=tz,
+        tz_mode=tz_mode,
+        cal_name=analysis["cal_name"],
+        cal_desc=analysis["cal_desc"],
+        uid_domain=analysis["uid_domain"],
+        chinese=analysis["is_chinese"],
+        recurring=recurring,
+    )
+
+
+def convert_pdf(
+    pdf_path: str,
+    monday_date: str,
+    output_dir: str | None = None,
+    tz: str = "Asia/Shanghai",
+    tz_mode: str = "floating",
+    recurring: bool = False,
+) -> dict:
+    """Convert one timetable PDF to .ics without prompting.
+
+    The .ics is named '<StudentName> <Term>.ics' and written beside the PDF,
+    or into ``output_dir``. Returns the ``analyze_timetable`` result with the
+    final ``output`` path and the ``events`` count.
+    """
+    res = analyze_timetable(pdf_path, monday_date)
+    if output_dir:
+        res["output"] = os.path.join(output_dir, os.path.basename(res["output"]))
+    with open(res["output"], "wb") as f:
+        res["events"] = write_analysis_ics(res, monday_date, f, tz=tz, tz_mode=tz_mode, recurring=recurring)
+    return res
+
+
+def _monday_str(monday) -> str:
+    return monday.strftime("%Y-%m-%d") if isinstance(monday, date) else monday
+
+
+async def _run_stage(executor, fn, *args):
+    """Run one stage in ``executor``; if cancelled, wait for the stage to finish, then re-raise.
+
+    The thread cannot be interrupted, so returning early would let the caller
+    clean up (close the document, delete the temp PDF) under a running stage.
+    """
+    import asyncio
+    # Run in a copy of the caller's context so its instrument() hook applies
+    ctx = contextvars.copy_context()
+    fut = asyncio.get_running_loop().run_in_executor(executor, functools.partial(ctx.run, fn, *args))
+    try:
+        return await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        while not fut.done():
+            try:
+                await asyncio.wait([fut])
+            except asyncio.CancelledError:
                 continue
-            if in_event:
-                if l.startswith("DTSTAMP:"):
-                    have_dtstamp = True
-                # Time handling adjustments for DTSTART/DTEND
-                if l.startswith("DTSTART") or l.startswith("DTEND"):
-                    if tz_mode == "floating" or tz_mode == "utc":
-                        # Remove TZID and Z to keep floating local times
-                        if l.startswith("DTSTART;") or l.startswith("DTEND;"):
-                            key_params, val = l.split(":", 1)
-                            key = key_params.split(";", 1)[0]
-                            l = f"{key}:{val}"
-                        if l.endswith("Z"):
-                            l = l[:-1]
-                    elif tz_mode == "tzid":
-                        # Ensure TZID is present and no trailing Z
-                        if l.startswith("DTSTART:"):
-                            _, val = l.split(":", 1)
-                            l = f"DTSTART;TZID={tz}:{val}"
-                        elif l.startswith("DTEND:"):
-                            _, val = l.split(":", 1)
-                            l = f"DTEND;TZID={tz}:{val}"
-                        # If already had TZID, leave as-is
-                        if l.endswith("Z"):
-                            l = l[:-1]
-                if l == "END:VEVENT":
-                    if not have_dtstamp:
-                        # Insert DTSTAMP after BEGIN:VEVENT
-                        buf.insert(1, f"DTSTAMP:{utc_now}")
-                    buf.append(l)
-                    fixed.extend(buf)
-                    in_event = False
-                    buf = []
-                else:
-                    buf.append(l)
-            else:
-                fixed.append(l)
-        # Ensure CRLF line endings
-        return "\r\n".join([x for x in fixed if x is not None and x != ""]) + "\r\n"
+        if not fut.cancelled():
+            # Retrieve the outcome so a failing stage is not logged as unretrieved
+            fut.exception()
+        raise
+
+
+async def analyze(pdf: "bytes | str", monday: "date | str", executor=None) -> dict:
+    """Coroutine version of ``analyze_timetable`` for asyncio services.
+
+    ``pdf`` is the PDF bytes or a path. Table extraction, parsing and name/term
+    detection each run in ``executor`` (the loop's default thread pool when
+    None), so the event loop never blocks on pdfplumber. Cancelling the task
+    stops the pipeline at the next stage boundary: the stage already running
+    finishes in its thread, and only then is the document closed and the
+    temporary PDF removed. The stages share one open document, so
+    ``executor`` must be thread-based. For bytes, ``pdf`` is None and
+    ``output`` is only the file name.
+    """
+    monday_date = _monday_str(monday)
+    datetime.strptime(monday_date, "%Y-%m-%d")
+    tmp = None
+    if isinstance(pdf, (bytes, bytearray, memoryview)):
+        import tempfile
+        fd, tmp = tempfile.mkstemp(suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf)
+        pdf = tmp
+    doc = TimetableDocument(pdf)
+    try:
+        tables = await _run_stage(executor, extract_tables, doc, "lines")
+        courses, meta, is_chinese = await _run_stage(executor, _parse_timetable, tables)
+        res = await _run_stage(executor, _describe_timetable, doc, meta, monday_date)
+    finally:
+        doc.close()
+        if tmp:
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+    if tmp:
+        # Uploaded bytes have no home directory; keep just the file name
+        res.update(pdf=None, output=os.path.basename(res["output"]))
+    res.update(courses=courses, is_chinese=is_chinese)
+    return res
 
-    content = fix_ics_content(content)
 
-    with open(output_path, "wb") as f:
-        f.write(content.encode("utf-8"))
-    print(f"Calendar exported: {output_path} (events: {len(cal.events)})")
+async def write_calendar(analysis: dict, monday: "date | str", tz: str = "Asia/Shanghai",
+                         tz_mode: str = "floating", recurring: bool = False, executor=None) -> tuple[bytes, int]:
+    """Render an analysis to .ics bytes in ``executor``; returns ``(ics_bytes, events)``."""
+    import io
+
+    def render() -> tuple[bytes, int]:
+        buf = io.BytesIO()
+        events = write_analysis_ics(analysis, _monday_str(monday), buf, tz=tz, tz_mode=tz_mode, recurring=recurring)
+        return buf.getvalue(), events
+
+    return await _run_stage(executor, render)
+
+
+async def convert(
+    pdf: "bytes | str",
+    monday: "date | str",
+    tz: str = "Asia/Shanghai",
+    tz_mode: str = "floating",
+    recurring: bool = False,
+    executor=None,
+) -> dict:
+    """Asyncio conversion: ``analyze`` then ``write_calendar``, without blocking the loop.
+
+    Returns the analysis dict plus ``"ics"`` (the calendar bytes) and
+    ``"events"``. Nothing is written to disk except a temporary copy of
+    uploaded bytes.
+    """
+    res = await analyze(pdf, monday, executor=executor)
+    res["ics"], res["events"] = await write_calendar(res, monday, tz=tz, tz_mode=tz_mode,
+                                                     recurring=recurring, executor=executor)
+    return res
+
+
+def expand_pdf_inputs(inputs: list[str]) -> list[str]:
+    """Expand files, glob patterns and directories (searched recursively) into unique PDF paths."""
+    out: list[str] = []
+    seen: set[str] = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            found = sorted(glob.glob(os.path.join(glob.escape(item), "**", "*.pdf"), recursive=True)
+                           + glob.glob(os.path.join(glob.escape(item), "**", "*.PDF"), recursive=True))
+        elif glob.has_magic(item):
+            found = sorted(p for p in glob.glob(item, recursive=True) if os.path.isfile(p))
+        else:
+            found = [item]
+        for p in found:
+            key = os.path.normcase(os.path.abspath(p))
+            if key not in seen:
+                seen.add(key)
+                out.append(p)
+    return out
+
 
+def _convert_job(pdf_path: str, options: dict) -> dict:
+    """Batch worker: convert one PDF and report the outcome instead of raising.
+
+    The calendar is written to a temporary ``"part"`` file beside its final
+    ``"output"`` path; ``run_batch`` moves it into place. With
+    ``options["stats"]`` the result carries the job's StageStats totals.
+    """
+    import uuid
+    options = dict(options)
+    stats = StageStats() if options.pop("stats", False) else None
+    monday_date = options.pop("monday_date")
+    output_dir = options.pop("output_dir", None)
+    part = None
+    try:
+        if not os.path.isfile(pdf_path):
+            raise FileNotFoundError("PDF not found")
+        with instrument(stats):
+            res = analyze_timetable(pdf_path, monday_date)
+            if output_dir:
+                res["output"] = os.path.join(output_dir, os.path.basename(res["output"]))
+            out_dir, name = os.path.split(os.path.abspath(res["output"]))
+            part = os.path.join(out_dir, f".{name}.{uuid.uuid4().hex[:12]}.part")
+            with open(part, "wb") as f:
+                events = write_analysis_ics(res, monday_date, f, **options)
+        out = {"pdf": pdf_path, "ok": True, "output": res["output"], "part": part,
+               "courses": len(res["courses"]), "events": events}
+    except Exception as e:
+        if part and os.path.exists(part):
+            os.remove(part)
+        out = {"pdf": pdf_path, "ok": False, "error": str(e) or type(e).__name__}
+    if stats is not None:
+        out["stats"] = stats.to_dict()
+    return out
+
+
+def _claim_output(res: dict, claimed: dict[str, str]) -> None:
+    """Give a finished batch result its own output path.
+
+    The first input (in input order) for a path keeps it; later ones get
+    ``<name> (2).ics``, ``<name> (3).ics``… and ``"same_output_as"`` names the
+    input that kept the original.
+    """
+    if not res["ok"]:
+        return
+    path = res["output"]
+    key = os.path.normcase(os.path.abspath(path))
+    if key in claimed:
+        res["same_output_as"] = claimed[key]
+        stem, ext = os.path.splitext(path)
+        n = 2
+        while os.path.normcase(os.path.abspath(f"{stem} ({n}){ext}")) in claimed:
+            n += 1
+        path = f"{stem} ({n}){ext}"
+        key = os.path.normcase(os.path.abspath(path))
+        res["output"] = path
+    claimed[key] = res["pdf"]
+
+
+def _place_output(res: dict) -> None:
+    """Move a claimed batch result's part file to its output path."""
+    if not res["ok"]:
+        return
+    part = res.pop("part")
+    try:
+        os.replace(part, res["output"])
+    except OSError as e:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        res.update(ok=False, error=str(e) or type(e).__name__)
+
+
+def run_batch(pdfs: list[str], options: dict, jobs: int = 1, on_result=None, on_clash=None) -> list[dict]:
+    """Convert many PDFs, optionally in a process pool; results keep the input order.
+
+    ``jobs`` 0 uses one process per CPU. Inputs that resolve to the same
+    .ics never overwrite each other: outputs are claimed in input order
+    (see ``_claim_output``), so the names are the same for any ``jobs``.
+    ``on_clash`` is called with a renamed result before its file is moved
+    into place, and ``on_result`` with each result, in input order, after.
+    """
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    results: list[dict | None] = [None] * len(pdfs)
+    claimed: dict[str, str] = {}
+    done = 0
+
+    def flush():
+        # Claim outputs for the finished prefix of the input list
+        nonlocal done
+        while done < len(results) and results[done] is not None:
+            _claim_output(results[done], claimed)
+            if on_clash and results[done].get("same_output_as"):
+                on_clash(results[done])
+            _place_output(results[done])
+            if on_result:
+                on_result(results[done])
+            done += 1
+
+    if jobs <= 1 or len(pdfs) <= 1:
+        for i, pdf in enumerate(pdfs):
+            results[i] = _convert_job(pdf, options)
+            flush()
+        return results
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=min(jobs, len(pdfs))) as ex:
+        futures = {ex.submit(_convert_job, pdf, options): i for i, pdf in enumerate(pdfs)}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                results[i] = fut.result()
+            except Exception as e:
+                # The worker process died (e.g. killed); report it like any other failure
+                results[i] = {"pdf": pdfs[i], "ok": False, "error": str(e) or type(e).__name__}
+            flush()
+    return results
+
+
+def _format_result(res: dict) -> str:
+    if res["ok"]:
+        return f"OK    {res['pdf']} -> {res['output']} ({res['courses']} courses, {res['events']} events)"
+    return f"FAIL  {res['pdf']}: {res['error']}"
+
+
+def batch_main(argv: list[str]) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(
+        prog="zjnu-ics",
+        description="Convert ZJNU timetable PDFs to .ics calendars. Run without arguments for the interactive prompt.",
+    )
+    ap.add_argument("inputs", nargs="+", help="PDF files, glob patterns or directories")
+    ap.add_argument("--monday", required=True, help="Monday of week 1 (YYYY-MM-DD)")
+    ap.add_argument("--tz-mode", choices=("floating", "tzid", "utc"), default="floating")
+    ap.add_argument("--tz", default="Asia/Shanghai", help="time zone for --tz-mode tzid and X-WR-TIMEZONE")
+    ap.add_argument("--output-dir", help="write .ics files here instead of beside each PDF")
+    ap.add_argument("--recurring", action="store_true", help="one VEVENT per course slot (RRULE/EXDATE/RDATE)")
+    ap.add_argument("-j", "--jobs", type=int, default=1, help="parallel worker processes (0 = one per CPU)")
+    ap.add_argument("--json", action="store_true", help="print the per-file report as JSON")
+    ap.add_argument("--stats", action="store_true", help="print per-stage timings and counters")
+    ap.add_argument("--stats-json", metavar="PATH", help="write per-stage timings and counters as JSON")
+    args = ap.parse_args(argv)
+    try:
+        datetime.strptime(args.monday, "%Y-%m-%d")
+    except Exception:
+        ap.error("--monday must be YYYY-MM-DD")
+    if args.tz_mode == "tzid":
+        try:
+            _zoneinfo(args.tz)
+        except ValueError as e:
+            ap.error(str(e))
+    pdfs = expand_pdf_inputs(args.inputs)
+    if not pdfs:
+        ap.error("no PDF files matched")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    options = {
+        "monday_date": args.monday,
+        "output_dir": args.output_dir,
+        "tz": args.tz,
+        "tz_mode": args.tz_mode,
+        "recurring": args.recurring,
+        "stats": bool(args.stats or args.stats_json),
+    }
+    on_result = on_clash = None
+    if not args.json:
+        on_result = lambda res: print(_format_result(res), flush=True)
+        # Inputs for the same student and term must not overwrite each other
+        on_clash = lambda res: print(f"WARN  {res['pdf']}: same output as {res['same_output_as']}, "
+                                     f"writing {res['output']}", flush=True)
+    results = run_batch(pdfs, options, jobs=args.jobs, on_result=on_result, on_clash=on_clash)
+    failed = sum(1 for r in results if not r["ok"])
+    stats = StageStats()
+    for r in results:
+        stats.merge(r.pop("stats", {}))
+    if args.stats_json:
+        stats.write_json(args.stats_json)
+    if args.json:
+        # Inputs for the same student and term were renamed; see "same_output_as"
+        report = {"results": results, "failed": failed,
+                  "renamed": [r["pdf"] for r in results if r.get("same_output_as")]}
+        if args.stats:
+            report["stats"] = stats.to_dict()
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        if args.stats:
+            print(stats.table())
+        print(f"{len(results)} file(s): {len(results) - failed} converted, {failed} failed")
+    return 1 if failed else 0
+
+
+SERVE_FORMATS = {
+    "ics": "text/calendar; charset=utf-8",
+    "json": "application/json; charset=utf-8",
+    "summary": "text/plain; charset=utf-8",
+}
+
+
+class ServiceBusy(Exception):
+    """Raised by ConversionService.submit when its queue is full."""
+
+
+def _warm_worker() -> int:
+    """Serve-pool warm-up: import pdfplumber so the first request does not pay for it."""
+    _pdfplumber()
+    return os.getpid()
+
+
+def _serve_job(pdf_bytes: bytes, options: dict) -> tuple[str, str, bytes]:
+    """Convert PDF bytes per ``options``; returns (format, filename, body).
+
+    ``options`` holds ``monday_date``, ``format`` (see SERVE_FORMATS), ``tz``,
+    ``tz_mode`` and ``recurring``. Also the serve-pool worker.
+    """
+    import tempfile
+    fmt = options["format"]
+    fd, tmp = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf_bytes)
+        res = analyze_timetable(tmp, options["monday_date"])
+    finally:
+        try:
+            os.remove(tmp)
+        except Exception:
+            pass
+    name = os.path.basename(res["output"])
+    if fmt == "summary":
+        return fmt, os.path.splitext(name)[0] + ".txt", summarize_courses(res["courses"], res["is_chinese"]).encode("utf-8")
+    if fmt == "json":
+        body = {
+            "name": res["cal_name"],
+            "is_chinese": res["is_chinese"],
+            "courses": [dict(c) for c in res["courses"]],
+        }
+        return fmt, os.path.splitext(name)[0] + ".json", json.dumps(body, ensure_ascii=False).encode("utf-8")
+    import io
+    buf = io.BytesIO()
+    write_analysis_ics(res, options["monday_date"], buf, tz=options["tz"], tz_mode=options["tz_mode"],
+                       recurring=options["recurring"])
+    return fmt, name, buf.getvalue()
+
+
+def conversion_key(pdf_bytes: bytes, options: dict) -> str:
+    """Identity of a conversion: SHA-256 of the PDF bytes plus the options."""
+    h = hashlib.sha256(pdf_bytes)
+    h.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one computation.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for and share its result (or exception). Nothing is cached once
+    the call finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, object] = {}
+
+    def do(self, key: str, fn, *args, **kwargs):
+        from concurrent.futures import Future
+        with self._lock:
+            fut = self._calls.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._calls[key] = Future()
+        if not leader:
+            return fut.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+_CONVERSIONS = SingleFlight()
+
+
+def convert_timetable(
+    pdf: "bytes | str",
+    monday_date: str,
+    format: str = "ics",
+    tz: str = "Asia/Shanghai",
+    tz_mode: str = "floating",
+    recurring: bool = False,
+) -> tuple[str, str, bytes]:
+    """Convert a PDF (bytes or path) in memory; returns (format, filename, body).
+
+    Concurrent calls with the same PDF content and options share one
+    extraction and parse instead of each running the pipeline.
+    """
+    if format not in SERVE_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(SERVE_FORMATS)}")
+    if isinstance(pdf, str):
+        with open(pdf, "rb") as f:
+            pdf = f.read()
+    options = {"monday_date": monday_date, "format": format, "tz": tz, "tz_mode": tz_mode, "recurring": bool(recurring)}
+    return _CONVERSIONS.do(conversion_key(pdf, options), _serve_job, pdf, options)
+
+
+def _serve_worker_init() -> None:
+    # Ctrl-C reaches the whole process group; the parent drains running jobs instead
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class ConversionService:
+    """Bounded, pre-warmed process pool behind ``zjnu-ics serve``.
+
+    At most ``workers`` conversions run at once and ``queue_size`` more may
+    wait; beyond that ``submit`` raises ServiceBusy instead of queueing. A
+    request that exceeds ``timeout`` seconds gets TimeoutError, but keeps its
+    slot until the worker actually finishes so the bound holds. Identical
+    requests (same PDF bytes and options) in flight share one pool job and
+    take no extra slot.
+    """
+
+    def __init__(self, workers: int = 0, queue_size: int = 8, timeout: float = 120.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.workers + queue_size)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._inflight: dict[str, list] = {}  # key -> [future, waiters, pool]
+        self._closed = False
+        self._pool = self._new_pool()
+
+    def _new_pool(self):
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_serve_worker_init)
+
+    def warm_up(self) -> None:
+        """Start every worker and import the PDF stack before the first request."""
+        for fut in [self._pool.submit(_warm_worker) for _ in range(self.workers)]:
+            fut.result()
+
+    @property
+    def pending(self) -> int:
+        """Conversions running or waiting."""
+        return self._pending
+
+    @property
+    def closed(self) -> bool:
+        """True once ``close`` was called; new work is refused."""
+        return self._closed
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            self._pending -= 1
+            self._inflight.pop(key, None)
+        self._slots.release()
+
+    def _join(self, key: str, pdf_bytes: bytes, options: dict) -> list:
+        """Return the in-flight entry for ``key``, starting a pool job if there is none."""
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is not None:
+                entry[1] += 1
+                return entry
+            if self._closed or not self._slots.acquire(blocking=False):
+                raise ServiceBusy()
+            self._pending += 1
+            pool = self._pool
+            try:
+                fut = pool.submit(_serve_job, pdf_bytes, options)
+            except Exception:
+                self._pending -= 1
+                self._slots.release()
+                raise
+            entry = self._inflight[key] = [fut, 1, pool]
+        fut.add_done_callback(lambda _f: self._release(key))
+        return entry
+
+    def submit(self, pdf_bytes: bytes, options: dict) -> tuple[str, str, bytes]:
+        """Convert in the pool and wait; raises ServiceBusy, TimeoutError or the worker's exception."""
+        from concurrent.futures import TimeoutError as FutureTimeout
+        from concurrent.futures.process import BrokenProcessPool
+        entry = self._join(conversion_key(pdf_bytes, options), pdf_bytes, options)
+        fut, pool = entry[0], entry[2]
+        try:
+            return fut.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                entry[1] -= 1
+                last = entry[1] == 0
+            if last:
+                fut.cancel()
+            raise TimeoutError(f"conversion took longer than {self.timeout:g}s") from None
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OS); replace the pool for later requests
+            with self._lock:
+                if self._pool is pool and not self._closed:
+                    self._pool = self._new_pool()
+            pool.shutdown(wait=False)
+            raise
+
+    def close(self) -> None:
+        """Stop accepting work and wait for running and queued conversions."""
+        self._closed = True
+        self._pool.shutdown(wait=True)
+
+
+def _read_upload(content_type: str, body: bytes) -> tuple[bytes, dict]:
+    """Return (pdf_bytes, form_fields) from a raw or multipart/form-data upload body."""
+    if not content_type.lower().startswith("multipart/form-data"):
+        return body, {}
+    from email import policy
+    from email.parser import BytesParser
+    msg = BytesParser(policy=policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+    )
+    pdf, fields = b"", {}
+    for part in msg.iter_parts():
+        data = part.get_payload(decode=True) or b""
+        if part.get_filename() is not None or part.get_content_type() == "application/pdf":
+            pdf = pdf or data
+        elif part.get_param("name", header="content-disposition"):
+            fields[part.get_param("name", header="content-disposition")] = data.decode("utf-8", "replace").strip()
+    return pdf, fields
+
+
+def make_server(service: "ConversionService", host: str = "127.0.0.1", port: int = 8080,
+                max_upload: int = 20 << 20, read_timeout: float = 30.0):
+    """Build the ThreadingHTTPServer for ``zjnu-ics serve`` around ``service``.
+
+    ``POST /convert`` takes the PDF as the raw body or as the file field of a
+    multipart form. Options come from the query string or form fields:
+    ``monday`` (required), ``format`` (ics/json/summary), ``tz_mode``, ``tz``
+    and ``recurring``. ``GET /health`` reports the pool state. A connection
+    that stalls for ``read_timeout`` seconds (mid-upload or idle between
+    keep-alive requests) is closed, so slow clients cannot pin handler threads.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qsl, quote, urlsplit
+
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "zjnu-ics"
+        protocol_version = "HTTP/1.1"
+        # Socket timeout for every read and write on the connection
+        timeout = read_timeout
+
+        def _send(self, status: int, body: bytes, content_type: str, headers: dict | None = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _error(self, status: int, message: str, headers: dict | None = None) -> None:
+            body = json.dumps({"error": message}, ensure_ascii=False).encode("utf-8")
+            self._send(status, body, SERVE_FORMATS["json"], headers)
+
+        def do_GET(self) -> None:
+            if urlsplit(self.path).path != "/health":
+                return self._error(404, "not found")
+            state = {"status": "closing" if service.closed else "ok", "workers": service.workers,
+                     "queue_size": service.queue_size, "pending": service.pending}
+            self._send(200, json.dumps(state).encode("utf-8"), SERVE_FORMATS["json"])
+
+        def do_POST(self) -> None:
+            url = urlsplit(self.path)
+            if url.path != "/convert":
+                # The body is left unread, so the connection cannot be reused
+                self.close_connection = True
+                return self._error(404, "not found")
+            try:
+                length = int(self.headers.get("Content-Length", ""))
+            except ValueError:
+                self.close_connection = True
+                return self._error(411, "Content-Length required")
+            if length < 0:
+                self.close_connection = True
+                return self._error(400, "invalid Content-Length")
+            if length > max_upload:
+                self.close_connection = True
+                return self._error(413, f"upload larger than {max_upload} bytes")
+            try:
+                body = self.rfile.read(length)
+            except TimeoutError:
+                self.close_connection = True
+                return self._error(408, f"upload stalled for more than {read_timeout:g}s")
+            pdf, fields = _read_upload(self.headers.get("Content-Type", ""), body)
+            params = dict(parse_qsl(url.query))
+            params.update(fields)
+            if not pdf.startswith(b"%PDF"):
+                return self._error(400, "body is not a PDF")
+            fmt = params.get("format", "ics").lower()
+            if fmt not in SERVE_FORMATS:
+                return self._error(400, "format must be ics, json or summary")
+            monday = params.get("monday", "")
+            try:
+                datetime.strptime(monday, "%Y-%m-%d")
+            except ValueError:
+                return self._error(400, "monday must be YYYY-MM-DD")
+            if params.get("tz_mode", "").lower() == "tzid":
+                try:
+                    _zoneinfo(params.get("tz", "Asia/Shanghai"))
+                except ValueError as e:
+                    return self._error(400, str(e))
+            options = {
+                "monday_date": monday,
+                "format": fmt,
+                "tz": params.get("tz", "Asia/Shanghai"),
+                "tz_mode": params.get("tz_mode", "floating"),
+                "recurring": params.get("recurring", "").lower() in ("1", "true", "yes", "on"),
+            }
+            try:
+                fmt, filename, body = service.submit(pdf, options)
+            except ServiceBusy:
+                return self._error(503 if service.closed else 429, "server busy, retry later", {"Retry-After": "5"})
+            except TimeoutError as e:
+                return self._error(504, str(e))
+            except ValueError as e:
+                return self._error(422, str(e))
+            except Exception as e:
+                return self._error(500, str(e) or type(e).__name__)
+            disposition = f"attachment; filename*=UTF-8''{quote(filename)}"
+            self._send(200, body, SERVE_FORMATS[fmt], {"Content-Disposition": disposition})
+
+        def log_message(self, format: str, *args) -> None:
+            sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    # Let in-flight requests finish on server_close()
+    server.daemon_threads = False
+    server.block_on_close = True
+    return server
+
+
+def serve_main(argv: list[str]) -> int:
+    import argparse
+    import signal
+    ap = argparse.ArgumentParser(
+        prog="zjnu-ics serve",
+        description="Serve PDF → .ics conversion over HTTP (POST /convert, GET /health).",
+    )
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("-j", "--jobs", type=int, default=0, help="worker processes (0 = one per CPU)")
+    ap.add_argument("--queue", type=int, default=8, help="requests allowed to wait for a worker before 429")
+    ap.add_argument("--timeout", type=float, default=120.0, help="per-request conversion timeout in seconds")
+    ap.add_argument("--max-upload", type=int, default=20 << 20, help="largest accepted upload in bytes")
+    ap.add_argument("--read-timeout", type=float, default=30.0,
+                    help="seconds a connection may stall while sending a request before it is closed")
+    args = ap.parse_args(argv)
+    service = ConversionService(workers=args.jobs, queue_size=args.queue, timeout=args.timeout)
+    service.warm_up()
+    server = make_server(service, args.host, args.port, max_upload=args.max_upload, read_timeout=args.read_timeout)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever(), which runs in this (the main) thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print(f"Serving on http://{args.host}:{server.server_port} ({service.workers} workers, queue {args.queue})", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        # Refuse new work and let running conversions finish, then join the handler threads
+        service.close()
+        server.server_close()
+    print("Stopped.", flush=True)
+    return 0
+
+
+def main(argv: list[str] | None = None) -> None:
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == "serve":
+        sys.exit(serve_main(argv[1:]))
+    if argv:
+        sys.exit(batch_main(argv))
 
-def main() -> None:
     # Prompt user for the PDF path and Monday date of week 1
     pdf_path = input("Enter the PDF timetable path (leave blank to auto-detect the first .pdf here): ").strip()
     if not pdf_path:
@@ -1363,80 +3412,15 @@ def main() -> None:
         print("Invalid date format. Please use YYYY-MM-DD.")
         sys.exit(1)
 
-    # Detect tables (use 'lines' strategy by default for robustness)
-    tables = extract_tables(pdf_path, strategy="lines")
-
-    # Merge while preserving newlines for robust block parsing
-    headers, rows, meta, _, is_chinese = merge_main_table(tables, collapse_newlines=False)
-    if not headers:
-        print("Could not detect main timetable header; aborting.")
-        sys.exit(1)
-
-    # Stitch continuation fragments split by PDF extraction
-    rows = merge_continuation_rows(headers, rows)
-
-    # Extract courses from main table and outside-of-table metadata
-    # Activate Chinese or English type names for titles
-    set_active_type_map(use_chinese=is_chinese)
-    courses_from_table = extract_courses_from_table(headers, rows, preserve_newlines=True)
-    courses_from_meta = extract_outside_courses(meta)
-    courses = courses_from_table + courses_from_meta
-    if not courses:
-        print("No courses detected; cannot generate calendar.")
+    try:
+        res = convert_pdf(pdf_path, monday_str)
+    except ValueError as e:
+        print(f"{e}; aborting.")
         sys.exit(1)
-
     # Always show a concise per-course summary to help verify parsing
-    print(summarize_courses(courses, is_chinese))
-
-    # Derive default calendar name/desc if not provided
-    def derive_calendar_name(pdf_path: str, ics_path: str) -> str:
-        base_pdf = os.path.splitext(os.path.basename(pdf_path))[0]
-        # Remove Chinese word for timetable and duplicate parenthetical like (2)
-        base_pdf = base_pdf.replace("课表", "").strip()
-        base_pdf = re.sub(r"\s*\(\d+\)\s*$", "", base_pdf)
-        # Try to extract term like (2025-2026-1)
-        mterm = re.search(r"\((\d{4}-\d{4}-\d)\)", base_pdf)
-        name = base_pdf
-        if mterm:
-            term = mterm.group(1)
-            prefix = base_pdf[: mterm.start()].strip()
-            name = f"{prefix} {term}".strip()
-        # Replace underscores and compress spaces
-        name = name.replace("_", " ")
-        name = " ".join(name.split())
-        # If empty, fallback to ICS filename stem
-        if not name:
-            name = os.path.splitext(os.path.basename(ics_path))[0]
-        return name
-
-    # Determine output .ics path '<StudentName> <Term>.ics' beside the PDF
-    ics_output, base = compute_ics_output_path(pdf_path, meta, monday_str)
-
-    cal_name = base
-    cal_desc = f"Generated timetable starting Monday {monday_str}"
-
-    # Use student ID for ASCII-only fields where names may contain Chinese.
-    # Parse student info from metadata lines we collected during merge.
-    student = extract_student_info(meta)
-    student_id = student.get("id")
-
-    # Determine term for UID domain tagging
-    term = extract_term_from_content(pdf_path, meta) or derive_term_from_monday(monday_str)
-    term_ascii = re.sub(r"[^0-9-]", "", term or "")
+    print(summarize_courses(res["courses"], res["is_chinese"]))
+    print(f"Calendar exported: {res['output']} (events: {res['events']})")
 
-    # Build ICS (respect chosen tz-mode; default remains floating for exact times across apps)
-    build_ics(
-        courses,
-        monday_date=monday_str,
-        output_path=ics_output,
-        tz="Asia/Shanghai",
-        tz_mode="floating",
-        cal_name=cal_name,
-        cal_desc=cal_desc,
-        uid_domain=(f"{student_id}.{term_ascii}" if student_id and term_ascii else (student_id or term_ascii or None)),
-        chinese=is_chinese,
-    )
- 
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,79 @@
+"""Micro-benchmark of the cell/block parser on the sample timetables.
+
+Tables are extracted once; only the text parsing stages are timed. The parse
+caches are cleared before each pass except for the 'warm' line.
+Usage: python tools/bench_parse.py [--repeat N] [pdf ...]
+"""
+import os, sys, time
+import argparse
+# Add project root to sys.path so local modules are importable when running from tools/
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import timetable_to_calendar_zjnu as core  # type: ignore
+
+DEFAULT_PDFS = [
+    os.path.join("samples", "AL RAIMI ABDULLAH(2025-2026-1)课表 EN.pdf"),
+    os.path.join("samples", "AL RAIMI ABDULLAH(2025-2026-1)课表 CH.pdf"),
+]
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_pdf(pdf_path: str, repeat: int) -> None:
+    headers, rows, meta, _notes, is_cn = core.merge_main_table(core.extract_tables(pdf_path, strategy="lines"), collapse_newlines=False)
+    rows = core.merge_continuation_rows(headers, rows)
+    core.set_active_type_map(use_chinese=is_cn)
+    cells = [c for r in rows for c in r[2:] if (c or "").strip()]
+    blocks = [b for c in cells for b in core.split_blocks_by_marker(c)]
+    inner = 50
+
+    def run_cells():
+        for _ in range(inner):
+            core.parse_cache_clear()
+            core.extract_courses_from_table(headers, rows, preserve_newlines=True)
+
+    def run_cells_warm():
+        for _ in range(inner):
+            core.extract_courses_from_table(headers, rows, preserve_newlines=True)
+
+    def run_blocks():
+        for _ in range(inner):
+            core.parse_cache_clear()
+            for b in blocks:
+                core.parse_block_text(b, None)
+
+    def run_meta():
+        for _ in range(inner):
+            core.extract_outside_courses(meta)
+            core.extract_student_info(meta)
+
+    t_cells = _best_of(run_cells, repeat) / inner
+    t_warm = _best_of(run_cells_warm, repeat) / inner
+    t_blocks = _best_of(run_blocks, repeat) / inner
+    t_meta = _best_of(run_meta, repeat) / inner
+    print(f"{os.path.basename(pdf_path)}")
+    print(f"  cells: {len(cells):3d}  {t_cells / max(1, len(cells)) * 1e6:8.1f} us/cell   ({t_cells * 1e3:.2f} ms/table)")
+    print(f"  warm:  {len(cells):3d}  {t_warm / max(1, len(cells)) * 1e6:8.1f} us/cell   (parse caches hot)")
+    print(f"  blocks:{len(blocks):3d}  {t_blocks / max(1, len(blocks)) * 1e6:8.1f} us/block")
+    print(f"  meta:  {len(meta):3d}  {t_meta * 1e6:8.1f} us/document (outside courses + student info)")
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Per-cell parse cost of the block parser")
+    ap.add_argument("pdfs", nargs="*", default=DEFAULT_PDFS)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args(argv)
+    for pdf in args.pdfs:
+        bench_pdf(pdf, args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
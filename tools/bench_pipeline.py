@@ -0,0 +1,191 @@
+"""Benchmark suite for every pipeline stage on synthetic ZJNU timetables.
+
+Each scenario writes a synthetic PDF (tools/synth_timetable.py) at a given
+scale and runs in its own process, so peak RSS is per scenario. Timed:
+extract_tables, merge_main_table, merge_continuation_rows,
+extract_courses_from_table (parse caches cleared), write_ics (the writer
+behind build_ics) and the full pipeline (analyze_timetable + .ics), reported
+as best-of-N ms, PDFs/s and events/s.
+
+Baselines are machine specific: record one with --save-baseline, then later
+runs compare against it and exit 1 when a metric is slower than --tolerance.
+Usage: python tools/bench_pipeline.py [--repeat N] [--scenario NAME ...] [--save-baseline] [--baseline PATH]
+"""
+import os, sys, time
+import argparse
+import io
+import json
+import subprocess
+import tempfile
+# Add project root to sys.path so local modules are importable when running from tools/
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+import timetable_to_calendar_zjnu as core  # type: ignore
+import synth_timetable  # type: ignore
+
+MON = "2025-09-08"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# name -> write_timetable_pdf options
+SCENARIOS = {
+    "en-1p": {"chinese": False, "courses_per_cell": 1, "pages": 1, "outside": 2},
+    "cn-1p": {"chinese": True, "courses_per_cell": 1, "pages": 1, "outside": 2},
+    "en-3p-dense": {"chinese": False, "courses_per_cell": 3, "pages": 3, "outside": 6, "fill": 0.8},
+    "cn-3p-dense": {"chinese": True, "courses_per_cell": 3, "pages": 3, "outside": 6, "fill": 0.8},
+}
+STAGES = ["extract_tables", "merge_main_table", "merge_continuation_rows", "extract_courses_from_table",
+          "write_ics", "pipeline"]
+
+
+def _best_of(fn, repeat: int) -> tuple[float, object]:
+    """Best per-call time over ``repeat`` samples; fast stages loop so each sample lasts ~20 ms."""
+    t0 = time.perf_counter()
+    result = fn()
+    inner = max(1, int(0.02 / max(time.perf_counter() - t0, 1e-6)))
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(inner):
+            result = fn()
+        best = min(best, (time.perf_counter() - t0) / inner)
+    return best, result
+
+
+def _peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / 1024
+
+
+def run_scenario(name: str, repeat: int) -> dict:
+    """Generate the scenario's PDF and time every stage in this process."""
+    opts = SCENARIOS[name]
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = os.path.join(tmp, f"{name}.pdf")
+        expected = synth_timetable.write_timetable_pdf(pdf, **opts)
+        ms: dict[str, float] = {}
+
+        def extract():
+            # A fresh document each time: no page or content cache
+            with core.TimetableDocument(pdf) as doc:
+                return core.extract_tables(doc, strategy="lines")
+
+        t, tables = _best_of(extract, repeat)
+        ms["extract_tables"] = t
+        t, merged = _best_of(lambda: core.merge_main_table(tables, collapse_newlines=False), repeat)
+        ms["merge_main_table"] = t
+        headers, rows, meta, _notes, is_cn = merged
+        t, rows = _best_of(lambda: core.merge_continuation_rows(headers, rows), repeat)
+        ms["merge_continuation_rows"] = t
+        ctx = core.parse_context(is_cn)
+
+        def parse():
+            core.parse_cache_clear()
+            return core.extract_courses_from_table(headers, rows, preserve_newlines=True, ctx=ctx) \
+                + core.extract_outside_courses(meta, ctx)
+
+        t, courses = _best_of(parse, repeat)
+        ms["extract_courses_from_table"] = t
+        t, events = _best_of(lambda: core.write_ics(courses, MON, io.BytesIO(), chinese=is_cn), repeat)
+        ms["write_ics"] = t
+
+        def pipeline():
+            core.parse_cache_clear()
+            res = core.analyze_timetable(pdf, MON)
+            return core.write_analysis_ics(res, MON, io.BytesIO())
+
+        t, _ = _best_of(pipeline, repeat)
+        ms["pipeline"] = t
+        pages = len({p for p, _t, _r in tables})
+    return {
+        "scenario": name,
+        "pages": pages,
+        "courses": len(courses),
+        "expected_courses": expected,
+        "events": events,
+        "ms": {k: round(v * 1000, 3) for k, v in ms.items()},
+        "pdfs_per_s": round(1 / ms["pipeline"], 2),
+        "events_per_s": round(events / ms["pipeline"], 1),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """Return one line per metric that is slower than the baseline by more than ``tolerance``."""
+    out = []
+    for res in results:
+        base = baseline.get(res["scenario"])
+        if not base:
+            continue
+        for stage, v in res["ms"].items():
+            b = base["ms"].get(stage)
+            # Ignore sub-10 µs differences on the tiny stages
+            if b and v > b * (1 + tolerance) and v - b > 0.01:
+                out.append(f"{res['scenario']}: {stage} {v:.2f} ms vs baseline {b:.2f} ms (+{(v / b - 1) * 100:.0f}%)")
+    return out
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Per-stage and end-to-end benchmarks on synthetic timetables")
+    ap.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only these (repeatable)")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare with / save to")
+    ap.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a metric counts as a regression")
+    ap.add_argument("--json", action="store_true", help="print results as JSON")
+    ap.add_argument("--run", help=argparse.SUPPRESS)  # child process: one scenario, JSON to stdout
+    args = ap.parse_args(argv)
+    if args.run:
+        print(json.dumps(run_scenario(args.run, args.repeat)))
+        return 0
+
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", name, "--repeat", str(args.repeat)],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stderr)
+            return 2
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'scenario':<13} {'pages':>5} {'courses':>9} {'events':>6}" + "".join(f" {s[:12]:>12}" for s in STAGES)
+              + f" {'PDFs/s':>7} {'events/s':>9} {'RSS MB':>7}")
+        for r in results:
+            courses = f"{r['courses']}/{r['expected_courses']}"
+            rss = f"{r['peak_rss_mb']:.0f}" if r["peak_rss_mb"] is not None else "n/a"
+            print(f"{r['scenario']:<13} {r['pages']:>5} {courses:>9} {r['events']:>6}"
+                  + "".join(f" {r['ms'][s]:>12.2f}" for s in STAGES)
+                  + f" {r['pdfs_per_s']:>7.2f} {r['events_per_s']:>9.0f} {rss:>7}")
+        print("(stage columns: best-of-N ms)")
+
+    status = 0
+    for r in results:
+        if r["courses"] != r["expected_courses"]:
+            print(f"MISMATCH {r['scenario']}: parsed {r['courses']} courses, generator wrote {r['expected_courses']}")
+            status = 1
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({r["scenario"]: r for r in results}, f, indent=2)
+        print(f"Baseline saved: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"SLOWER {line}")
+        if regressions:
+            status = 1
+        else:
+            print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
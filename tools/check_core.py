@@ -0,0 +1,176 @@
+"""Regression checks for core helpers that the sample PDFs do not exercise.
+
+Each ``check_*`` function raises AssertionError on failure; the script runs
+them all and exits 1 if any failed.
+Usage: python tools/check_core.py [-k SUBSTRING]
+"""
+import os, sys
+import argparse
+import random
+import traceback
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# Add project root to sys.path so local modules are importable when running from tools/
+sys.path.insert(0, ROOT)
+
+import timetable_to_calendar_zjnu as core  # type: ignore
+
+SAMPLE_EN = os.path.join(ROOT, "samples", "AL RAIMI ABDULLAH(2025-2026-1)课表 EN.pdf")
+
+
+def _recurrence(text: str):
+    return core.weekly_recurrence(core.WeekSet.parse(text))
+
+
+def _expand(first: int, rule) -> set[int]:
+    k, count, ex, rd = rule
+    weeks = {first + i * k for i in range(count)} if count else {first}
+    return (weeks - set(ex)) | set(rd)
+
+
+def check_weekly_recurrence_examples():
+    # (interval, count, exdates, rdates)
+    assert _recurrence("1-8,10-17") == (1, 17, [9], [])
+    assert _recurrence("1-8,20") == (1, 8, [], [20])
+    assert _recurrence("1-8,17") == (1, 8, [], [17])
+    assert _recurrence("1-8,16,17") == (1, 8, [], [16, 17])
+    assert _recurrence("1,3,5,7,9") == (2, 5, [], [])
+    assert _recurrence("5") == (0, 0, [], [])
+
+
+def check_weekly_recurrence_cheapest():
+    # Exact for random week sets, and never worse than any (interval, count) rule
+    rng = random.Random(20251017)
+    for _ in range(2000):
+        weeks = sorted(rng.sample(range(1, 21), rng.randint(1, 12)))
+        rule = _recurrence(",".join(map(str, weeks)))
+        assert _expand(weeks[0], rule) == set(weeks), (weeks, rule)
+        k, count, ex, rd = rule
+        cost = (1 if count else 0) + len(ex) + len(rd)
+        brute = len(weeks) - 1
+        for kk in range(1, 20):
+            for n in range(2, 21):
+                prog = {weeks[0] + i * kk for i in range(n)}
+                brute = min(brute, 1 + len(prog - set(weeks)) + len(set(weeks) - prog))
+        assert cost == brute, (weeks, rule, brute)
+
+
+def check_tzid_calendar_defines_zone():
+    # TZID= references need a VTIMEZONE; bad zone names never reach the output
+    import io
+    from datetime import datetime
+    course = {"name": "Physics\rLab", "type": "", "teacher": "", "location": "", "day": 0,
+              "periods": [1, 2], "weeks": [1, 2], "outside": False}
+    buf = io.BytesIO()
+    core.write_ics([course], "2025-09-08", buf, tz="America/New_York", tz_mode="tzid")
+    text = buf.getvalue().decode()
+    assert text.count("BEGIN:VTIMEZONE") == 1 and "TZID:America/New_York\r\n" in text
+    assert text.index("END:VTIMEZONE") < text.index("BEGIN:VEVENT")
+    assert "DTSTART;TZID=America/New_York:" in text
+    assert "SUMMARY:Physics\\nLab" in text, "bare CR must be escaped as a line break"
+    # 2025-11-02 02:00 EDT -> EST and 2026-03-08 02:00 EST -> EDT
+    lines = core.ics_vtimezone("America/New_York", datetime(2025, 9, 8), datetime(2026, 9, 9))
+    assert "DTSTART:20251102T020000" in lines and "DTSTART:20260308T020000" in lines, lines
+    shanghai = core.ics_vtimezone("Asia/Shanghai", datetime(2025, 9, 8), datetime(2026, 9, 9))
+    assert shanghai.count("TZOFFSETTO:+0800") == 1 and "BEGIN:DAYLIGHT" not in shanghai, shanghai
+    for bad in ("Asia/Nowhere", "UTC\r\nBEGIN:VEVENT", "../etc/passwd"):
+        try:
+            core.write_ics([course], "2025-09-08", io.BytesIO(), tz=bad, tz_mode="tzid")
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted time zone {bad!r}")
+
+
+def check_course_round_trip():
+    # Course keeps non-contiguous periods and the parser hands out Course records
+    d = {"name": "Lab", "periods": [1, 3], "weeks": [1, 2, 5], "location": "", "teacher": "",
+         "type": "", "type_char": "", "day": "Mon"}
+    c = core.Course.from_dict(d)
+    assert c["periods"] == [1, 3] and c.to_dict() == d and c == d, c
+    outside = core.Course(name="Reading", weeks=[3], outside=True)
+    assert "periods" not in outside and "day" not in outside, outside.keys()
+    res = core.analyze_timetable(SAMPLE_EN, "2025-09-08")
+    assert all(isinstance(x, core.Course) for x in res["courses"])
+    assert any(x.get("outside") for x in res["courses"])
+
+
+def _open_fds() -> int | None:
+    fd_dir = "/proc/self/fd"
+    return len(os.listdir(fd_dir)) if os.path.isdir(fd_dir) else None
+
+
+def check_analyze_cancel_during_extract():
+    # Cancelling analyze() mid-stage must not close the document or delete the
+    # temp PDF under the running extract_tables thread
+    import asyncio
+    import threading
+    import time
+    with open(SAMPLE_EN, "rb") as f:
+        pdf = f.read()
+    core._pdfplumber()
+    real = core.extract_tables
+    started = threading.Event()
+    seen: dict = {}
+
+    def slow_extract(doc, strategy):
+        seen["doc"] = doc
+        started.set()
+        time.sleep(0.3)  # the task is cancelled while the stage sleeps here
+        try:
+            seen["tables"] = real(doc, strategy)
+        except Exception as e:
+            seen["error"] = e
+            raise
+        return seen["tables"]
+
+    logged: list = []
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda _loop, context: logged.append(context))
+        task = asyncio.create_task(core.analyze(pdf, "2025-09-08"))
+        await loop.run_in_executor(None, started.wait)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        else:
+            raise AssertionError("analyze finished instead of being cancelled")
+        await asyncio.sleep(0.05)
+
+    fds = _open_fds()
+    core.extract_tables = slow_extract
+    try:
+        asyncio.run(run())
+    finally:
+        core.extract_tables = real
+    assert "error" not in seen, f"stage failed under cancellation: {seen.get('error')!r}"
+    assert "tables" in seen, "stage did not finish"
+    assert not logged, logged
+    doc = seen["doc"]
+    assert doc._pdf is None, "document left open"
+    assert not os.path.exists(doc.pdf_path), "temporary PDF left behind"
+    if fds is not None:
+        assert _open_fds() == fds, f"file descriptors: {fds} before, {_open_fds()} after"
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Run the core regression checks")
+    ap.add_argument("-k", default="", help="only run checks whose name contains this")
+    args = ap.parse_args(argv)
+    checks = [(n, f) for n, f in sorted(globals().items()) if n.startswith("check_") and callable(f) and args.k in n]
+    failed = 0
+    for name, fn in checks:
+        try:
+            fn()
+            print(f"OK    {name}")
+        except Exception:
+            failed += 1
+            print(f"FAIL  {name}")
+            traceback.print_exc()
+    print(f"{len(checks)} check(s): {len(checks) - failed} passed, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
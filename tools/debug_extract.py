@@ -1,5 +1,22 @@
+"""Parser debugging: deep dive into one PDF, or a golden-corpus regression run.
+
+Single PDF: dumps metadata, raw cells, block splits and parsed courses.
+Corpus (--corpus DIR): converts every PDF under DIR in parallel and compares
+each with its golden course JSON and .ics (DTSTAMP ignored), reporting
+per-file diffs, wall time and the slowest files. --update-golden records the
+current output and timings as the new goldens; files slower than their
+recorded time by more than --tolerance count as SLOW, so record and check
+with the same --jobs on the same machine.
+Usage: python tools/debug_extract.py <pdf>
+       python tools/debug_extract.py --corpus DIR [--golden DIR] [--jobs N] [--slowest N] [--update-golden]
+"""
 import os
 import sys
+import argparse
+import difflib
+import io
+import json
+import time
 from pathlib import Path
 from datetime import datetime
 
@@ -7,15 +24,23 @@ from datetime import datetime
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 import timetable_to_calendar_zjnu as core  # type: ignore
 
+MON = "2025-09-08"
+
 
-def main(pdf_path: str):
+def dump_pdf(pdf_path: str):
     print(f"PDF: {pdf_path}")
-    tables = core.extract_tables(pdf_path, strategy="lines")
-    header = core.merge_main_table(tables, collapse_newlines=False)
-    if not header or not header[0]:
-        print("No header detected.")
-        return
-    headers, rows, meta, notes, is_chinese = header
+    # Every exit path closes the document; cached page text outlives it
+    with core.TimetableDocument(pdf_path) as doc:
+        tables = core.extract_tables(doc, strategy="lines")
+        header = core.merge_main_table(tables, collapse_newlines=False)
+        if not header or not header[0]:
+            print("No header detected.")
+            return
+        headers, rows, meta, notes, is_chinese = header
+        # Name/ID/Term extraction
+        info_meta = core.extract_student_info(meta)
+        info_pdf = core.extract_student_info_from_pdf(doc, meta)
+        term = core.extract_term_from_content(doc, meta)
     # Merge continuation rows to attach Campus/Area/Teacher fragments to the correct cells
     try:
         rows = core.merge_continuation_rows(headers, rows)
@@ -29,10 +54,6 @@ def main(pdf_path: str):
     for i, line in enumerate(notes[:10], 1):
         print(f"{i:02d}: {line}")
 
-    # Name/ID/Term extraction
-    info_meta = core.extract_student_info(meta)
-    info_pdf = core.extract_student_info_from_pdf(pdf_path, meta)
-    term = core.extract_term_from_content(pdf_path, meta)
     print("-- Extracted --")
     print(f"Name(meta): {info_meta.get('name')}")
     print(f"Name(pdf):  {info_pdf.get('name')}")
@@ -74,7 +95,7 @@ def main(pdf_path: str):
                     print(f"[row {r_i:02d} sec={sec_text:>2}] {day}:")
                     print(cell)
                     try:
-                        blocks = core.split_blocks_smart(cell)
+                        blocks = [bl for bl, _ in core.split_cell_blocks(cell)]
                     except Exception:
                         blocks = []
                     if blocks:
@@ -86,13 +107,13 @@ def main(pdf_path: str):
                                 print(f"     [{bi}] {bl}")
 
     # Parse courses and backfill teachers
-    core.set_active_type_map(use_chinese=is_chinese)
-    courses_tbl = core.extract_courses_from_table(headers, rows, preserve_newlines=True)
+    ctx = core.parse_context(is_chinese)
+    courses_tbl = core.extract_courses_from_table(headers, rows, preserve_newlines=True, ctx=ctx)
     try:
         core._backfill_teachers(courses_tbl)
     except Exception:
         pass
-    courses_meta = core.extract_outside_courses(meta)
+    courses_meta = core.extract_outside_courses(meta, ctx)
     print(f"Courses parsed (table): {len(courses_tbl)} | (outside): {len(courses_meta)} | total: {len(courses_tbl)+len(courses_meta)}")
 
     # Detailed parsed output for table courses
@@ -128,8 +149,127 @@ def main(pdf_path: str):
             print(f"- [O{i:02d}] {name} | {ctype} | weeks={weeks} ({condensed}) | teacher={tchr} | loc={loc}")
 
 
+def convert_for_corpus(pdf_path: str, monday: str) -> dict:
+    """Corpus worker: courses and .ics text for one PDF plus its wall time."""
+    t0 = time.perf_counter()
+    try:
+        res = core.analyze_timetable(pdf_path, monday)
+        buf = io.BytesIO()
+        core.write_analysis_ics(res, monday, buf)
+    except Exception as e:
+        return {"ok": False, "error": str(e) or type(e).__name__, "seconds": time.perf_counter() - t0}
+    seconds = time.perf_counter() - t0
+    courses = [dict(c) for c in res["courses"]]
+    return {"ok": True, "courses": courses, "ics": buf.getvalue().decode("utf-8"), "seconds": seconds}
+
+
+def _ics_lines(text: str) -> list[str]:
+    # DTSTAMP is the generation time; everything else is deterministic
+    return [l for l in text.replace("\r\n", "\n").split("\n") if l and not l.startswith("DTSTAMP:")]
+
+
+def _courses_lines(courses: list[dict]) -> list[str]:
+    return json.dumps(courses, ensure_ascii=False, sort_keys=True, indent=1).splitlines()
+
+
+def _diff(expected: list[str], actual: list[str], name: str, limit: int) -> list[str]:
+    out = list(difflib.unified_diff(expected, actual, f"golden/{name}", f"current/{name}", lineterm="", n=1))
+    return out[:limit] + ([f"... {len(out) - limit} more diff lines"] if len(out) > limit else [])
+
+
+def run_corpus(args) -> int:
+    from concurrent.futures import ProcessPoolExecutor
+    corpus = os.path.abspath(args.corpus)
+    golden = os.path.abspath(args.golden or os.path.join(corpus, "golden"))
+    pdfs = [p for p in core.expand_pdf_inputs([corpus]) if not os.path.abspath(p).startswith(golden + os.sep)]
+    if not pdfs:
+        print(f"No PDFs under {corpus}")
+        return 1
+    rels = [os.path.relpath(p, corpus) for p in pdfs]
+    jobs = args.jobs or os.cpu_count() or 1
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=min(jobs, len(pdfs))) as ex:
+        results = list(ex.map(convert_for_corpus, pdfs, [args.monday] * len(pdfs)))
+    wall = time.perf_counter() - t0
+
+    timings_path = os.path.join(golden, "timings.json")
+    try:
+        with open(timings_path, "r", encoding="utf-8") as f:
+            base_times = json.load(f)
+    except Exception:
+        base_times = {}
+    counts = {"OK": 0, "DIFF": 0, "NEW": 0, "FAIL": 0, "SLOW": 0}
+    for rel, res in zip(rels, results):
+        stem = os.path.join(golden, os.path.splitext(rel)[0])
+        secs = f"{res['seconds'] * 1000:8.1f} ms"
+        if not res["ok"]:
+            counts["FAIL"] += 1
+            print(f"FAIL  {secs}  {rel}: {res['error']}")
+            continue
+        if args.update_golden:
+            os.makedirs(os.path.dirname(stem), exist_ok=True)
+            with open(stem + ".courses.json", "w", encoding="utf-8") as f:
+                f.write("\n".join(_courses_lines(res["courses"])) + "\n")
+            with open(stem + ".ics", "w", encoding="utf-8", newline="") as f:
+                f.write(res["ics"])
+            counts["OK"] += 1
+            print(f"SAVED {secs}  {rel}")
+            continue
+        try:
+            with open(stem + ".courses.json", "r", encoding="utf-8") as f:
+                want_courses = f.read().splitlines()
+            with open(stem + ".ics", "r", encoding="utf-8", newline="") as f:
+                want_ics = f.read()
+        except FileNotFoundError:
+            counts["NEW"] += 1
+            print(f"NEW   {secs}  {rel} (no golden; run with --update-golden)")
+            continue
+        diff = _diff(want_courses, _courses_lines(res["courses"]), "courses.json", args.diff_lines)
+        diff += _diff(_ics_lines(want_ics), _ics_lines(res["ics"]), "calendar.ics", args.diff_lines)
+        base = base_times.get(rel.replace(os.sep, "/"))
+        slow = base is not None and res["seconds"] > base * (1 + args.tolerance) and res["seconds"] - base > 0.05
+        status = "DIFF" if diff else ("SLOW" if slow else "OK")
+        counts[status] += 1
+        note = f" (baseline {base * 1000:.1f} ms)" if slow else ""
+        print(f"{status:<5} {secs}  {rel}{note}")
+        for line in diff:
+            print(f"      {line}")
+
+    if args.update_golden:
+        times = {rel.replace(os.sep, "/"): round(res["seconds"], 4) for rel, res in zip(rels, results) if res["ok"]}
+        os.makedirs(golden, exist_ok=True)
+        with open(timings_path, "w", encoding="utf-8") as f:
+            json.dump(times, f, indent=1, sort_keys=True)
+
+    ranked = sorted(zip(rels, results), key=lambda x: x[1]["seconds"], reverse=True)[:args.slowest]
+    print(f"-- Slowest {len(ranked)} --")
+    for rel, res in ranked:
+        print(f"  {res['seconds'] * 1000:8.1f} ms  {rel}")
+    total = sum(r["seconds"] for r in results)
+    print(f"{len(pdfs)} file(s) in {wall:.2f}s wall ({len(pdfs) / wall:.2f} PDFs/s, {total / len(pdfs) * 1000:.1f} ms/file on "
+          f"{min(jobs, len(pdfs))} worker(s)): " + ", ".join(f"{v} {k}" for k, v in counts.items() if v))
+    return 1 if counts["DIFF"] or counts["FAIL"] or counts["SLOW"] else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Debug one timetable PDF or run the golden-corpus regression check")
+    ap.add_argument("pdf", nargs="?", help="PDF to dump in detail")
+    ap.add_argument("--corpus", help="directory of PDFs to check against goldens")
+    ap.add_argument("--golden", help="golden directory (default: <corpus>/golden)")
+    ap.add_argument("--update-golden", action="store_true", help="write current output and timings as the goldens")
+    ap.add_argument("--monday", default=MON, help="Week 1 Monday used for the .ics goldens")
+    ap.add_argument("-j", "--jobs", type=int, default=0, help="worker processes (0 = one per CPU)")
+    ap.add_argument("--slowest", type=int, default=10, help="list the N slowest files")
+    ap.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown against golden timings")
+    ap.add_argument("--diff-lines", type=int, default=40, help="max diff lines shown per file and artifact")
+    args = ap.parse_args(argv)
+    if args.corpus:
+        return run_corpus(args)
+    if not args.pdf:
+        ap.error("give a PDF or --corpus DIR")
+    dump_pdf(args.pdf)
+    return 0
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python tools/debug_extract.py <path-to-pdf>")
-        sys.exit(1)
-    main(sys.argv[1])
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""Import-time budget check for CLI and GUI cold start.
+
+Runs each start-up path in a fresh interpreter with ``python -X importtime``.
+It fails when a heavy dependency (pdfplumber, pdfminer, PIL, ics, arrow) is
+imported before it is needed, or when the median start-up cost over the bare
+interpreter exceeds its budget.
+Usage: python tools/import_budget.py [--runs N] [--scale X]
+"""
+import os, sys, time
+import argparse
+import compileall
+import statistics
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+HEAVY = ("pdfplumber", "pdfminer", "PIL", "ics", "arrow")
+
+# name -> (code run with -c, budget in ms over a bare interpreter)
+TARGETS = {
+    "import core": ("import timetable_to_calendar_zjnu", 60),
+    "zjnu-ics --help": (
+        "import sys; sys.argv = ['zjnu-ics', '--help']\n"
+        "import timetable_to_calendar_zjnu as m\n"
+        "try:\n    m.main()\nexcept SystemExit:\n    pass",
+        90,
+    ),
+    "import gui": ("import gui_win", 150),
+}
+
+
+def _run(code: str, importtime: bool = False) -> tuple[float, str]:
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(f"{code!r} failed:\n{proc.stderr}")
+    return elapsed, proc.stderr
+
+
+def heavy_imports(code: str) -> list[str]:
+    """Top-level packages from HEAVY that ``code`` imports."""
+    _, err = _run(code, importtime=True)
+    found = set()
+    for line in err.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        name = line.rsplit("|", 1)[-1].strip().split(".")[0]
+        if name in HEAVY:
+            found.add(name)
+    return sorted(found)
+
+
+def startup_ms(code: str, runs: int) -> float:
+    """Median wall time of ``code`` minus a bare ``pass`` interpreter, in ms."""
+    base = statistics.median(_run("pass")[0] for _ in range(runs))
+    return max(0.0, statistics.median(_run(code)[0] for _ in range(runs)) - base) * 1000
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Check start-up import cost of the CLI and GUI")
+    ap.add_argument("--runs", type=int, default=7, help="interpreter launches per measurement")
+    ap.add_argument("--scale", type=float, default=1.0, help="multiply every budget (slow CI machines)")
+    args = ap.parse_args(argv)
+    # Measure with up-to-date bytecode, as an installed package would start
+    for mod in ("timetable_to_calendar_zjnu.py", "gui_win.py"):
+        compileall.compile_file(os.path.join(ROOT, mod), quiet=1)
+    failed = 0
+    for name, (code, budget) in TARGETS.items():
+        try:
+            heavy = heavy_imports(code)
+        except RuntimeError as e:
+            if name == "import gui" and "tkinter" in str(e):
+                print(f"SKIP  {name}: tkinter is not available")
+                continue
+            raise
+        ms = startup_ms(code, args.runs)
+        limit = budget * args.scale
+        ok = not heavy and ms <= limit
+        failed += not ok
+        note = f"  heavy imports: {', '.join(heavy)}" if heavy else ""
+        print(f"{'OK' if ok else 'FAIL':<5} {name:<16} {ms:7.1f} ms (budget {limit:.0f} ms){note}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,296 @@
+"""Synthetic ZJNU timetable PDF generator for benchmarks.
+
+Writes EN or CN timetables in the ZJNU print layout: title and outside-course
+rows spanning the grid, a Period/Sections/Mon..Sun header, 13 section rows
+with Morning/Afternoon/Evening spans, multi-section course cells with wrapped
+text and the legend row. The PDF is written by hand (no extra dependencies)
+with the non-embedded Adobe STSong-Light font, which covers ASCII, CJK and the
+course markers.
+Usage: python tools/synth_timetable.py out.pdf [--cn] [--courses-per-cell N] [--pages N] [--outside N]
+"""
+import argparse
+import random
+
+MARKERS = "△★▲☆"
+DAYS_EN = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+DAYS_CN = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
+PERIODS = [(1, 5, "Morning", "上午"), (6, 9, "Afternoon", "下午"), (10, 13, "Evening", "晚上")]
+NAMES_EN = [
+    "Cyber Security", "Object-Oriented Analysis & Design", "Software Process and Documentation",
+    "Software Quality Assurance & Testing", "Fundamentals of Artificial Intelligence",
+    "Individual Project Training", "Computer Networks", "Operating Systems", "Database Principles",
+    "Discrete Mathematics", "Compiler Construction", "Web Application Development",
+]
+NAMES_CN = [
+    "网络安全", "面向对象分析与设计", "软件过程与文档写作", "软件质量保证与测试", "人工智能基础",
+    "个人项目实训", "计算机网络", "操作系统", "数据库原理", "离散数学", "编译原理", "Web应用开发",
+]
+TEACHERS = ["Li Minshuo", "Wu Jianbin", "Ding Zhiguo", "Md Shaiful Islam Babu", "WangZiYe", "陈欣", "郑晓红", "蓝珲"]
+ROOMS = ["25-315", "26-317", "16-428", "20-204B软件实验室（三）", "20-109网络与信息安全", "20-206软件实验室"]
+
+# Layout (points). Pages are A4-landscape wide and as tall as their rows need.
+FONT_SIZE = 6.5
+LINE_H = 8.0
+PAD = 2.0
+MARGIN = 30.0
+COL_W = [40.0, 30.0] + [102.0] * 7
+PAGE_W = MARGIN * 2 + sum(COL_W)
+
+
+def _text_width(s: str) -> float:
+    return sum(0.5 if ord(ch) < 128 else 1.0 for ch in s) * FONT_SIZE
+
+
+def wrap(text: str, width: float) -> list[str]:
+    """Break text into lines of at most ``width`` points, preferring breaks after ' ', '/' or ','."""
+    lines: list[str] = []
+    for para in text.split("\n"):
+        cur = ""
+        for ch in para:
+            if cur and _text_width(cur + ch) > width:
+                cut = max(cur.rfind(" "), cur.rfind("/"), cur.rfind(","))
+                if cut >= len(cur) - 10 and cut > 0:
+                    lines.append(cur[:cut + 1].rstrip())
+                    cur = cur[cut + 1:].lstrip()
+                else:
+                    lines.append(cur)
+                    cur = ""
+            cur += ch
+        lines.append(cur)
+    return [l for l in lines if l]
+
+
+def _weeks(rng: random.Random) -> list[int]:
+    start = rng.randint(1, 4)
+    end = rng.randint(start + 3, 17)
+    weeks = list(range(start, end + 1))
+    if rng.random() < 0.3:
+        weeks = [w for w in weeks if w % 2 == start % 2]
+    elif rng.random() < 0.3:
+        gap = rng.choice(weeks)
+        weeks = [w for w in weeks if w != gap]
+    return weeks
+
+
+def _condense(weeks: list[int]) -> list[str]:
+    out, i = [], 0
+    while i < len(weeks):
+        j = i
+        while j + 1 < len(weeks) and weeks[j + 1] == weeks[j] + 1:
+            j += 1
+        out.append(str(weeks[i]) if i == j else f"{weeks[i]}-{weeks[j]}")
+        i = j + 1
+    return out
+
+
+def _block(rng: random.Random, chinese: bool, name: str, s: int, e: int, width: float) -> list[str]:
+    marker = rng.choice(MARKERS)
+    teacher = rng.choice(TEACHERS)
+    room = rng.choice(ROOMS) if rng.random() < 0.85 else None
+    weeks = _condense(_weeks(rng))
+    if chinese:
+        wk = ",".join(f"{w}周" for w in weeks)
+        detail = f"({s}-{e}节){wk}/校区:主校区（金华）/场地:{room or '未排地点'}/教师:{teacher}"
+    else:
+        detail = f"({s}-{e} Section)Week {','.join(weeks)}/Campus:Main Campus/Area:{room or 'Not yet'}/Teachers:{teacher}"
+    return wrap(name + marker, width) + wrap(detail, width)
+
+
+def generate_layout(chinese: bool = False, courses_per_cell: int = 1, outside: int = 2,
+                    fill: float = 0.45, seed: int = 0) -> tuple[list[list[str]], list[dict], int]:
+    """Return (full-width text rows, grid cells, expected course count).
+
+    Grid cells are ``{"col", "row", "span", "lines"}`` with ``row`` 1..13 for
+    sections and 0 for the header.
+    """
+    rng = random.Random(seed)
+    names = NAMES_CN if chinese else NAMES_EN
+    width = COL_W[2] - 2 * PAD
+    student = f"SYNTH STUDENT {seed:03d}"
+    sid = f"2023{seed:08d}"
+    if chinese:
+        top = [[f"{student}课表", f"2025-2026学年第1学期 学号：{sid}"]]
+    else:
+        top = [[f"{student}'s Curriculum", f"2025-2026 academic year 1 term student ID: {sid}"]]
+    for i in range(outside):
+        name, marker, teacher = rng.choice(names), rng.choice(MARKERS), rng.choice(TEACHERS)
+        weeks = _weeks(rng)
+        wk = ",".join(_condense(weeks))
+        qq = rng.randint(10 ** 8, 10 ** 10)
+        if chinese:
+            top.append([f"其他课程：{name}{marker}{teacher}(共{len(weeks)}周)/{wk}周/课程QQ群号：{qq};"])
+        else:
+            top.append([f"Other courses：{name}{marker}{teacher}(total {len(weeks)} week)/{wk} Week/Not Yet：课程QQ群号：{qq};"])
+    cells = [{"col": 0, "row": 0, "span": 1, "lines": ["时间段"] if chinese else ["Period", "of time"]},
+             {"col": 1, "row": 0, "span": 1, "lines": ["节次"] if chinese else ["Sectio", "ns"]}]
+    cells += [{"col": 2 + d, "row": 0, "span": 1, "lines": [day]} for d, day in enumerate(DAYS_CN if chinese else DAYS_EN)]
+    for first, last, en, cn in PERIODS:
+        cells.append({"col": 0, "row": first, "span": last - first + 1, "lines": [cn if chinese else en]})
+    cells += [{"col": 1, "row": r, "span": 1, "lines": [str(r)]} for r in range(1, 14)]
+    expected = outside
+    for d in range(7):
+        r = 1
+        while r <= 13:
+            period_end = next(last for first, last, _, _ in PERIODS if first <= r <= last)
+            if rng.random() < fill:
+                span = rng.randint(1, period_end - r + 1)
+                name = rng.choice(names)
+                lines: list[str] = []
+                for _ in range(courses_per_cell):
+                    lines += _block(rng, chinese, name, r, r + span - 1, width)
+                cells.append({"col": 2 + d, "row": r, "span": span, "lines": lines})
+                expected += courses_per_cell
+                r += span
+            else:
+                r += 1
+    bottom = ["★: 术科 △: Theory ▲: 实践 ☆: Experiment print time:2025-09-15"] if not chinese else \
+        ["★：术科 △：理论 ▲：实践 ☆：实验 打印时间：2025-09-15"]
+    return top + [bottom], cells, expected
+
+
+class _PdfWriter:
+    """Tiny PDF writer: one shared CJK font, line and text drawing per page."""
+
+    def __init__(self):
+        self.objects: list[bytes] = []
+
+    def add(self, body: bytes) -> int:
+        self.objects.append(body)
+        return len(self.objects)
+
+    @staticmethod
+    def text(x: float, y: float, s: str) -> bytes:
+        return f"BT /F1 {FONT_SIZE} Tf {x:.2f} {y:.2f} Td <{s.encode('utf-16-be').hex()}> Tj ET\n".encode("ascii")
+
+    @staticmethod
+    def line(x1: float, y1: float, x2: float, y2: float) -> bytes:
+        return f"{x1:.2f} {y1:.2f} m {x2:.2f} {y2:.2f} l S\n".encode("ascii")
+
+    def write(self, path: str, pages: list[tuple[float, bytes]]) -> None:
+        font = self.add(b"<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H "
+                        b"/DescendantFonts [3 0 R] >>")
+        assert font == 1
+        self.add(b"<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 /FontBBox [-25 -254 1000 880] "
+                 b"/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 93 >>")
+        self.add(b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light "
+                 b"/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 2 >> "
+                 b"/FontDescriptor 2 0 R /DW 1000 /W [1 95 500 814 939 500] >>")
+        pages_id = len(self.objects) + 1 + 2 * len(pages)
+        kids = []
+        for height, content in pages:
+            content = b"0.5 w\n" + content
+            c = self.add(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+            kids.append(self.add(f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {PAGE_W:.0f} {height:.0f}] "
+                                 f"/Resources << /Font << /F1 1 0 R >> >> /Contents {c} 0 R >>".encode("ascii")))
+        self.add(f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>".encode("ascii"))
+        catalog = self.add(f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode("ascii"))
+        out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for i, body in enumerate(self.objects, start=1):
+            offsets.append(len(out))
+            out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+        xref = len(out)
+        out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.objects) + 1)
+        out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+        out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(self.objects) + 1, catalog, xref)
+        with open(path, "wb") as f:
+            f.write(out)
+
+
+def write_timetable_pdf(path: str, chinese: bool = False, courses_per_cell: int = 1, pages: int = 1,
+                        outside: int = 2, fill: float = 0.45, seed: int = 0) -> int:
+    """Write a synthetic timetable PDF; returns the number of courses a parser should find.
+
+    ``pages`` splits the section rows over that many pages (never inside a
+    multi-section cell), as long timetables are printed.
+    """
+    top, cells, expected = generate_layout(chinese, courses_per_cell, outside, fill, seed)
+    # Row heights: every row fits its own cells; a spanning cell stretches its last row
+    heights = {r: LINE_H + 2 * PAD for r in range(0, 14)}
+    for c in cells:
+        if c["span"] == 1:
+            heights[c["row"]] = max(heights[c["row"]], len(c["lines"]) * LINE_H + 2 * PAD)
+    for c in cells:
+        if c["span"] > 1:
+            need = len(c["lines"]) * LINE_H + 2 * PAD
+            have = sum(heights[r] for r in range(c["row"], c["row"] + c["span"]))
+            if need > have:
+                heights[c["row"] + c["span"] - 1] += need - have
+    # Page breaks at row boundaries that no cell spans
+    breakable = [r for r in range(2, 14) if not any(c["row"] < r < c["row"] + c["span"] for c in cells)]
+    breaks = sorted({min(breakable, key=lambda r: abs(r - 1 - 13 * k / pages)) for k in range(1, pages)}) if breakable else []
+    chunks = [list(range(a, b)) for a, b in zip([1] + breaks, breaks + [14])]
+    x_cols = [MARGIN]
+    for w in COL_W:
+        x_cols.append(x_cols[-1] + w)
+    full_w = x_cols[-1] - MARGIN
+    page_list = []
+    for p, rows in enumerate(chunks):
+        bands: list[tuple[str, object, float]] = []  # (kind, payload, height)
+        if p == 0:
+            bands += [("full", lines, len(lines) * LINE_H + 2 * PAD) for lines in top[:-1]]
+            bands.append(("row", 0, heights[0]))
+        bands += [("row", r, heights[r]) for r in rows]
+        if p == len(chunks) - 1:
+            bands.append(("full", top[-1], len(top[-1]) * LINE_H + 2 * PAD))
+        height = sum(h for _, _, h in bands) + 2 * MARGIN
+        content = bytearray()
+        y = height - MARGIN
+        tops: dict[int, float] = {}
+        bottoms: dict[int, float] = {}
+        content += _PdfWriter.line(MARGIN, y, MARGIN + full_w, y)
+        for kind, payload, h in bands:
+            if kind == "full":
+                for i, ln in enumerate(wrap("\n".join(payload), full_w - 2 * PAD)):
+                    content += _PdfWriter.text(MARGIN + PAD, y - PAD - (i + 1) * LINE_H + 2, ln)
+                content += _PdfWriter.line(MARGIN, y, MARGIN, y - h) + _PdfWriter.line(MARGIN + full_w, y, MARGIN + full_w, y - h)
+            else:
+                tops[payload], bottoms[payload] = y, y - h
+            y -= h
+            if kind == "full":
+                content += _PdfWriter.line(MARGIN, y, MARGIN + full_w, y)
+        # Grid: each cell draws its box; spans leave inner horizontals out
+        for c in cells:
+            r0, r1 = c["row"], c["row"] + c["span"] - 1
+            if r0 not in tops and r1 not in tops:
+                continue
+            shown = [r for r in range(r0, r1 + 1) if r in tops]
+            top_y, bot_y = tops[shown[0]], bottoms[shown[-1]]
+            x0, x1 = x_cols[c["col"]], x_cols[c["col"] + 1]
+            content += _PdfWriter.line(x0, top_y, x1, top_y) + _PdfWriter.line(x0, bot_y, x1, bot_y)
+            content += _PdfWriter.line(x0, top_y, x0, bot_y) + _PdfWriter.line(x1, top_y, x1, bot_y)
+            if shown[0] == r0:
+                for i, ln in enumerate(c["lines"]):
+                    ty = top_y - PAD - (i + 1) * LINE_H + 2
+                    if ty < bot_y:
+                        break
+                    content += _PdfWriter.text(x0 + PAD, ty, ln)
+        # Empty day cells still need their boxes
+        for r in tops:
+            for col in range(2, 9):
+                if not any(c["col"] == col and c["row"] <= r < c["row"] + c["span"] for c in cells):
+                    x0, x1 = x_cols[col], x_cols[col + 1]
+                    content += _PdfWriter.line(x0, tops[r], x1, tops[r]) + _PdfWriter.line(x0, bottoms[r], x1, bottoms[r])
+                    content += _PdfWriter.line(x0, tops[r], x0, bottoms[r]) + _PdfWriter.line(x1, tops[r], x1, bottoms[r])
+        page_list.append((height, bytes(content)))
+    _PdfWriter().write(path, page_list)
+    return expected
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Write a synthetic ZJNU timetable PDF")
+    ap.add_argument("output")
+    ap.add_argument("--cn", action="store_true", help="Chinese layout and labels")
+    ap.add_argument("--courses-per-cell", type=int, default=1)
+    ap.add_argument("--pages", type=int, default=1)
+    ap.add_argument("--outside", type=int, default=2, help="outside-course metadata lines")
+    ap.add_argument("--fill", type=float, default=0.45, help="chance that a free slot starts a course")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+    n = write_timetable_pdf(args.output, args.cn, args.courses_per_cell, args.pages, args.outside, args.fill, args.seed)
+    print(f"Wrote: {args.output} ({n} courses)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())